@@ -1,9 +1,37 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
-from PIL import Image, ImageTk
+from tkinter import ttk, messagebox, filedialog, simpledialog
+from PIL import Image, ImageOps, ImageTk
 import os
+import uuid
+import asyncio
+import io
+import gzip
+import bisect
+import unicodedata
+import itertools
+import copy
+import functools
+import logging
+import sys
+import shutil
+import time
+import queue
+import threading
 import csv
-from datetime import datetime
+import json
+import html
+import sqlite3
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from datetime import datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # NumPy がない環境では一括計算を純Pythonで行う
 
 """
 ############################################################
@@ -18,124 +46,3416 @@ from datetime import datetime
 ############################################################
 """
 
+class CsvRowIndex:
+    """CSVファイルの行オフセット索引（仮想リスト用）"""
+    PAGE_SIZE = 200
+    CACHE_PAGES = 16
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = []  # 各レコードの開始バイト位置
+        self.size = 0      # 索引済みのバイト数
+        self.pages = OrderedDict()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def reset(self):
+        self.offsets = []
+        self.size = 0
+        self.pages.clear()
+
+    def refresh(self):
+        """前回の索引位置から末尾までを走査し、追記された行だけ索引に加える"""
+        try:
+            file_size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            self.reset()
+            return
+        if file_size < self.size:
+            # ファイルが作り直された場合は索引をやり直す
+            self.reset()
+        if file_size == self.size:
+            return
+
+        # 末尾のページは追記で変わるので破棄
+        if self.offsets:
+            self.pages.pop((len(self.offsets) - 1) // self.PAGE_SIZE, None)
+
+        with open(self.path, "rb") as f:
+            f.seek(self.size)
+            pos = self.size
+            start = None
+            quoted = False
+            for line in f:
+                if start is None:
+                    start = pos
+                pos += len(line)
+                # 引用符で囲まれた改行はレコードの区切りとみなさない
+                if line.count(b'"') % 2:
+                    quoted = not quoted
+                if not quoted and line.endswith(b"\n"):
+                    self.offsets.append(start)
+                    start = None
+            # 書きかけの最終行は次回の走査に回す
+            self.size = pos if start is None else start
+
+    def rows(self, start, stop):
+        """start 行目から stop 行目の手前までを読み込む"""
+        stop = min(stop, len(self.offsets))
+        result = []
+        index = max(0, start)
+        while index < stop:
+            page_no = index // self.PAGE_SIZE
+            page = self.load_page(page_no)
+            page_start = page_no * self.PAGE_SIZE
+            result.extend(page[index - page_start:stop - page_start])
+            index = page_start + self.PAGE_SIZE
+        return result
+
+    def load_page(self, page_no):
+        if page_no in self.pages:
+            self.pages.move_to_end(page_no)
+            return self.pages[page_no]
+        first = page_no * self.PAGE_SIZE
+        last = min(first + self.PAGE_SIZE, len(self.offsets))
+        end = self.offsets[last] if last < len(self.offsets) else self.size
+        with open(self.path, "rb") as f:
+            f.seek(self.offsets[first])
+            data = f.read(end - self.offsets[first])
+        page = list(csv.reader(io.StringIO(data.decode("utf-8"), newline="")))
+        self.pages[page_no] = page
+        if len(self.pages) > self.CACHE_PAGES:
+            self.pages.popitem(last=False)
+        return page
+
+
+class VirtualTreeView:
+    """表示範囲（と少しの余白）の行だけを Treeview のアイテムとして保持する仮想リスト"""
+    MARGIN = 5
+
+    def __init__(self, parent, columns, source):
+        self.source = source
+        self.first = 0
+        self.items = []
+        self.after_render = None  # 再描画のたびに呼ぶ関数（選択の復元など）
+
+        self.scrollbar = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self.on_scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree = ttk.Treeview(parent, columns=columns, show='headings')
+        self.tree.pack(fill=tk.BOTH, expand=True)
+
+        self.tree.bind("<Configure>", lambda event: self.render())
+        self.tree.bind("<MouseWheel>", self.on_mousewheel)
+        self.tree.bind("<Button-4>", lambda event: self.scroll_by(-3))
+        self.tree.bind("<Button-5>", lambda event: self.scroll_by(3))
+        self.tree.bind("<Prior>", lambda event: self.scroll_by(-self.visible_rows()))
+        self.tree.bind("<Next>", lambda event: self.scroll_by(self.visible_rows()))
+
+    def visible_rows(self):
+        rowheight = ttk.Style().lookup('Treeview', 'rowheight') or 20
+        height = self.tree.winfo_height()
+        if height <= 1:
+            # まだ描画されていない場合は Treeview の既定行数
+            return int(self.tree.cget('height'))
+        # 見出し行の分を差し引く
+        return max(1, height // int(rowheight) - 1)
+
+    def at_end(self):
+        return self.first + self.visible_rows() >= len(self.source)
+
+    def refresh(self, follow_tail=False):
+        """ファイルの追記分を索引に加えて再描画する"""
+        keep_tail = follow_tail or self.at_end()
+        self.source.refresh()
+        if keep_tail:
+            self.first = len(self.source)
+        self.render()
+
+    def on_scroll(self, *args):
+        if args[0] == 'moveto':
+            self.first = int(float(args[1]) * len(self.source))
+            self.render()
+        elif args[0] == 'scroll':
+            amount = int(args[1])
+            if args[2] == 'pages':
+                amount *= self.visible_rows()
+            self.scroll_by(amount)
+
+    def on_mousewheel(self, event):
+        self.scroll_by(-3 if event.delta > 0 else 3)
+        return "break"
+
+    def scroll_by(self, amount):
+        self.first += amount
+        self.render()
+        return "break"
+
+    def render(self):
+        total = len(self.source)
+        visible = self.visible_rows()
+        self.first = max(0, min(self.first, total - visible))
+        rows = self.source.rows(self.first, self.first + visible + self.MARGIN)
+
+        # アイテムは作り直さずに値だけ差し替える
+        while len(self.items) < len(rows):
+            self.items.append(self.tree.insert("", "end"))
+        while len(self.items) > len(rows):
+            self.tree.delete(self.items.pop())
+        for item, row in zip(self.items, rows):
+            self.tree.item(item, values=row)
+        self.tree.yview_moveto(0)
+
+        if total:
+            self.scrollbar.set(self.first / total, min(1.0, (self.first + visible) / total))
+        else:
+            self.scrollbar.set(0, 1)
+        if self.after_render:
+            self.after_render()
+
+
+def normalize_text(text):
+    """検索用に全角・半角と大文字・小文字をそろえる"""
+    return unicodedata.normalize('NFKC', text).lower()
+
+
+def parse_code_entry(text):
+    """高速入力欄の文字列を (商品コード, 個数の増減) のリストにする
+
+    空白区切りで複数入力でき、「code」で1個、「code*3」で3個追加、「-code」で1個（「-code*3」で3個）減らす。
+    """
+    entries = []
+    for token in text.split():
+        sign = 1
+        if token.startswith("-"):
+            sign, token = -1, token[1:]
+        code, _, quantity = token.partition("*")
+        if not code:
+            raise ValueError(token)
+        entries.append((code, sign * (int(quantity) if quantity else 1)))
+    return entries
+
+
+class ProductSearchIndex:
+    """商品名の前方一致検索用の索引（正規化した名前と単語の昇順リストを bisect で引く）"""
+
+    def __init__(self, products):
+        keys = set()
+        for i, product in enumerate(products):
+            name = normalize_text(product['name'])
+            keys.add((name, i))
+            # 空白で区切られた単語と商品コードの先頭からも引けるようにする
+            for word in name.split():
+                keys.add((word, i))
+            if product.get('code'):
+                keys.add((normalize_text(product['code']), i))
+        self.keys = sorted(keys)
+
+    def search(self, prefix):
+        """名前（または名前中の単語・商品コード）が prefix で始まる商品の番号を商品順に返す"""
+        prefix = normalize_text(prefix)
+        start = bisect.bisect_left(self.keys, (prefix,))
+        found = set()
+        for key, i in itertools.islice(self.keys, start, None):
+            if not key.startswith(prefix):
+                break
+            found.add(i)
+        return sorted(found)
+
+
+class CatalogRows:
+    """カタログ表示の行ソース（絞り込んだ商品と分類の見出し行を仮想リストに渡す）"""
+
+    def __init__(self, products, counts):
+        self.products = products
+        self.counts = counts  # 現在の個数のリストを返す関数
+        self.entries = []     # ('category', 分類名) または ('product', 商品番号)
+
+    def set_filter(self, indices, group=False):
+        if group:
+            by_category = {}
+            for i in indices:
+                by_category.setdefault(self.products[i].get('category', ""), []).append(i)
+            self.entries = []
+            for category in sorted(by_category):
+                self.entries.append(('category', category))
+                self.entries.extend(('product', i) for i in by_category[category])
+        else:
+            self.entries = [('product', i) for i in indices]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def refresh(self):
+        pass
+
+    def rows(self, start, stop):
+        counts = self.counts()
+        rows = []
+        for kind, value in self.entries[max(0, start):stop]:
+            if kind == 'category':
+                rows.append([f"【{value or '未分類'}】", "", "", ""])
+            else:
+                product = self.products[value]
+                rows.append([product['name'], product['price'], counts[value], product.get('category', "")])
+        return rows
+
+    def product_at(self, position):
+        if 0 <= position < len(self.entries) and self.entries[position][0] == 'product':
+            return self.entries[position][1]
+        return None
+
+
+class SalesLedger:
+    """SQLite（WALモード）による販売台帳（read_only なら既存の台帳を読むだけで何も書き込まない）
+
+    販売履歴とアンケート結果の date / time はCSVと同じ年のない %m-%d / %H:%M なので、
+    年を含む記録日時を recorded 列に持ち、date / time はそこから作る。
+    """
+    LOG_FILES = {
+        'sales': "log.csv",
+        'surveys': "survey_log.csv",
+        'management_log': "management_log.csv",
+        'qualification_log': "qualification_log.csv",
+    }
+    DATED_TABLES = ('sales', 'surveys')  # 記録日時（recorded）を持つテーブル
+
+    def __init__(self, path="ledger.db", read_only=False):
+        self.path = path
+        if read_only:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        else:
+            self.conn = sqlite3.connect(path)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.create_tables()
+        # 読むだけで開いた以前の台帳には記録日時の列がない
+        self.dated = 'recorded' in self.table_columns('sales')
+
+    def create_tables(self):
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS sales (
+                    id INTEGER PRIMARY KEY, date TEXT, time TEXT, name TEXT,
+                    qualification TEXT, total INTEGER, products TEXT, recorded TEXT);
+                CREATE TABLE IF NOT EXISTS surveys (
+                    id INTEGER PRIMARY KEY, sale_id INTEGER REFERENCES sales(id),
+                    date TEXT, time TEXT, name TEXT, qualification TEXT,
+                    survey TEXT, remarks TEXT, recorded TEXT);
+                CREATE TABLE IF NOT EXISTS management_log (
+                    id INTEGER PRIMARY KEY, date TEXT, time TEXT, entries TEXT);
+                CREATE TABLE IF NOT EXISTS qualification_log (
+                    id INTEGER PRIMARY KEY, date TEXT, time TEXT, entries TEXT);
+                CREATE INDEX IF NOT EXISTS sales_date ON sales(date);
+                CREATE INDEX IF NOT EXISTS sales_name ON sales(name);
+                CREATE INDEX IF NOT EXISTS sales_qualification ON sales(qualification);
+                CREATE INDEX IF NOT EXISTS surveys_date ON surveys(date);
+                CREATE INDEX IF NOT EXISTS surveys_name ON surveys(name);
+                CREATE INDEX IF NOT EXISTS surveys_qualification ON surveys(qualification);
+                CREATE INDEX IF NOT EXISTS surveys_sale ON surveys(sale_id);
+            """)
+        self.add_recorded_columns()
+
+    def table_columns(self, table):
+        return {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+
+    def add_recorded_columns(self):
+        """以前の台帳に記録日時の列を加える（年は新しい行から順に遡りながら、1つ後の行の日時に最も近い年にする）"""
+        for table in self.DATED_TABLES:
+            if 'recorded' in self.table_columns(table):
+                continue
+            with self.conn:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN recorded TEXT")
+                started = datetime.now()
+                updates = []
+                for row_id, date_str, time_str in self.conn.execute(
+                        f"SELECT id, date, time FROM {table} ORDER BY id DESC").fetchall():
+                    try:
+                        started = row_datetime(date_str, time_str, started)
+                    except (AttributeError, ValueError):
+                        pass
+                    updates.append((started.isoformat(timespec='seconds'), row_id))
+                self.conn.executemany(f"UPDATE {table} SET recorded = ? WHERE id = ?", updates)
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def dated_entry(entry, recorded=None):
+        """(記録日時, 行) を返す（記録日時があれば行の日付・時刻はそこから作り、なければ行の日付の直近の日時とする）"""
+        entry = list(entry)
+        if recorded is None:
+            try:
+                recorded = row_datetime(entry[0], entry[1], datetime.now())
+            except (IndexError, ValueError):
+                return None, entry
+            return recorded, entry
+        return recorded, [recorded.strftime('%m-%d'), recorded.strftime('%H:%M')] + entry[2:]
+
+    def insert_sale(self, log_entry, recorded=None):
+        recorded, log_entry = self.dated_entry(log_entry, recorded)
+        date_str, time_str, name, qualification, total = log_entry[:5]
+        cursor = self.conn.execute(
+            "INSERT INTO sales (date, time, name, qualification, total, products, recorded) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (date_str, time_str, name, qualification, int(total), json.dumps([int(c) for c in log_entry[5:]]),
+             recorded and recorded.isoformat(timespec='seconds')))
+        return cursor.lastrowid
+
+    def insert_survey(self, survey_entry, sale_id, recorded=None):
+        recorded, survey_entry = self.dated_entry(survey_entry, recorded)
+        row = (survey_entry + [""] * 6)[:6]
+        self.conn.execute(
+            "INSERT INTO surveys (sale_id, date, time, name, qualification, survey, remarks, recorded) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [sale_id] + row + [recorded and recorded.isoformat(timespec='seconds')])
+
+    def unpaired_sale_id(self, survey_entry):
+        """アンケート結果と日付・時刻・名前・資格が同じで、まだアンケート結果のない最初の販売の id"""
+        row = self.conn.execute(
+            "SELECT id FROM sales WHERE date = ? AND time = ? AND name = ? AND qualification = ? "
+            "AND NOT EXISTS (SELECT 1 FROM surveys WHERE surveys.sale_id = sales.id) ORDER BY id LIMIT 1",
+            (list(survey_entry) + [""] * 4)[:4]).fetchone()
+        return row[0] if row else None
+
+    def insert_change(self, table, log_entry):
+        self.conn.execute(
+            f"INSERT INTO {table} (date, time, entries) VALUES (?, ?, ?)",
+            (log_entry[0], log_entry[1], json.dumps(list(log_entry[2:]), ensure_ascii=False)))
+
+    def record_sale(self, log_entry, survey_entry, recorded=None):
+        """販売とアンケート結果を1つのトランザクションで記録（recorded は販売した日時）"""
+        with self.conn:
+            sale_id = self.insert_sale(log_entry, recorded)
+            self.insert_survey(survey_entry, sale_id, recorded)
+        return sale_id
+
+    def record_change(self, table, log_entry):
+        """商品・資格の変更履歴を記録"""
+        with self.conn:
+            self.insert_change(table, log_entry)
+
+    def row_to_entry(self, table, row):
+        if table == 'sales':
+            return list(row[:5]) + json.loads(row[5])
+        if table == 'surveys':
+            return list(row)
+        return list(row[:2]) + json.loads(row[2])
+
+    def columns(self, table):
+        if table == 'sales':
+            return "date, time, name, qualification, total, products"
+        if table == 'surveys':
+            return "date, time, name, qualification, survey, remarks"
+        return "date, time, entries"
+
+    def count(self, table):
+        return self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def iter_rows(self, table):
+        """CSVと同じ並びの行を古い順に返す"""
+        for row in self.conn.execute(f"SELECT {self.columns(table)} FROM {table} ORDER BY id"):
+            yield self.row_to_entry(table, row)
+
+    def iter_rows_with_start(self, table):
+        """販売履歴・アンケート結果を (記録日時, 行) の組で古い順に返す（LogSegments.iter_rows_with_start と同じ形）"""
+        started = datetime.now()
+        if not self.dated:
+            # 記録日時の列がない以前の台帳は、今日から遡って直近1年の販売とみなす
+            yield from ((started, row) for row in self.iter_rows(table))
+            return
+        for row in self.conn.execute(f"SELECT recorded, {self.columns(table)} FROM {table} ORDER BY id"):
+            if row[0]:
+                started = datetime.fromisoformat(row[0])
+            yield started, self.row_to_entry(table, row[1:])
+
+    def rows(self, table, start, stop):
+        # id は1から連番で振られるため範囲指定で取得できる
+        cursor = self.conn.execute(
+            f"SELECT {self.columns(table)} FROM {table} WHERE id > ? AND id <= ? ORDER BY id",
+            (start, stop))
+        return [self.row_to_entry(table, row) for row in cursor]
+
+    def iter_id_range(self, table, start, stop):
+        """id が start より大きく stop 以下の行を古い順に1行ずつ返す（レポートの並列集計用）"""
+        cursor = self.conn.execute(
+            f"SELECT {self.columns(table)} FROM {table} WHERE id > ? AND id <= ? ORDER BY id", (start, stop))
+        for row in cursor:
+            yield self.row_to_entry(table, row)
+
+    def meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def max_id(self, table):
+        return self.conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+
+    def recorded_range(self, table, start, stop):
+        """id が start より大きく stop 以下の行の、最初と最後の行の記録日時（なければ None）"""
+        def recorded(order):
+            row = self.conn.execute(
+                f"SELECT recorded FROM {table} WHERE id > ? AND id <= ? ORDER BY id {order} LIMIT 1",
+                (start, stop)).fetchone()
+            return datetime.fromisoformat(row[0]) if row and row[0] else None
+        return recorded("ASC"), recorded("DESC")
+
+    def needs_csv_export(self):
+        """CSVにまだ書き出していない行があるか
+
+        CSVで記録している間は、この場合だけ sync_csv を呼べばよい（CSVに増えた行は次にSQLiteで
+        開いたときに csv_rows の位置から取り込まれるので、起動のたびにCSVを数えなくてよい）。
+        """
+        if self.meta('csv_imported') and self.meta('csv_rows:sales') is None:
+            return True
+        return any(self.max_id(table) > int(self.meta(f'ledger_id:{table}', 0)) for table in self.LOG_FILES)
+
+    def sync_csv(self, directory=".", segments=None):
+        """CSVログと台帳の差分を互いに反映する（保存形式を切り替えたときに呼ぶ）
+
+        meta には台帳に取り込み済みのCSVの行数（csv_rows:テーブル名）と、CSVに書き出し済みの
+        台帳の id（ledger_id:テーブル名）を記録する。CSVに増えた行を台帳へ取り込み、台帳に増えた行を
+        CSVの末尾へ書き出すので、どちらの保存形式で記録した販売も失われない。
+        segments を渡すと販売履歴とアンケート結果は閉じたセグメントも含めて数える。
+        書き込みスレッドが止まっている間に呼ぶ。取り込み・書き出しした行数の合計を返す。
+        """
+        csv_tables = {name: key for key, name in LogSegments.FILES.items()}
+
+        def paths(table):
+            filename = self.LOG_FILES[table]
+            if segments and filename in csv_tables:
+                return segments, csv_tables[filename], segments.active_path(csv_tables[filename])
+            return None, None, os.path.join(directory, filename)
+
+        def read_from(table, start):
+            """start 行目以降を (記録日時, 行) の組で返す（記録日時がわからなければ None）"""
+            source, key, path = paths(table)
+            if source:
+                return [(started, row) for started, row in source.iter_rows_with_start(key, start) if row]
+            try:
+                with open(path, "r", newline="", encoding="utf-8") as f:
+                    return [(None, row) for row in itertools.islice(csv.reader(f), start, None) if row]
+            except FileNotFoundError:
+                return []
+
+        def count_rows(table):
+            source, key, path = paths(table)
+            if source:
+                return source.count_rows(key)
+            try:
+                with open(path, "r", newline="", encoding="utf-8") as f:
+                    return sum(1 for _ in csv.reader(f))
+            except FileNotFoundError:
+                return 0
+
+        changed = 0
+        with self.conn:
+            if self.meta('csv_imported') and self.meta('csv_rows:sales') is None:
+                # 以前のバージョンは1度だけ取り込んでいたので、今のCSVまでは反映済みとみなす
+                for table in self.LOG_FILES:
+                    rows = min(count_rows(table), self.max_id(table))
+                    self.set_meta(f'csv_rows:{table}', rows)
+                    self.set_meta(f'ledger_id:{table}', rows)
+            imported = {}
+            for table in self.LOG_FILES:
+                start = int(self.meta(f'csv_rows:{table}', 0))
+                rows = read_from(table, start)
+                ids = []
+                for recorded, row in rows:
+                    if table == 'sales':
+                        ids.append(self.insert_sale(row, recorded))
+                        continue
+                    if table == 'surveys':
+                        # 片方だけ書き込めなかった行もあるので、行の位置ではなく日時・名前・資格で販売と結びつける
+                        recorded, row = self.dated_entry(row, recorded)
+                        self.insert_survey(row, self.unpaired_sale_id(row), recorded)
+                    else:
+                        self.insert_change(table, row)
+                    ids.append(self.max_id(table))
+                imported[table] = set(ids)
+                changed += len(rows)
+            for table in self.LOG_FILES:
+                last_id = int(self.meta(f'ledger_id:{table}', 0))
+                cursor = self.conn.execute(
+                    f"SELECT id, {self.columns(table)} FROM {table} WHERE id > ? ORDER BY id", (last_id,))
+                rows = [self.row_to_entry(table, row[1:]) for row in cursor if row[0] not in imported[table]]
+                if rows:
+                    append_csv_rows(paths(table)[2], rows)
+                    changed += len(rows)
+                self.set_meta(f'csv_rows:{table}', count_rows(table))
+                self.set_meta(f'ledger_id:{table}', self.max_id(table))
+        return changed
+
+    def recent_sales(self, count):
+        """最近の販売を新しい順に (販売履歴の行, アンケート結果の行) で返す（sale_id で結合）"""
+        cursor = self.conn.execute(
+            "SELECT sales.date, sales.time, sales.name, sales.qualification, sales.total, sales.products, "
+            "surveys.date, surveys.time, surveys.name, surveys.qualification, surveys.survey, surveys.remarks "
+            "FROM sales JOIN surveys ON surveys.sale_id = sales.id ORDER BY sales.id DESC LIMIT ?", (count,))
+        return [(self.row_to_entry('sales', row[:6]), list(row[6:])) for row in cursor]
+
+    def export_csv(self, directory="."):
+        """互換性のためにCSVログとして書き出す"""
+        for table, filename in self.LOG_FILES.items():
+            with open(os.path.join(directory, filename), "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                for row in self.iter_rows(table):
+                    writer.writerow(row)
+
+    def row_source(self, table):
+        return LedgerRows(self, table)
+
+    def iter_rows_snapshot(self, table, count):
+        """別スレッドから読むための専用の接続で、先頭 count 行を返す"""
+        conn = sqlite3.connect(self.path)
+        try:
+            cursor = conn.execute(
+                f"SELECT {self.columns(table)} FROM {table} WHERE id <= ? ORDER BY id", (count,))
+            for row in cursor:
+                yield self.row_to_entry(table, row)
+        finally:
+            conn.close()
+
+
+class LedgerRows:
+    """販売台帳のテーブルを仮想リストの行ソースとして扱う"""
+
+    def __init__(self, ledger, table):
+        self.ledger = ledger
+        self.table = table
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def refresh(self):
+        self.length = self.ledger.count(self.table)
+
+    def rows(self, start, stop):
+        return self.ledger.rows(self.table, max(0, start), min(stop, self.length))
+
+
+class ThumbnailCache:
+    """商品画像のサムネイルキャッシュ（メモリ上のLRUとディスク上の縮小画像）"""
+    SCALES = (1, 2, 3)
+    BASE_SIZE = 20
+    MAX_PHOTOS = 256
+
+    def __init__(self, cache_dir=os.path.join("images", ".thumbs")):
+        self.cache_dir = cache_dir
+        self.photos = OrderedDict()  # (path, mtime, scale) -> PhotoImage
+
+    def get(self, image_path, scale):
+        """画像の PhotoImage を返す（画像がない場合は None）"""
+        try:
+            mtime = os.stat(image_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        key = (image_path, mtime, scale)
+        if key in self.photos:
+            self.photos.move_to_end(key)
+            return self.photos[key]
+
+        thumb_path = self.thumb_path(image_path, mtime, scale)
+        if os.path.exists(thumb_path):
+            image = Image.open(thumb_path)
+        else:
+            image = self.render(image_path, mtime)[scale]
+        photo = ImageTk.PhotoImage(image)
+        self.photos[key] = photo
+        if len(self.photos) > self.MAX_PHOTOS:
+            self.photos.popitem(last=False)
+        return photo
+
+    def thumb_path(self, image_path, mtime, scale):
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        return os.path.join(self.cache_dir, f"{stem}_{mtime}_x{scale}.png")
+
+    def render(self, image_path, mtime):
+        """元画像を1度だけデコードして x1/x2/x3 の縮小画像をまとめて作成"""
+        largest = self.BASE_SIZE * max(self.SCALES)
+        image = Image.open(image_path)
+        # JPEG などは縮小デコードで読み込む
+        image.draft(image.mode, (largest, largest))
+        image.load()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.remove_stale(image_path, mtime)
+        thumbs = {}
+        for scale in self.SCALES:
+            size = self.BASE_SIZE * scale
+            # 大きな画像は reduce で粗く縮めてから LANCZOS で仕上げる
+            thumb = image.resize((size, size), Image.LANCZOS, reducing_gap=3.0)
+            thumb.save(self.thumb_path(image_path, mtime, scale))
+            thumbs[scale] = thumb
+        return thumbs
+
+    def remove_stale(self, image_path, mtime):
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        for filename in os.listdir(self.cache_dir):
+            if filename.startswith(f"{stem}_") and not filename.startswith(f"{stem}_{mtime}_"):
+                os.remove(os.path.join(self.cache_dir, filename))
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp", ".tif", ".tiff")
+NORMALIZED_IMAGE_SIZE = 240  # images/ に保存する商品画像の最大の一辺（表示は最大で x3 の60ピクセル）
+
+
+def product_image_path(index, image_dir="images"):
+    return os.path.join(image_dir, f"image{index+1}.png")
+
+
+def normalize_product_image(source, image_path, size=NORMALIZED_IMAGE_SIZE):
+    """画像の中央を正方形に切り抜いて縮小したPNGとして保存し、x1/x2/x3 の縮小画像も作る（Tkに依存しない）"""
+    image = Image.open(source)
+    # JPEG などは縮小デコードで読み込む
+    image.draft(image.mode, (size, size))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+    side = min(size, *image.size)
+    image = ImageOps.fit(image, (side, side), Image.LANCZOS)
+
+    os.makedirs(os.path.dirname(image_path) or ".", exist_ok=True)
+    tmp_path = image_path + ".tmp"
+    image.save(tmp_path, format="PNG")
+    os.replace(tmp_path, image_path)
+    ThumbnailCache(os.path.join(os.path.dirname(image_path), ".thumbs")).render(
+        image_path, os.stat(image_path).st_mtime_ns)
+
+
+def ingest_product_image(job):
+    """1枚の画像を取り込み、(商品の番号, エラー) を返す（別プロセスで実行される）"""
+    index, source, image_path = job
+    try:
+        normalize_product_image(source, image_path)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        return index, f"{os.path.basename(source)}: {e}"
+    return index, None
+
+
+def ingest_product_images(jobs, workers=None):
+    """画像の取り込みをプロセスプールで並列に行い、終わった順に (商品の番号, エラー) を返す"""
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        yield from map(ingest_product_image, jobs)
+        return
+    # GUIのスレッドから呼ばれても安全なように、fork ではなく新しいプロセスで実行する
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(ingest_product_image, job) for job in jobs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def match_product_images(directory, products):
+    """フォルダ内の画像と商品の対応を {商品の番号: 画像のパス} で返す
+
+    mapping.csv（ファイル名, 商品名または商品コード）があればそれに従い、なければ拡張子を除いた
+    ファイル名が商品名・商品コード・image{番号} のいずれかと一致する画像を対応付ける。
+    """
+    keys = {}
+    for i, product in enumerate(products):
+        keys[normalize_text(f"image{i+1}")] = i
+        keys[normalize_text(product['name'])] = i
+        if product.get('code'):
+            keys[normalize_text(product['code'])] = i
+
+    mapping_path = os.path.join(directory, "mapping.csv")
+    if os.path.exists(mapping_path):
+        with open(mapping_path, "r", newline="", encoding="utf-8-sig") as f:
+            pairs = [(row[0], row[1]) for row in csv.reader(f) if len(row) >= 2]
+    else:
+        pairs = [(filename, os.path.splitext(filename)[0]) for filename in sorted(os.listdir(directory))
+                 if filename.lower().endswith(IMAGE_EXTENSIONS)]
+
+    matches = {}
+    for filename, target in pairs:
+        index = keys.get(normalize_text(target.strip()))
+        path = os.path.join(directory, filename.strip())
+        if index is not None and os.path.isfile(path):
+            matches[index] = path
+    return matches
+
+
+class PricingEngine:
+    """商品価格と資格割引を整数配列・辞書に変換した価格計算（Tkに依存しない）"""
+
+    def __init__(self, products, qualifications):
+        self.names = [product['name'] for product in products]
+        self.prices = [int(product['price']) for product in products]
+        self.discount_rates = {q['name']: int(q['discount']) for q in qualifications}
+        self.price_array = np.array(self.prices, dtype=np.int64) if np is not None else None
+
+    def discount_rate(self, qualification):
+        return self.discount_rates.get(qualification, 0)
+
+    def price(self, counts, qualification):
+        """1件の会計の (合計金額, 割引額, 請求額) を返す"""
+        total = sum(count * price for count, price in zip(counts, self.prices))
+        rate = self.discount_rate(qualification)
+        # 浮動小数点の誤差が出ないように整数で計算（端数は切り捨て）
+        return total, total * rate // 100, total * (100 - rate) // 100
+
+    def price_batch(self, counts_list, qualifications):
+        """複数の会計をまとめて計算し、(合計金額, 割引額, 請求額) の配列を返す"""
+        if np is None:
+            results = [self.price(counts, q) for counts, q in zip(counts_list, qualifications)]
+            return tuple(list(column) for column in zip(*results)) if results else ([], [], [])
+
+        counts = np.zeros((len(counts_list), len(self.prices)), dtype=np.int64)
+        for i, row in enumerate(counts_list):
+            row = row[:len(self.prices)]
+            counts[i, :len(row)] = row
+        totals = counts @ self.price_array
+
+        # 資格名は種類が少ないので名前ごとに割引率を引いてから展開する
+        names, inverse = np.unique(np.asarray(qualifications, dtype=object).astype(str), return_inverse=True)
+        rates = np.array([self.discount_rate(name) for name in names], dtype=np.int64)[inverse]
+        return totals, totals * rates // 100, totals * (100 - rates) // 100
+
+    def reprice_log(self, log_rows):
+        """履歴の行（log.csv の並び）をこの価格表で計算し直す"""
+        counts_list, qualifications = [], []
+        for row in log_rows:
+            counts_list.append([int(count or 0) for count in row[5:5 + len(self.prices)]])
+            qualifications.append(row[3])
+        return self.price_batch(counts_list, qualifications)
+
+
+class CatalogHistory:
+    """商品・資格の変更履歴から、ある時刻に有効だった価格表と割引率を引く
+
+    management_log.csv / qualification_log.csv の各行は変更後の一覧（"名前:価格" / "名前:割引率%"）なので、
+    変更時刻の配列を bisect で探せば O(log n) でその時刻の版がわかる。最初の変更より前の販売には
+    最も古い版を使い、変更履歴がない場合は現在の設定を使う。
+    """
+
+    def __init__(self, products, qualifications, management_rows=(), qualification_rows=()):
+        self.products = products
+        self.qualifications = qualifications
+        self.versions = {'products': ([], []), 'qualifications': ([], [])}  # 種類 -> (変更時刻, 版)
+        self.engines = {}  # (商品の版, 資格の版) -> PricingEngine
+        for kind, rows in (('products', management_rows), ('qualifications', qualification_rows)):
+            for row in rows:
+                parsed = self.parse_row(row, kind)
+                if parsed:
+                    self.add_version(kind, *parsed)
+
+    @staticmethod
+    def parse_row(row, kind):
+        """変更履歴の1行を (変更時刻, 版) にする（読めない行は None）"""
+        try:
+            timestamp = datetime.strptime(f"{row[0]} {row[1]}", '%y-%m-%d %H:%M:%S').timestamp()
+        except (IndexError, ValueError):
+            return None
+        key = 'price' if kind == 'products' else 'discount'
+        version = []
+        for entry in row[2:]:
+            name, _, value = entry.rpartition(":")
+            value = value.rstrip("%")
+            if not name or not value.isdigit():
+                return None
+            version.append({'name': name, key: value})
+        return timestamp, version
+
+    def add_version(self, kind, timestamp, version):
+        """変更を1件加える（通常は最後に追加されるが、時刻の順に挿入する）"""
+        times, versions = self.versions[kind]
+        i = bisect.bisect_right(times, timestamp)
+        times.insert(i, timestamp)
+        versions.insert(i, version)
+        self.engines.clear()
+
+    def set_current(self, products, qualifications):
+        """変更履歴がない場合に使う現在の設定"""
+        self.products = products
+        self.qualifications = qualifications
+        self.engines.clear()
+
+    def version_at(self, kind, timestamp):
+        times, versions = self.versions[kind]
+        if not times:
+            return -1, None
+        i = max(0, bisect.bisect_right(times, timestamp) - 1)
+        return i, versions[i]
+
+    def pricing_at(self, timestamp):
+        """時刻 timestamp に有効だった価格表の PricingEngine を返す"""
+        product_index, products = self.version_at('products', timestamp)
+        qualification_index, qualifications = self.version_at('qualifications', timestamp)
+        key = (product_index, qualification_index)
+        engine = self.engines.get(key)
+        if engine is None:
+            # 商品数の変更だけで記録されていない商品は、現在の同じ位置の商品とみなす
+            products = (products or []) + self.products[len(products or []):]
+            engine = self.engines[key] = PricingEngine(products, qualifications or self.qualifications)
+        return engine
+
+    def pricing_for_sale(self, row, counts, timestamp):
+        """販売の行（分単位の時刻 timestamp）の価格表を返す
+
+        販売の時刻は分までしか記録されていないので、その1分の間に変更があった場合は
+        記録された請求額と一致する方の版を選ぶ。
+        """
+        before, after = self.pricing_at(timestamp), self.pricing_at(timestamp + 59)
+        if before is after or after.price(counts, row[3])[2] == int(row[4]):
+            return after
+        return before
+
+    def reprice_log(self, timed_rows):
+        """(分単位の時刻, 履歴の行) の並びをそれぞれの時刻の価格表で計算し直す（版ごとにまとめて計算する）"""
+        groups = {}
+        for i, (timestamp, row) in enumerate(timed_rows):
+            counts = [int(count or 0) for count in row[5:]]
+            engine = self.pricing_for_sale(row, counts, timestamp)
+            group = groups.setdefault(id(engine), (engine, [], [], []))
+            group[1].append(i)
+            group[2].append(counts[:len(engine.prices)])
+            group[3].append(row[3])
+        size = sum(len(group[1]) for group in groups.values())
+        results = ([0] * size, [0] * size, [0] * size)
+        for engine, indices, counts_list, qualifications in groups.values():
+            for column, values in zip(results, engine.price_batch(counts_list, qualifications)):
+                for i, value in zip(indices, values):
+                    column[i] = int(value)
+        return results
+
+
+def load_catalog_history(products, qualifications, ledger=None, directory="."):
+    """商品・資格の変更履歴（CSVまたはSQLite台帳）を読み込む"""
+    def read_rows(table):
+        if ledger:
+            return ledger.iter_rows(table)
+        try:
+            with open(os.path.join(directory, SalesLedger.LOG_FILES[table]), "r", newline="", encoding="utf-8") as f:
+                return list(csv.reader(f))
+        except FileNotFoundError:
+            return []
+
+    return CatalogHistory(products, qualifications, read_rows('management_log'), read_rows('qualification_log'))
+
+
+class Cart:
+    """レジで選んでいる商品の個数（増減のたびに合計金額を差分で更新するので、商品数によらず O(1)）"""
+
+    def __init__(self, prices):
+        self.prices = list(prices)
+        self.counts = [0] * len(self.prices)
+        self.subtotal = 0
+        self.nonzero = set()  # 個数が0でない商品（クリアでこれだけを戻す）
+
+    def set(self, index, count):
+        count = max(0, count)
+        self.subtotal += (count - self.counts[index]) * self.prices[index]
+        self.counts[index] = count
+        if count:
+            self.nonzero.add(index)
+        else:
+            self.nonzero.discard(index)
+        return count
+
+    def add(self, index, delta):
+        return self.set(index, self.counts[index] + delta)
+
+    def clear(self):
+        """すべて0個にして、個数が変わった商品の番号を返す"""
+        changed = self.nonzero
+        for index in changed:
+            self.counts[index] = 0
+        self.nonzero = set()
+        self.subtotal = 0
+        return changed
+
+    def load(self, counts):
+        """個数をまとめて置き換える（足りない分は0個）"""
+        counts = [max(0, int(count or 0)) for count in counts[:len(self.prices)]]
+        self.counts[:] = counts + [0] * (len(self.prices) - len(counts))
+        self.recompute()
+
+    def set_prices(self, prices):
+        """商品リストが変わったときに価格を差し替える（商品数の増減に合わせて個数も伸び縮みさせる）"""
+        self.prices = list(prices)
+        self.counts[:] = (self.counts + [0] * len(self.prices))[:len(self.prices)]
+        self.recompute()
+
+    def recompute(self):
+        self.subtotal = sum(count * price for count, price in zip(self.counts, self.prices))
+        self.nonzero = {i for i, count in enumerate(self.counts) if count}
+
+    def totals(self, rate):
+        """(合計金額, 割引額, 請求額) を PricingEngine.price と同じ整数計算で返す"""
+        return self.subtotal, self.subtotal * rate // 100, self.subtotal * (100 - rate) // 100
+
+
+class ConfigStore:
+    """設定をまとめて保持する settings.json（起動時に1度だけ読み込み、一時ファイルと rename で書き込む）
+
+    read_only なら settings.json がなくても作らず、以前の設定ファイルを読むだけにする（レポートなど）。
+    """
+    VERSION = 1
+    DEFAULTS = {
+        'product_count': 6,
+        'survey_count': 3,
+        'qualification_count': 3,
+        'question_responses': ["未回答", "回答1", "回答2"],
+        'image_scale': 1,
+        'products': None,  # None の場合は商品数から初期値を作る
+        'qualifications': None,
+        'shop_name': "",
+        'persistent_text': "",
+        'list_mode': "full",
+        'storage_mode': "csv",
+        'write_policy': ["interval", 200],  # always / interval / idle とミリ秒（always 以外は落ちると直前の販売が失われうる）
+        'segment_mode': "day",
+        'register_layout': "rows",  # rows: 商品ごとの行, catalog: 検索できる一覧（商品が多い場合）
+        'next_product_id': 1,       # 商品ID（列ストアの列の鍵）の次の番号
+        'register_id': "",          # 空の場合は初回起動時に作る
+        'sync_server': "",          # 同期サーバーの host:port（空なら1台で使う）
+        'sync_catalog_revision': 0,
+    }
+
+    def __init__(self, path="settings.json", after=None, debounce_ms=300, read_only=False):
+        self.path = path
+        self.after = after  # root.after を渡すと保存をまとめて遅延させる
+        self.debounce_ms = debounce_ms
+        self.read_only = read_only
+        self.revision = 0
+        self.dirty = False
+        self.scheduled = False
+        self.data = copy.deepcopy(self.DEFAULTS)
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            # 初回は以前のバージョンの設定ファイルを取り込む
+            self.data.update(read_legacy_settings(os.path.dirname(self.path) or "."))
+            self.dirty = True
+            self.flush()
+            return
+        self.revision = stored.get('revision', 0)
+        self.data.update(self.migrate(stored.get('version', 0), stored.get('settings', {})))
+
+    def migrate(self, version, settings):
+        """古い形式の設定を現在の形式に変換する"""
+        if version > self.VERSION:
+            raise ValueError(f"{self.path} は新しいバージョンの設定です（version {version}）")
+        return settings
+
+    def get(self, key):
+        return copy.deepcopy(self.data[key])
+
+    def set(self, key, value):
+        if self.data.get(key) == value:
+            return
+        self.data[key] = copy.deepcopy(value)
+        self.dirty = True
+        if self.after is None:
+            self.flush()
+        elif not self.scheduled:
+            self.scheduled = True
+            self.after(self.debounce_ms, self.flush)
+
+    def flush(self):
+        """変更があれば settings.json に書き込む"""
+        self.scheduled = False
+        if not self.dirty or self.read_only:
+            return
+        self.revision += 1
+        stored = {'version': self.VERSION, 'revision': self.revision, 'settings': self.data}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(stored, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        # 書き込み途中で止まっても元の settings.json は壊れない
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+def read_legacy_settings(directory="."):
+    """以前のバージョンの個別の設定ファイルを読み込む（存在するものだけ）"""
+    def read_text(filename):
+        with open(os.path.join(directory, filename), "r", encoding="utf-8") as f:
+            return f.read().strip()
+
+    def read_rows(filename):
+        with open(os.path.join(directory, filename), "r", newline="", encoding="utf-8") as f:
+            return list(csv.reader(f))
+
+    def read_dicts(filename):
+        with open(os.path.join(directory, filename), "r", newline="", encoding="utf-8") as f:
+            return [dict(row) for row in csv.DictReader(f)]
+
+    readers = {
+        'product_count': lambda: int(read_rows("product_count.csv")[0][0]),
+        'survey_count': lambda: int(read_rows("survey_count.csv")[0][0]),
+        'qualification_count': lambda: int(read_rows("qualification_count.csv")[0][0]),
+        'question_responses': lambda: [row[0] for row in read_rows("question_responses.csv")],
+        'image_scale': lambda: int(read_text("image_scale.txt")),
+        'products': lambda: read_dicts("products.csv"),
+        'qualifications': lambda: read_dicts("qualifications.csv"),
+        'shop_name': lambda: read_text("shop_name.txt"),
+        'persistent_text': lambda: read_text("persistent_text.txt"),
+        'list_mode': lambda: read_text("list_mode.txt"),
+        'storage_mode': lambda: read_text("storage_mode.txt"),
+        # 間隔のない write_policy.csv は以前のバージョンと同じく 200 ミリ秒とする
+        'write_policy': lambda: [read_rows("write_policy.csv")[0][0], int((read_rows("write_policy.csv")[0] + [200])[1])],
+    }
+    settings = {}
+    for key, reader in readers.items():
+        try:
+            settings[key] = reader()
+        except (FileNotFoundError, IndexError, ValueError):
+            pass
+    return settings
+
+
+class SalesAggregates:
+    """イベント中の販売集計（1件ごとに差分で更新し、スナップショットとして保存する）"""
+
+    def __init__(self, path="aggregates.json", after=None, debounce_ms=1000):
+        self.path = path
+        self.after = after
+        self.debounce_ms = debounce_ms
+        self.dirty = False
+        self.scheduled = False
+        self.needs_rebuild = False
+        self.reset()
+        self.load()
+
+    def reset(self):
+        """新しいイベントとして集計を0からやり直す"""
+        self.data = {
+            'event_started': datetime.now().isoformat(timespec='seconds'),
+            'sales': 0,
+            'gross': 0,      # 割引前の合計金額
+            'discount': 0,
+            'revenue': 0,    # 請求額の合計
+            'products': {},        # 商品名 -> [個数, 売上]
+            'qualifications': {},  # 資格名 -> [件数, 請求額, 割引額]
+            'hours': {},           # "月-日 時" -> [件数, 請求額]
+        }
+        self.dirty = True
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data.update(json.load(f))
+            self.dirty = False
+        except FileNotFoundError:
+            # スナップショットがない場合は履歴から1度だけ集計する
+            self.needs_rebuild = True
+
+    def add_sale(self, date_str, time_str, qualification, items, gross, discount, final_total):
+        """1件の販売を集計に加える（items は (商品名, 個数, 金額) の並び）"""
+        data = self.data
+        data['sales'] += 1
+        data['gross'] += gross
+        data['discount'] += discount
+        data['revenue'] += final_total
+        for name, units, amount in items:
+            if units:
+                product = data['products'].setdefault(name, [0, 0])
+                product[0] += units
+                product[1] += amount
+        stats = data['qualifications'].setdefault(qualification, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += final_total
+        stats[2] += discount
+        hour = data['hours'].setdefault(f"{date_str} {time_str[:2]}時", [0, 0])
+        hour[0] += 1
+        hour[1] += final_total
+        self.schedule_save()
+
+    def event_dates(self):
+        """イベント開始日から今日までの日付（履歴の %m-%d 形式）"""
+        day = datetime.fromisoformat(self.data['event_started']).date()
+        today = datetime.now().date()
+        dates = set()
+        while day <= today:
+            dates.add(day.strftime('%m-%d'))
+            day += timedelta(days=1)
+        return dates
+
+    def rebuild(self, log_rows, pricing, history=None):
+        """イベント期間中の履歴から集計を作り直す（history があれば販売した時刻の価格表を使う）"""
+        event_started = self.data['event_started']
+        self.reset()
+        self.data['event_started'] = event_started
+        dates = self.event_dates()
+        started = datetime.fromisoformat(event_started)
+        for row in log_rows:
+            if len(row) < 5 or row[0] not in dates:
+                continue
+            counts = [int(count or 0) for count in row[5:]]
+            row_pricing = pricing
+            if history is not None:
+                # イベント期間中の行なので、年はイベント開始日時から補う
+                try:
+                    timestamp = row_datetime(row[0], row[1], started).timestamp()
+                except ValueError:
+                    pass  # 時刻が読めない行は現在の価格表で計算する
+                else:
+                    row_pricing = history.pricing_for_sale(row, counts, timestamp)
+            gross, discount = row_pricing.price(counts, row[3])[:2]
+            items = [(name, count, count * price)
+                     for name, count, price in zip(row_pricing.names, counts, row_pricing.prices)]
+            self.add_sale(row[0], row[1], row[3], items, gross, discount, int(row[4]))
+        self.needs_rebuild = False
+        self.schedule_save()
+
+    def replace(self, data):
+        """別に計算した集計で置き換える（イベント開始日時はそのまま）"""
+        self.data.update(data)
+        self.needs_rebuild = False
+        self.schedule_save()
+
+    def schedule_save(self):
+        self.dirty = True
+        if self.after is None:
+            self.flush()
+        elif not self.scheduled:
+            self.scheduled = True
+            self.after(self.debounce_ms, self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        if not self.dirty:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+class SurveyTallies:
+    """アンケートの回答数（全体・資格ごと・時間帯ごと）を1件ごとに差分で数え、スナップショットとして保存する
+
+    回答は記録された文字列で数える。質問タブで質問名を変更した場合は、変更前の名前を変更後の名前の
+    別名として記録し、以前の回答も変更後の名前で数える（履歴から数え直しても同じ結果になる）。
+    """
+
+    def __init__(self, path="survey_tallies.json", after=None, debounce_ms=1000):
+        self.path = path
+        self.after = after
+        self.debounce_ms = debounce_ms
+        self.dirty = False
+        self.scheduled = False
+        self.needs_rebuild = False
+        self.aliases = {}  # 変更前の質問名 -> 変更後の質問名
+        self.reset()
+        self.load()
+
+    def reset(self):
+        self.data = {
+            'total': 0,
+            'answers': {},         # 回答 -> 件数
+            'qualifications': {},  # 資格名 -> {回答: 件数}
+            'hours': {},           # "時" -> {回答: 件数}
+        }
+        self.dirty = True
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            # スナップショットがない場合は履歴から1度だけ数える
+            self.needs_rebuild = True
+            return
+        self.aliases = stored.pop('aliases', {})
+        self.data.update(stored)
+        self.dirty = False
+
+    def resolve(self, answer):
+        return self.aliases.get(answer, answer)
+
+    def add(self, survey_entry):
+        """アンケート結果の1行（survey_log.csv の並び）を数える"""
+        if len(survey_entry) < 5:
+            return
+        data = self.data
+        answer = self.resolve(survey_entry[4])
+        data['total'] += 1
+        data['answers'][answer] = data['answers'].get(answer, 0) + 1
+        for key, group in (('qualifications', survey_entry[3]), ('hours', f"{survey_entry[1][:2]}時")):
+            counts = data[key].setdefault(group, {})
+            counts[answer] = counts.get(answer, 0) + 1
+        self.schedule_save()
+
+    def rebuild(self, survey_rows):
+        """保存されている全てのアンケート結果から数え直す"""
+        self.reset()
+        for row in survey_rows:
+            self.add(row)
+        self.needs_rebuild = False
+        self.schedule_save()
+
+    def rename(self, old, new):
+        """質問名の変更を記録し、変更前の名前の回答数を変更後の名前に移す"""
+        if old == new:
+            return
+        for source, target in list(self.aliases.items()):
+            if target == old:
+                self.aliases[source] = new
+        self.aliases[old] = new
+        self.aliases.pop(new, None)
+        for counts in [self.data['answers']] + list(self.data['qualifications'].values()) \
+                + list(self.data['hours'].values()):
+            if old in counts:
+                counts[new] = counts.get(new, 0) + counts.pop(old)
+        self.schedule_save()
+
+    def ordered_answers(self, questions):
+        """現在の質問の順に、以前の質問名で記録された回答をその後に並べる"""
+        return list(questions) + sorted(set(self.data['answers']) - set(questions))
+
+    def schedule_save(self):
+        self.dirty = True
+        if self.after is None:
+            self.flush()
+        elif not self.scheduled:
+            self.scheduled = True
+            self.after(self.debounce_ms, self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        if not self.dirty:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(self.data, aliases=self.aliases), f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+def row_datetime(date_str, time_str, started):
+    """履歴の %m-%d / %H:%M を、その行を含むセグメントの開始日時から年を補って datetime にする"""
+    month, day = (int(part) for part in date_str.split("-")[-2:])
+    hour, minute = (int(part) for part in time_str.split(":")[:2])
+    # セグメントの途中で年が変わる場合もあるので、未来にならない範囲で開始日時に最も近い年を選ぶ
+    limit = datetime.now() + timedelta(days=1)
+    candidates = []
+    for year in (started.year - 1, started.year, started.year + 1):
+        try:
+            when = datetime(year, month, day, hour, minute)
+        except ValueError:  # 2月29日
+            continue
+        if when <= limit:
+            candidates.append(when)
+    if not candidates:
+        # 2月29日で前後1年にうるう年がない場合は、それより前の直近のうるう年とする
+        for year in range(started.year - 2, started.year - 9, -1):
+            try:
+                return datetime(year, month, day, hour, minute)
+            except ValueError:
+                continue
+        raise ValueError(f"日付が無効です: {date_str}")
+    return min(candidates, key=lambda when: abs(when - started))
+
+
+class ColumnarSales:
+    """販売の列指向ストア（列ごとの固定長配列をメモリマップし、NumPy のまま集計する）
+
+    columns/ に timestamp・total・gross・qualification と商品IDごとの個数・金額の列を1ファイルずつ置き、
+    meta.json に行数・容量・資格名の一覧を記録する。商品の列は商品IDで持つので、
+    商品の並びや数が変わっても過去の行はずれない。金額は販売した時点の単価で記録するので、
+    後から価格を変えても過去の売上は変わらない。NumPy がない環境では使わない。
+    """
+    VERSION = 2  # 形式が違うストアは作り直す
+    INITIAL_CAPACITY = 1024
+    BASE_COLUMNS = {'timestamp': 'int64', 'total': 'int64', 'gross': 'int64', 'qualification': 'int32'}
+    PRODUCT_DTYPE = 'int32'
+    AMOUNT_DTYPE = 'int64'
+
+    def __init__(self, directory="columns"):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.meta = None
+        self.arrays = {}
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+        except FileNotFoundError:
+            return
+        if self.meta.get('version') != self.VERSION:
+            self.meta = None
+            return
+        for name in self.column_names():
+            self.open_column(name)
+
+    @property
+    def ready(self):
+        return self.meta is not None
+
+    def __len__(self):
+        return self.meta['rows'] if self.meta else 0
+
+    def column_names(self):
+        names = list(self.BASE_COLUMNS)
+        for pid in self.meta['products']:
+            names += [f"product_{pid}", f"amount_{pid}"]
+        return names
+
+    def dtype(self, name):
+        if name.startswith("amount_"):
+            return self.AMOUNT_DTYPE
+        return self.BASE_COLUMNS.get(name, self.PRODUCT_DTYPE)
+
+    def open_column(self, name):
+        path = os.path.join(self.directory, f"{name}.bin")
+        size = self.meta['capacity'] * np.dtype(self.dtype(name)).itemsize
+        if file_size(path) < size:
+            # 新しい列や容量を増やした列は0で埋めて伸ばす
+            with open(path, "ab") as f:
+                f.truncate(size)
+        self.arrays[name] = np.memmap(path, dtype=self.dtype(name), mode='r+', shape=(self.meta['capacity'],))
+
+    def create(self):
+        """空のストアを作る（既存の列は作り直す）"""
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".bin"):
+                os.remove(os.path.join(self.directory, filename))
+        self.meta = {'version': self.VERSION, 'rows': 0, 'capacity': self.INITIAL_CAPACITY,
+                     'qualifications': [], 'products': []}
+        self.arrays = {}
+        for name in self.column_names():
+            self.open_column(name)
+        self.save_meta()
+
+    def save_meta(self):
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self.meta_path)
+
+    def reserve(self, rows):
+        """rows 行が入るまで容量を倍々に増やす"""
+        capacity = self.meta['capacity']
+        if rows <= capacity:
+            return
+        while capacity < rows:
+            capacity *= 2
+        for array in self.arrays.values():
+            array.flush()
+        self.arrays = {}
+        self.meta['capacity'] = capacity
+        for name in self.column_names():
+            self.open_column(name)
+
+    def product_columns(self, product_id):
+        """商品の (個数, 金額) の列（初めての商品なら列を作る）"""
+        name = f"product_{product_id}"
+        if name not in self.arrays:
+            self.meta['products'].append(product_id)
+            self.open_column(name)
+            self.open_column(f"amount_{product_id}")
+        return self.arrays[name], self.arrays[f"amount_{product_id}"]
+
+    def qualification_id(self, name):
+        names = self.meta['qualifications']
+        if name not in names:
+            names.append(name)
+        return names.index(name)
+
+    def append(self, timestamp, total, gross, qualification, items):
+        """1件の販売を追加する（items は 商品ID -> (個数, 販売した時点の単価での金額)）"""
+        self.append_many([(timestamp, total, gross, qualification, items)])
+
+    def append_many(self, sales):
+        sales = list(sales)
+        start = self.meta['rows']
+        self.reserve(start + len(sales))
+        arrays = self.arrays
+        for offset, (timestamp, total, gross, qualification, items) in enumerate(sales):
+            row = start + offset
+            arrays['timestamp'][row] = timestamp
+            arrays['total'][row] = total
+            arrays['gross'][row] = gross
+            arrays['qualification'][row] = self.qualification_id(qualification)
+            for product_id, (quantity, amount) in items.items():
+                if quantity:
+                    units, amounts = self.product_columns(product_id)
+                    units[row] = quantity
+                    amounts[row] = amount
+        self.meta['rows'] = start + len(sales)
+        self.save_meta()
+
+    def column(self, name):
+        """列の有効な行だけの配列（メモリマップのビューなのでコピーしない）"""
+        return self.arrays[name][:self.meta['rows']]
+
+    def mask(self, start=None, end=None):
+        """[start, end) の期間の行を選ぶ真偽値の配列（None なら全期間）"""
+        timestamps = self.column('timestamp')
+        selected = np.ones(len(timestamps), dtype=bool)
+        if start is not None:
+            selected &= timestamps >= int(start)
+        if end is not None:
+            selected &= timestamps < int(end)
+        return selected
+
+    def summarize(self, products, start=None):
+        """SalesAggregates と同じ形の集計を列からまとめて計算する（商品名は products の現在の名前）"""
+        selected = self.mask(start)
+        totals = self.column('total')[selected]
+        gross = self.column('gross')[selected]
+        discounts = gross - totals
+        data = {'sales': int(selected.sum()), 'gross': int(gross.sum()),
+                'discount': int(discounts.sum()), 'revenue': int(totals.sum()),
+                'products': {}, 'qualifications': {}, 'hours': {}}
+        for product in products:
+            name = f"product_{product.get('id')}"
+            if name in self.arrays:
+                units = int(self.column(name)[selected].sum())
+                if units:
+                    amount = int(self.column(f"amount_{product.get('id')}")[selected].sum())
+                    data['products'][product['name']] = [units, amount]
+        qualification_ids = self.column('qualification')[selected]
+        names = self.meta['qualifications']
+        counts = np.bincount(qualification_ids, minlength=len(names))
+        revenue = np.bincount(qualification_ids, weights=totals, minlength=len(names))
+        discount = np.bincount(qualification_ids, weights=discounts, minlength=len(names))
+        for i, name in enumerate(names):
+            if counts[i]:
+                data['qualifications'][name] = [int(counts[i]), int(revenue[i]), int(discount[i])]
+        # 時刻はローカル時刻の1時間ごとにまとめる
+        offset = int(datetime.now().astimezone().utcoffset().total_seconds())
+        hours, inverse = np.unique((self.column('timestamp')[selected] + offset) // 3600, return_inverse=True)
+        hour_counts = np.bincount(inverse, minlength=len(hours))
+        hour_revenue = np.bincount(inverse, weights=totals, minlength=len(hours))
+        for i, hour in enumerate(hours):
+            label = datetime.fromtimestamp(int(hour) * 3600 - offset).strftime('%m-%d %H時')
+            data['hours'][label] = [int(hour_counts[i]), int(hour_revenue[i])]
+        return data
+
+    def close(self):
+        for array in self.arrays.values():
+            array.flush()
+        self.arrays = {}
+
+
+class HistoryIndex:
+    """販売履歴とアンケート結果の検索用索引（転置索引と日付順の索引）
+
+    日付順の索引は年を補った "YYYY-MM-DD HH:MM" で持つので、年をまたいだ履歴も混ざらない。
+    """
+
+    def __init__(self):
+        self.records = []         # (販売履歴の行, アンケート結果の行)
+        self.by_name = {}         # 名前 -> [番号]
+        self.by_qualification = {}
+        self.by_survey = {}
+        self.bigrams = {}         # 名前・備考の2文字ごと -> {番号}
+        self.date_keys = []       # 年を補った日付と時刻の昇順（date_ids と対応）
+        self.date_ids = []
+
+    def build(self, dated_log_rows, survey_rows):
+        """(年の補完に使う日時, 販売履歴の行) とアンケート結果の行から索引を作る
+
+        2つの履歴は行の位置ではなく日時・名前・資格で突き合わせる（match_sales）。
+        片方にしかない行も、もう片方を空にして索引に加える。
+        """
+        dated_log_rows = [(started, row) for started, row in dated_log_rows if row]
+        survey_rows = [row for row in survey_rows if row]
+        started = None
+        for i, j in match_sales([row for _, row in dated_log_rows], survey_rows):
+            log_row = []
+            if i is not None:
+                started, log_row = dated_log_rows[i]
+            # アンケート結果だけの行は直前の販売の日時から年を補う
+            self.add(log_row, survey_rows[j] if j is not None else [], started)
+        return self
+
+    @staticmethod
+    def date_key(date_str, time_str, started=None):
+        try:
+            when = row_datetime(date_str, time_str or "00:00", started or datetime.now())
+        except ValueError:
+            return f"{date_str} {time_str}"
+        return when.strftime('%Y-%m-%d %H:%M')
+
+    def add(self, log_row, survey_row, started=None):
+        log_row = [str(value) for value in log_row]
+        survey_row = [str(value) for value in survey_row]
+        record_id = len(self.records)
+        self.records.append((log_row, survey_row))
+        # 日付・時刻・名前・資格は両方の行に共通
+        date_str, time_str, name, qualification = ((log_row or survey_row) + [""] * 4)[:4]
+        survey = survey_row[4] if len(survey_row) > 4 else ""
+        remarks = survey_row[5] if len(survey_row) > 5 else ""
+
+        self.by_name.setdefault(name, []).append(record_id)
+        self.by_qualification.setdefault(qualification, []).append(record_id)
+        self.by_survey.setdefault(survey, []).append(record_id)
+        for text in {name, remarks}:
+            for gram in self.grams(text):
+                self.bigrams.setdefault(gram, set()).add(record_id)
+
+        key = self.date_key(date_str, time_str, started)
+        if not self.date_keys or key >= self.date_keys[-1]:
+            self.date_keys.append(key)
+            self.date_ids.append(record_id)
+        else:
+            position = bisect.bisect_right(self.date_keys, key)
+            self.date_keys.insert(position, key)
+            self.date_ids.insert(position, record_id)
+
+    @staticmethod
+    def grams(text):
+        text = text.lower()
+        if len(text) < 2:
+            return {text} if text else set()
+        return {text[i:i + 2] for i in range(len(text) - 1)}
+
+    def search_text(self, text):
+        """名前または備考に text を含む番号"""
+        text = text.lower()
+        if len(text) < 2:
+            # 1文字の場合は2文字ごとの索引から候補を集める
+            return set().union(*(ids for gram, ids in self.bigrams.items() if text in gram))
+        candidates = None
+        for gram in self.grams(text):
+            ids = self.bigrams.get(gram, set())
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return set()
+        return candidates
+
+    def query(self, name="", date_from="", date_to="", qualification="", survey="", text=""):
+        """条件をすべて満たす番号を古い順に返す（日付は YYYY-MM-DD）"""
+        sets = []
+        if name:
+            exact = self.by_name.get(name)
+            if exact is not None:
+                sets.append(set(exact))
+            else:
+                # 完全一致がなければ部分一致で探す
+                sets.append({i for i in self.search_text(name) if name.lower() in self.records[i][0][2].lower()})
+        if qualification:
+            sets.append(set(self.by_qualification.get(qualification, ())))
+        if survey:
+            sets.append(set(self.by_survey.get(survey, ())))
+        if text:
+            sets.append({i for i in self.search_text(text)
+                         if text.lower() in self.remarks(i).lower() or text.lower() in self.records[i][0][2].lower()})
+        if date_from or date_to:
+            start = bisect.bisect_left(self.date_keys, date_from) if date_from else 0
+            # 終了日はその日の最後の時刻まで含める
+            stop = bisect.bisect_right(self.date_keys, date_to + "￿") if date_to else len(self.date_keys)
+            sets.append(set(self.date_ids[start:stop]))
+
+        if not sets:
+            return list(range(len(self.records)))
+        sets.sort(key=len)
+        result = sets[0].intersection(*sets[1:])
+        return sorted(result)
+
+    def remarks(self, record_id):
+        survey_row = self.records[record_id][1]
+        return survey_row[5] if len(survey_row) > 5 else ""
+
+
+class SaleWriter:
+    """販売記録を別スレッドでまとめて log.csv / survey_log.csv に書き込む（先行書き込みジャーナル付き）
+
+    fsync の方針:
+      always   -- 1件ごとに書き込んでから戻る
+      interval -- interval_ms ごとにまとめて書き込む
+      idle     -- 書き込み待ちがなくなったときにまとめて fsync する
+
+    interval / idle では record はメモリ上の書き込み待ちに加えるだけなので、ジャーナルに
+    書き込まれる前（interval では最大 interval_ms、idle では販売が続いている間）に
+    アプリが落ちると、その間の販売は失われる。1件も失えない場合は always を使う。
+
+    書き込みに失敗した販売記録はジャーナルに残したまま RETRY_SECONDS ごとに書き直し、
+    失敗の理由は take_errors で画面側に伝える（書き込みスレッドは止めない）。
+    再試行を待っている販売はCSVにまだないので、flush はその件数を返す。
+    """
+    POLICIES = ("always", "interval", "idle")
+    RETRY_SECONDS = 5
+
+    def __init__(self, log_path="log.csv", survey_path="survey_log.csv", journal_path="log_journal.jsonl",
+                 policy="interval", interval_ms=200):
+        self.log_path = log_path
+        self.survey_path = survey_path
+        self.journal_path = journal_path
+        self.policy = policy if policy in self.POLICIES else "interval"
+        self.interval_ms = interval_ms
+        self.queue = queue.Queue()
+        self.unfinished = 0       # CSVにまだ書き込まれていない販売の件数（再試行待ちも含む）
+        self.failed_sales = 0     # そのうち書き込みに失敗して再試行を待っている件数
+        self.condition = threading.Condition()
+        self.retry_record = None  # 書き込めなかった販売記録（ジャーナルと同じ形）
+        self.errors = queue.Queue()
+
+        # 前回の書き込みが途中で止まっていた場合は、ジャーナルから書き直す
+        self.replay()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def record(self, log_entry, survey_entry):
+        """販売記録を書き込み待ちに追加"""
+        with self.condition:
+            self.unfinished += 1
+        self.queue.put((list(log_entry), list(survey_entry)))
+        if self.policy == "always":
+            self.flush()
+
+    def pending(self):
+        """書き込みを待っている販売の件数（再試行待ちは含めない）"""
+        return self.unfinished - self.failed_sales
+
+    def failed(self):
+        """書き込めずに再試行を待っている販売の件数"""
+        return self.failed_sales
+
+    def take_errors(self):
+        """書き込みに失敗した理由を取り出す"""
+        errors = []
+        while True:
+            try:
+                errors.append(self.errors.get_nowait())
+            except queue.Empty:
+                return errors
+
+    def flush(self):
+        """書き込み待ちの販売記録の書き込みが終わるまで待ち、CSVに書き込めなかった件数を返す"""
+        with self.condition:
+            while self.unfinished > self.failed_sales:
+                self.condition.wait()
+            return self.failed_sales
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        stop = False
+        while not stop:
+            batch = []
+            try:
+                # 書き込めなかった販売記録があれば、新しい販売を待たずに一定時間ごとに再試行する
+                item = self.queue.get(timeout=self.RETRY_SECONDS if self.retry_record else None)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                stop = True
+            elif item:
+                batch.append(item)
+                deadline = time.monotonic() + (self.interval_ms / 1000 if self.policy == "interval" else 0)
+                # 待ち時間の間に届いた販売記録をまとめて1回で書き込む
+                while True:
+                    try:
+                        item = self.queue.get(timeout=max(0, deadline - time.monotonic())) \
+                            if deadline > time.monotonic() else self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+            if not batch and not self.retry_record:
+                continue
+
+            sync = self.policy != "idle" or self.queue.empty()
+            try:
+                written = self.commit(batch, sync)
+            except Exception as e:  # ファイルがロックされている、ディスクがいっぱいなど
+                self.errors.put(e)
+                with self.condition:
+                    # 書き込めなかった販売は、再試行が成功するまで書き込み待ちとして数えておく
+                    self.failed_sales = len(self.retry_record['sales'])
+                    self.condition.notify_all()
+            else:
+                with self.condition:
+                    self.unfinished -= written
+                    self.failed_sales = 0
+                    self.condition.notify_all()
+
+    def commit(self, batch, sync):
+        """再試行待ちの販売と batch をまとめて書き込み、書き込んだ件数を返す"""
+        record = self.retry_record
+        if record is None:
+            record = {
+                'log_size': file_size(self.log_path),
+                'survey_size': file_size(self.survey_path),
+                'sales': [],
+            }
+        # 書き込めなかった分は最初の記録時のサイズのまま、新しい販売を後ろに加えて書き直す
+        record['sales'] = record['sales'] + batch
+        self.retry_record = record
+        # 1. ジャーナルに書き込む（書き込み途中で止まっても前の内容が残るように置き換える）
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        # 2. CSVに反映
+        self.apply(record, sync)
+        # 3. 反映が終わったジャーナルを空にする
+        with open(self.journal_path, "w", encoding="utf-8"):
+            pass
+        self.retry_record = None
+        return len(record['sales'])
+
+    def apply(self, record, sync):
+        """ジャーナルの1件を反映（記録時のサイズまで戻してから追記するので何度実行しても同じ結果になる）"""
+        for path, size, column in ((self.log_path, record['log_size'], 0),
+                                   (self.survey_path, record['survey_size'], 1)):
+            if file_size(path) > size:
+                os.truncate(path, size)
+            with open(path, "a", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                for sale in record['sales']:
+                    writer.writerow(sale[column])
+                f.flush()
+                if sync:
+                    os.fsync(f.fileno())
+
+    def replay(self):
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 書きかけの行はCSVに反映される前に止まったものなので捨てる
+                break
+            self.apply(record, sync=True)
+        with open(self.journal_path, "w", encoding="utf-8"):
+            pass
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def append_csv_rows(path, rows):
+    """CSVファイルの末尾に行を追記する（最後の行が改行で終わっていなければ改行を補う）"""
+    size = file_size(path)
+    if size:
+        with open(path, "rb") as f:
+            f.seek(size - 1)
+            ends_with_newline = f.read(1) in (b"\n", b"\r")
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        if size and not ends_with_newline:
+            f.write("\r\n")
+        writer = csv.writer(f)
+        for row in rows:
+            writer.writerow(row)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def iter_csv_prefix(path, size, skip=0):
+    """CSVファイルの先頭 size バイト分の行を返す（読み込み中の追記分は含めない。skip バイト目から読む）"""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+
+    def lines():
+        pos = f.seek(skip)
+        for line in f:
+            if pos >= size:
+                break
+            pos += len(line)
+            yield line.decode("utf-8")
+
+    with f:
+        yield from csv.reader(lines())
+
+
+def read_csv_tail(path, count, block_size=8192):
+    """CSVファイルの末尾から count 行を読む（後ろからブロック単位でシークし、先頭からは読まない）"""
+    if count <= 0:
+        return []
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return []
+    with f:
+        pos = f.seek(0, os.SEEK_END)
+        data = b""
+        while pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+            block_size *= 2
+            if data.count(b"\n") <= count:
+                continue
+            # 先頭の1行は途中から読んでいるかもしれないので捨てる
+            tail = data[data.index(b"\n") + 1:]
+            # 引用符の数が奇数なら引用符で囲まれた改行の途中で切っているので、もっと前から読む
+            if tail.count(b'"') % 2:
+                continue
+            rows = [row for row in csv.reader(io.StringIO(tail.decode("utf-8"), newline="")) if row]
+            if len(rows) >= count:
+                return rows[-count:]
+        rows = [row for row in csv.reader(io.StringIO(data.decode("utf-8"), newline="")) if row]
+        return rows[-count:]
+
+
+def compare_sale_times(log_row, survey_row):
+    """2つの行の日時を比べて -1 / 0 / 1 を返す（年は互いに近い方を補うので、12月と1月の行も比べられる）"""
+    try:
+        log_time = row_datetime(log_row[0], log_row[1], datetime.now())
+        survey_time = row_datetime(survey_row[0], survey_row[1], log_time)
+    except (IndexError, ValueError):
+        log_time, survey_time = log_row[:2], survey_row[:2]
+    return (log_time > survey_time) - (log_time < survey_time)
+
+
+def match_sales(log_rows, survey_rows):
+    """販売履歴とアンケート結果の行を古い順に突き合わせ、(販売履歴の番号, アンケート結果の番号) を返す
+
+    どちらの行も先頭の日付・時刻・名前・資格が共通なので、これを販売の識別子として突き合わせる。
+    片方にしかない行（書き込みの途中で止まった場合など）は、もう片方の番号を None にする。
+    日時が同じで名前か資格だけが違う場合は、次のアンケート結果がこの販売と一致すれば
+    アンケート結果を、そうでなければ販売履歴を片方だけの行とする。
+    """
+    i = j = 0
+    while i < len(log_rows) and j < len(survey_rows):
+        log_key, survey_key = log_rows[i][:4], survey_rows[j][:4]
+        if log_key == survey_key:
+            yield i, j
+            i += 1
+            j += 1
+            continue
+        order = compare_sale_times(log_key, survey_key)
+        if order == 0:
+            order = 1 if j + 1 < len(survey_rows) and survey_rows[j + 1][:4] == log_key else -1
+        if order < 0:
+            yield i, None
+            i += 1
+        else:
+            yield None, j
+            j += 1
+    for i in range(i, len(log_rows)):
+        yield i, None
+    for j in range(j, len(survey_rows)):
+        yield None, j
+
+
+def pair_sales(log_rows, survey_rows):
+    """販売履歴とアンケート結果の行を match_sales で対応付け、新しい順の組にする
+
+    片方にしかない行（書き込みの途中で止まった場合など）は読み飛ばす。
+    """
+    pairs = [(log_rows[i], survey_rows[j]) for i, j in match_sales(log_rows, survey_rows)
+             if i is not None and j is not None]
+    pairs.reverse()
+    return pairs
+
+
+class LogSegments:
+    """販売履歴を日ごと（またはイベントごと）のセグメントに分けて管理する
+
+    log.csv / survey_log.csv は常に書き込み中のセグメントとして使い、閉じたセグメントは
+    logs/ に gzip で圧縮して置く。manifest.json には各セグメントの開始・終了日時と
+    行数・バイト位置（全履歴を連結したときの先頭行番号とバイト位置）を記録する。
+
+    履歴の日付には年がないため、マニフェストのない以前の log.csv を取り込むときは legacy_year
+    （年を返す関数か年）で最初の販売の年を決めて開始日時とする。legacy_year がなければ最初の販売を
+    今日から遡って直近の日付とみなし、set_legacy_year で年が確かめられるまで legacy_pending を返す。
+    read_only ならファイルを変更しない。
+    """
+    MODES = ("day", "event")
+    FILES = {'sales': "log.csv", 'surveys': "survey_log.csv"}
+
+    def __init__(self, directory="logs", mode="day", active_dir=".", legacy_year=None, read_only=False):
+        self.directory = directory
+        self.active_dir = active_dir
+        self.mode = mode if mode in self.MODES else "day"
+        self.legacy_year = legacy_year
+        self.read_only = read_only
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.manifest = {'version': 1, 'active': None, 'segments': []}
+        self.load()
+
+    def active_path(self, table):
+        return os.path.join(self.active_dir, self.FILES[table])
+
+    def load(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            pass
+        active = self.manifest['active']
+        if active is None:
+            # 以前のバージョンの log.csv は最初の販売の日時から始まるセグメントとみなす
+            # （ファイルの更新日時はコピーなどで変わるので使わない）
+            started = self.legacy_started()
+            self.manifest['active'] = {'started': (started or datetime.now()).isoformat(timespec='seconds')}
+            if started and self.legacy_year is None:
+                self.manifest['active']['legacy'] = True
+            self.save()
+        elif 'closed_bytes' in active and not self.read_only:
+            # 閉じたセグメントの分を書き込み中のファイルから消す前に止まっていた
+            self.drop_closed_bytes()
+
+    def legacy_started(self, year=None):
+        """以前のバージョンの log.csv の最初の行の日時（年は year か legacy_year から。行がなければ None）"""
+        try:
+            with open(self.active_path('sales'), "r", newline="", encoding="utf-8") as f:
+                row = next((row for row in csv.reader(f) if len(row) >= 2), None)
+        except FileNotFoundError:
+            return None
+        if row is None:
+            return None
+        if year is None:
+            year = self.legacy_year() if callable(self.legacy_year) else self.legacy_year
+        try:
+            if year is None:
+                return row_datetime(row[0], row[1], datetime.now())
+            month, day = (int(part) for part in row[0].split("-")[-2:])
+            hour, minute = (int(part) for part in row[1].split(":")[:2])
+            return datetime(year, month, day, hour, minute)
+        except ValueError:
+            return None
+
+    def legacy_pending(self):
+        """以前の log.csv の最初の販売の年を推定したまま、まだ確かめていないか"""
+        return self.manifest['active'].get('legacy', False)
+
+    def set_legacy_year(self, year):
+        """以前の log.csv の最初の販売の年を決め、書き込み中のセグメントの開始日時にする"""
+        started = self.legacy_started(year)
+        if started:
+            self.manifest['active']['started'] = started.isoformat(timespec='seconds')
+        self.manifest['active'].pop('legacy', None)
+        self.save()
+
+    def active_skip_bytes(self, table):
+        """書き込み中のファイルの先頭にまだ残っている、閉じたセグメントに移した分のバイト数"""
+        size = self.manifest['active'].get('closed_bytes', {}).get(table, 0)
+        return size if file_size(self.active_path(table)) >= size else 0
+
+    def save(self):
+        if self.read_only:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    @property
+    def segments(self):
+        return self.manifest['segments']
+
+    def active_started(self):
+        return datetime.fromisoformat(self.manifest['active']['started'])
+
+    def needs_rotation(self, now=None):
+        """日ごとの区切りで、書き込み中のセグメントが今日より前に始まっているか"""
+        if self.mode != "day":
+            return False
+        now = now or datetime.now()
+        return self.active_started().date() != now.date()
+
+    def rotate(self, now=None):
+        """書き込み中のセグメントを圧縮して閉じ、新しいセグメントを始める（書き込みが止まっている間に呼ぶ）"""
+        now = now or datetime.now()
+        if not any(file_size(self.active_path(table)) for table in self.FILES):
+            # 空のセグメントは残さず開始日時だけ進める
+            self.manifest['active'] = {'started': now.isoformat(timespec='seconds')}
+            self.save()
+            return None
+
+        started = self.active_started()
+        segment_id = started.strftime('%Y-%m-%d_%H%M%S')
+        ids = {segment['id'] for segment in self.segments}
+        suffix = 1
+        while segment_id in ids:
+            suffix += 1
+            segment_id = f"{started.strftime('%Y-%m-%d_%H%M%S')}_{suffix}"
+        previous = self.segments[-1] if self.segments else None
+        segment = {'id': segment_id, 'started': started.isoformat(timespec='seconds'),
+                   'closed': now.isoformat(timespec='seconds')}
+        for table, filename in self.FILES.items():
+            path = self.active_path(table)
+            name, ext = os.path.splitext(filename)
+            archive = f"{name}_{segment_id}{ext}.gz"
+            rows = self.compress(path, os.path.join(self.directory, archive))
+            first_row = previous[table]['first_row'] + previous[table]['rows'] if previous else 0
+            offset = previous[table]['offset'] + previous[table]['bytes'] if previous else 0
+            segment[table] = {'file': archive, 'rows': rows, 'bytes': file_size(path),
+                              'first_row': first_row, 'offset': offset}
+
+        # 先にマニフェストへ記録してから書き込み中のファイルを空にする（途中で止まっても load でやり直せる）
+        self.segments.append(segment)
+        self.manifest['active'] = {'started': now.isoformat(timespec='seconds'),
+                                   'closed_bytes': {table: segment[table]['bytes'] for table in self.FILES}}
+        self.save()
+        self.drop_closed_bytes()
+        return segment
+
+    def compress(self, path, archive_path):
+        """CSVをそのままのバイト列で gzip に圧縮して行数を返す"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, "r", newline="", encoding="utf-8") as f:
+            rows = sum(1 for _ in csv.reader(f))
+        tmp_path = archive_path + ".tmp"
+        with open(path, "rb") as src, gzip.open(tmp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, archive_path)
+        return rows
+
+    def drop_closed_bytes(self):
+        """書き込み中のファイルの先頭から、閉じたセグメントに移した分を取り除く"""
+        active = self.manifest['active']
+        for table, size in active.pop('closed_bytes').items():
+            path = self.active_path(table)
+            if file_size(path) < size:
+                continue
+            with open(path, "rb") as f:
+                f.seek(size)
+                rest = f.read()
+            # ファイルは作り直さずに切り詰める（読み込み中の他のスレッドが開いていてもよいように）
+            with open(path, "r+b") as f:
+                f.write(rest)
+                f.truncate(len(rest))
+                f.flush()
+                os.fsync(f.fileno())
+        self.save()
+
+    def find(self, segment_id):
+        for segment in self.segments:
+            if segment['id'] == segment_id:
+                return segment
+        raise KeyError(segment_id)
+
+    def iter_segment(self, table, segment_id):
+        """閉じたセグメント1つの行を必要になった分だけ展開して返す"""
+        segment = self.find(segment_id)
+        with gzip.open(os.path.join(self.directory, segment[table]['file']), "rt",
+                       newline="", encoding="utf-8") as f:
+            yield from csv.reader(f)
+
+    def iter_active(self, table):
+        """書き込み中のセグメントの行を返す（閉じたセグメントに移した分が残っていれば読み飛ばす）"""
+        try:
+            raw = open(self.active_path(table), "rb")
+        except FileNotFoundError:
+            return
+        with raw:
+            raw.seek(self.active_skip_bytes(table))
+            yield from csv.reader(io.TextIOWrapper(raw, encoding="utf-8", newline=""))
+
+    def iter_rows(self, table):
+        """閉じたセグメントから書き込み中のセグメントまで、全履歴を古い順に返す"""
+        for segment in list(self.segments):
+            yield from self.iter_segment(table, segment['id'])
+        yield from self.iter_active(table)
+
+    def iter_rows_from(self, table, start):
+        """全履歴を連結したときの start 行目以降を返す（それより前の閉じたセグメントは開かない）"""
+        for segment in list(self.segments):
+            info = segment[table]
+            if info['first_row'] + info['rows'] <= start:
+                continue
+            skip = max(0, start - info['first_row'])
+            yield from itertools.islice(self.iter_segment(table, segment['id']), skip, None)
+        skip = max(0, start - self.closed_rows(table))
+        yield from itertools.islice(self.iter_active(table), skip, None)
+
+    def closed_rows(self, table):
+        """閉じたセグメントの行数の合計"""
+        if not self.segments:
+            return 0
+        last = self.segments[-1][table]
+        return last['first_row'] + last['rows']
+
+    def count_rows(self, table):
+        """全履歴の行数（書き込み中のセグメントだけ読んで数える）"""
+        return self.closed_rows(table) + sum(1 for _ in self.iter_active(table))
+
+    def iter_rows_with_start(self, table, start=0):
+        """全履歴（start 行目以降）を (年の補完に使う日時, 行) の組で古い順に返す
+
+        セグメントの最初の行はセグメントの開始日時から、それ以降の行は1つ前の行の日時から年を補うので、
+        セグメントの途中で年が変わっても（12月の次に1月の行が来ても）翌年の販売になる。
+        start より前に終わる閉じたセグメントは開かない。
+        """
+        sources = [(datetime.fromisoformat(segment['started']), segment[table]['first_row'],
+                    lambda segment_id=segment['id']: self.iter_segment(table, segment_id))
+                   for segment in list(self.segments)
+                   if segment[table]['first_row'] + segment[table]['rows'] > start]
+        sources.append((self.active_started(), self.closed_rows(table), lambda: self.iter_active(table)))
+        for started, first_row, rows in sources:
+            for i, row in enumerate(rows(), first_row):
+                try:
+                    started = row_datetime(row[0], row[1], started)
+                except (IndexError, ValueError):
+                    pass
+                if i >= start:
+                    yield started, row
+
+    def tail(self, table, count):
+        """最後の count 行を返す（書き込み中のセグメントで足りなければ閉じたセグメントから補う）"""
+        rows = read_csv_tail(self.active_path(table), count)
+        for segment in reversed(self.segments):
+            if len(rows) >= count:
+                break
+            rows = list(self.iter_segment(table, segment['id']))[-(count - len(rows)):] + rows
+        return rows
+
+    def label(self, segment):
+        started = datetime.fromisoformat(segment['started'])
+        closed = datetime.fromisoformat(segment['closed'])
+        return (f"{started.strftime('%Y-%m-%d %H:%M')}〜{closed.strftime('%Y-%m-%d %H:%M')}"
+                f"（{segment['sales']['rows']}件）")
+
+
+class SegmentRows:
+    """閉じたセグメントを仮想リストの行ソースとして扱う（最初に参照したときに展開する）"""
+
+    def __init__(self, segments, table, segment_id):
+        self.segments = segments
+        self.table = table
+        self.segment_id = segment_id
+        self.loaded = None
+
+    def __len__(self):
+        return len(self.loaded) if self.loaded is not None else 0
+
+    def refresh(self):
+        # 閉じたセグメントは変更されないので1度だけ読む
+        if self.loaded is None:
+            self.loaded = list(self.segments.iter_segment(self.table, self.segment_id))
+
+    def rows(self, start, stop):
+        self.refresh()
+        return self.loaded[max(0, start):stop]
+
+
+REPORT_CHUNK_ROWS = 200000  # 台帳を並列に集計するときの1単位の行数
+
+
+def report_parts(segments=None, ledger=None, date_from=None, date_to=None, chunk_rows=REPORT_CHUNK_ROWS):
+    """レポートを並列に集計する単位（閉じたセグメント1つ、書き込み中のセグメント、台帳の行範囲）を作る
+
+    期間外のセグメントは開かずに読み飛ばす。書き込み中のファイルは今のサイズまでしか読まない。
+    """
+    parts = []
+
+    def overlaps(started, closed):
+        return ((date_from is None or closed.date() >= date_from)
+                and (date_to is None or started.date() <= date_to))
+
+    if ledger is not None:
+        for table in LogSegments.FILES:
+            last_id = ledger.max_id(table)
+            for start in range(0, last_id, chunk_rows):
+                ids = (start, min(start + chunk_rows, last_id))
+                if ledger.dated:
+                    # 行範囲の最初と最後の行の記録日時で期間外の範囲を読み飛ばし、最初の行の日時から年を補う
+                    started, closed = ledger.recorded_range(table, *ids)
+                    if started and closed and not overlaps(started, closed):
+                        continue
+                    started = started or datetime.now()
+                else:
+                    # 記録日時の列がない以前の台帳は、今日から遡って直近の日付とみなす
+                    started = datetime.now()
+                parts.append({'table': table, 'started': started.isoformat(timespec='seconds'),
+                              'ledger': ledger.path, 'ids': ids})
+        return parts
+
+    for segment in segments.segments:
+        if not overlaps(datetime.fromisoformat(segment['started']), datetime.fromisoformat(segment['closed'])):
+            continue
+        for table in LogSegments.FILES:
+            parts.append({'table': table, 'started': segment['started'],
+                          'path': os.path.join(segments.directory, segment[table]['file']), 'size': None})
+    if overlaps(segments.active_started(), datetime.now()):
+        for table in LogSegments.FILES:
+            path = segments.active_path(table)
+            parts.append({'table': table, 'started': segments.manifest['active']['started'],
+                          'path': path, 'size': file_size(path), 'skip': segments.active_skip_bytes(table)})
+    return parts
+
+
+def iter_report_rows(part):
+    """集計単位の行を読み込みながら1行ずつ返す"""
+    if 'ledger' in part:
+        ledger = SalesLedger(part['ledger'], read_only=True)
+        try:
+            yield from ledger.iter_id_range(part['table'], *part['ids'])
+        finally:
+            ledger.close()
+    elif part['path'].endswith(".gz"):
+        with gzip.open(part['path'], "rt", newline="", encoding="utf-8") as f:
+            yield from csv.reader(f)
+    elif part['size'] is not None:
+        yield from iter_csv_prefix(part['path'], part['size'], part.get('skip', 0))
+    else:
+        with open(part['path'], "r", newline="", encoding="utf-8") as f:
+            yield from csv.reader(f)
+
+
+def iter_report_days(rows, started):
+    """行に年を補った日付を付けて (日付, 行) で返す
+
+    年は1つ前の日付から補うので、途中で年が変わっても翌年の日付になる。
+    行は日付の順に並んでいるので、変換は日付が変わったときだけ行う。
+    """
+    date_str, day = None, None
+    for row in rows:
+        if len(row) < 5:
+            continue
+        if row[0] != date_str:
+            try:
+                day = row_datetime(row[0], "00:00", started).date()
+            except ValueError:
+                continue
+            date_str = row[0]
+            started = datetime(day.year, day.month, day.day)
+        yield day, row
+
+
+def in_report_period(dated_rows, date_from=None, date_to=None):
+    for day, row in dated_rows:
+        if (date_from is None or day >= date_from) and (date_to is None or day <= date_to):
+            yield day, row
+
+
+def new_report_day():
+    return {
+        'sales': 0,
+        'gross': 0,
+        'discount': 0,
+        'revenue': 0,
+        'products': {},        # 商品名 -> [個数, 売上]
+        'qualifications': {},  # 資格名 -> [件数, 請求額, 割引額]
+        'answers': {},         # 回答 -> [件数]
+    }
+
+
+def fold_report_sales(days, dated_rows, pricing, history=None):
+    """販売履歴の行を日ごとの集計に加える（history があれば販売した時刻の商品名・単価・割引率を使う）"""
+    day_starts = {}
+    for day, row in dated_rows:
+        stats = days.setdefault(day.isoformat(), new_report_day())
+        counts = [int(count or 0) for count in row[5:]]
+        if history is not None:
+            start = day_starts.get(day)
+            if start is None:
+                start = day_starts[day] = datetime.combine(day, datetime.min.time()).timestamp()
+            hour, minute = row[1].split(":")[:2]
+            pricing = history.pricing_for_sale(row, counts, start + int(hour) * 3600 + int(minute) * 60)
+        gross, discount = pricing.price(counts, row[3])[:2]
+        final_total = int(row[4])
+        stats['sales'] += 1
+        stats['gross'] += gross
+        stats['discount'] += discount
+        stats['revenue'] += final_total
+        for name, count, price in zip(pricing.names, counts, pricing.prices):
+            if count:
+                product = stats['products'].setdefault(name, [0, 0])
+                product[0] += count
+                product[1] += count * price
+        qualification = stats['qualifications'].setdefault(row[3], [0, 0, 0])
+        qualification[0] += 1
+        qualification[1] += final_total
+        qualification[2] += discount
+
+
+def fold_report_surveys(days, dated_rows):
+    """アンケート結果の行を日ごとの回答数に加える"""
+    for day, row in dated_rows:
+        stats = days.setdefault(day.isoformat(), new_report_day())
+        answer = stats['answers'].setdefault(row[4], [0])
+        answer[0] += 1
+
+
+def report_part(part, products, qualifications, date_from=None, date_to=None, history=None):
+    """集計単位1つを読みながら日ごとの集計にまとめる（別プロセスで実行される）"""
+    days = {}
+    rows = in_report_period(iter_report_days(iter_report_rows(part), datetime.fromisoformat(part['started'])),
+                            date_from, date_to)
+    if part['table'] == 'sales':
+        fold_report_sales(days, rows, PricingEngine(products, qualifications), history)
+    else:
+        fold_report_surveys(days, rows)
+    return days
+
+
+def merge_report_day(target, stats):
+    for key in ('sales', 'gross', 'discount', 'revenue'):
+        target[key] += stats[key]
+    for key in ('products', 'qualifications', 'answers'):
+        for name, values in stats[key].items():
+            current = target[key].setdefault(name, [0] * len(values))
+            for i, value in enumerate(values):
+                current[i] += value
+
+
+def build_report(parts, products, qualifications, date_from=None, date_to=None, workers=None, history=None):
+    """集計単位ごとの日別集計をプロセスプールで並列に作り、日ごとと期間全体のレポートにまとめる
+
+    history（CatalogHistory）を渡すと、価格や割引率を変更する前の販売も当時の価格表で集計する。
+    """
+    days = {}
+    args = (itertools.repeat(products), itertools.repeat(qualifications),
+            itertools.repeat(date_from), itertools.repeat(date_to), itertools.repeat(history))
+    workers = min(workers or os.cpu_count() or 1, len(parts))
+    if workers <= 1:
+        results = map(report_part, parts, *args)
+        executor = None
+    else:
+        # GUIのスレッドから呼ばれても安全なように、fork ではなく新しいプロセスで実行する
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        results = executor.map(report_part, parts, *args)
+    try:
+        for partial in results:
+            for day, stats in partial.items():
+                merge_report_day(days.setdefault(day, new_report_day()), stats)
+    finally:
+        if executor:
+            executor.shutdown()
+
+    total = new_report_day()
+    for stats in days.values():
+        merge_report_day(total, stats)
+    return {
+        'generated': datetime.now().isoformat(timespec='seconds'),
+        'from': date_from.isoformat() if date_from else (min(days) if days else None),
+        'to': date_to.isoformat() if date_to else (max(days) if days else None),
+        'total': total,
+        'days': dict(sorted(days.items())),
+    }
+
+
+def report_table_rows(report):
+    """レポートを (日付, 区分, 名前, 件数, 金額, 割引額) の行にする（期間全体は日付を「合計」とする）"""
+    for day, stats in [("合計", report['total'])] + list(report['days'].items()):
+        yield [day, "販売", "", stats['sales'], stats['revenue'], stats['discount']]
+        for name, (units, amount) in sorted(stats['products'].items()):
+            yield [day, "商品", name, units, amount, ""]
+        for name, (count, revenue, discount) in sorted(stats['qualifications'].items()):
+            yield [day, "資格", name, count, revenue, discount]
+        for name, (count,) in sorted(stats['answers'].items()):
+            yield [day, "回答", name, count, "", ""]
+
+
+REPORT_HEADINGS = ["日付", "区分", "名前", "件数", "金額", "割引額"]
+
+
+def write_report(report, path, fmt=None):
+    """レポートを CSV / JSON / HTML で書き出す（形式を省略した場合は拡張子で決める）"""
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt not in ("csv", "json", "html"):
+        raise ValueError(f"レポートの形式 {fmt} には対応していません（csv / json / html）")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(REPORT_HEADINGS)
+            writer.writerows(report_table_rows(report))
+        elif fmt == "json":
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        else:
+            write_report_html(report, f)
+    os.replace(tmp_path, path)
+
+
+def write_report_html(report, f):
+    total = report['total']
+    f.write('<!DOCTYPE html>\n<html lang="ja"><head><meta charset="utf-8"><title>販売レポート</title>\n'
+            '<style>table{border-collapse:collapse;margin-bottom:1em}'
+            'th,td{border:1px solid #999;padding:2px 8px}td.n{text-align:right}</style></head><body>\n')
+    f.write(f"<h1>販売レポート {html.escape(str(report['from']))}〜{html.escape(str(report['to']))}</h1>\n")
+    f.write(f"<p>販売件数: {total['sales']}件　売上: {total['revenue']}円　割引額: {total['discount']}円"
+            f"　（作成: {html.escape(report['generated'])}）</p>\n")
+
+    def table(caption, headings, rows):
+        f.write(f"<h2>{html.escape(caption)}</h2>\n<table><tr>")
+        f.write("".join(f"<th>{html.escape(heading)}</th>" for heading in headings) + "</tr>\n")
+        for row in rows:
+            cells = (f'<td class="n">{value}</td>' if isinstance(value, int) else f"<td>{html.escape(value)}</td>"
+                     for value in row)
+            f.write(f"<tr>{''.join(cells)}</tr>\n")
+        f.write("</table>\n")
+
+    table("日別", ["日付", "件数", "売上", "割引額"],
+          ([day, stats['sales'], stats['revenue'], stats['discount']] for day, stats in report['days'].items()))
+    table("商品", ["商品", "個数", "売上"],
+          ([name] + values for name, values in sorted(total['products'].items())))
+    table("資格", ["資格", "件数", "請求額", "割引額"],
+          ([name] + values for name, values in sorted(total['qualifications'].items())))
+    table("アンケート", ["回答", "件数"],
+          ([name] + values for name, values in sorted(total['answers'].items())))
+    f.write("</body></html>\n")
+
+
+def parse_report_date(text):
+    """レポートの期間の日付（YYYY-MM-DD、空なら指定なし）"""
+    text = text.strip()
+    return datetime.strptime(text, '%Y-%m-%d').date() if text else None
+
+
+def parse_search_date(text, today=None):
+    """検索の日付（YYYY-MM-DD、MM-DD なら今年）を YYYY-MM-DD の文字列にする（空なら空文字列）"""
+    text = text.strip()
+    if not text:
+        return ""
+    if text.count("-") == 1:
+        text = f"{(today or datetime.now()).year}-{text}"
+    return datetime.strptime(text, '%Y-%m-%d').strftime('%Y-%m-%d')
+
+
+class SyncClient:
+    """複数レジの同期クライアント（別スレッドの asyncio で同期サーバーに販売を送り、カタログの変更を受け取る）
+
+    送信前の販売は sync_outbox.jsonl に残すので、サーバーにつながらない間もレジは使え、
+    再接続したときにまとめて送られる。サーバーは販売IDで重複を除くので再送しても問題ない。
+    """
+    RETRY_SECONDS = 3
+    BATCH_SIZE = 500
+
+    def __init__(self, register_id, address, outbox_path="sync_outbox.jsonl", catalog_revision=0):
+        self.register_id = register_id
+        host, _, port = address.rpartition(":")
+        self.host = host or "127.0.0.1"
+        self.port = int(port)
+        self.outbox_path = outbox_path
+        self.catalog_revision = catalog_revision
+        self.lock = threading.Lock()
+        self.outbox = self.load_outbox()
+        self.in_flight = set()     # 送信済みで ack 待ちの販売ID
+        self.pending_catalog = None
+        self.catalogs_in_flight = deque()  # 送信済みで catalog_ack 待ちの変更（送った順）
+        self.incoming = queue.Queue()  # Tk 側で受け取る (種類, 内容)
+        self.connected = False
+        self.stopped = False
+        self.loop = None
+        self.wakeup = None
+        self.thread = threading.Thread(target=lambda: asyncio.run(self.main()), daemon=True)
+
+    def load_outbox(self):
+        sales = []
+        try:
+            with open(self.outbox_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        sales.append(json.loads(line))
+                    except ValueError:
+                        break  # 書きかけの行
+        except FileNotFoundError:
+            pass
+        return sales
+
+    def write_outbox(self):
+        tmp_path = self.outbox_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for sale in self.outbox:
+                f.write(json.dumps(sale, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.outbox_path)
+
+    def start(self):
+        self.thread.start()
+
+    def close(self):
+        self.stopped = True
+        self.notify()
+
+    def notify(self):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def add_sale(self, log_entry, survey_entry):
+        """販売に全レジで一意な販売IDを付けて送信待ちに加える"""
+        sale = {'id': f"{self.register_id}-{uuid.uuid4().hex}", 'register': self.register_id,
+                'recorded': datetime.now().isoformat(timespec='microseconds'),
+                'log': list(log_entry), 'survey': list(survey_entry)}
+        with self.lock:
+            self.outbox.append(sale)
+            with open(self.outbox_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(sale, ensure_ascii=False) + "\n")
+        self.notify()
+
+    def push_catalog(self, catalog):
+        """商品・資格・質問の変更をサーバーに送る（未接続なら接続したときに送る）"""
+        with self.lock:
+            self.pending_catalog = catalog
+        self.notify()
+
+    def pending(self):
+        return len(self.outbox)
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        while not self.stopped:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                await asyncio.sleep(self.RETRY_SECONDS)
+                continue
+            try:
+                await self.session(reader, writer)
+            except (OSError, ValueError):
+                pass
+            finally:
+                self.connected = False
+                self.in_flight.clear()
+                self.catalogs_in_flight.clear()  # ack が来なかった変更は再接続したときに送り直す
+                self.incoming.put(('status', False))
+                writer.close()
+            if not self.stopped:
+                await asyncio.sleep(self.RETRY_SECONDS)
+
+    async def send(self, writer, message):
+        writer.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+        await writer.drain()
+
+    async def session(self, reader, writer):
+        await self.send(writer, {'type': 'hello', 'register': self.register_id,
+                                 'catalog_revision': self.catalog_revision,
+                                 'catalog_dirty': self.pending_catalog is not None})
+        self.connected = True
+        self.incoming.put(('status', True))
+        receiver = asyncio.create_task(self.receive(reader))
+        self.wakeup.set()
+        try:
+            while not self.stopped:
+                waiter = asyncio.create_task(self.wakeup.wait())
+                done, _ = await asyncio.wait({waiter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+                if receiver in done:
+                    waiter.cancel()
+                    receiver.result()
+                    return
+                self.wakeup.clear()
+                with self.lock:
+                    # 変更は catalog_ack を受け取るまで残し、接続が切れたら送り直す
+                    catalog = self.pending_catalog
+                    if catalog is None or (self.catalogs_in_flight and self.catalogs_in_flight[-1] is catalog):
+                        catalog = None
+                    else:
+                        self.catalogs_in_flight.append(catalog)
+                    batch = [sale for sale in self.outbox if sale['id'] not in self.in_flight][:self.BATCH_SIZE]
+                    self.in_flight.update(sale['id'] for sale in batch)
+                if catalog is not None:
+                    await self.send(writer, {'type': 'catalog', 'catalog': catalog})
+                if batch:
+                    await self.send(writer, {'type': 'sales', 'sales': batch})
+        finally:
+            receiver.cancel()
+
+    async def receive(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionResetError("同期サーバーとの接続が切れました")
+            message = json.loads(line)
+            if message['type'] == 'ack':
+                acked = set(message['ids'])
+                with self.lock:
+                    self.outbox = [sale for sale in self.outbox if sale['id'] not in acked]
+                    self.in_flight -= acked
+                    self.write_outbox()
+                    more = bool(self.outbox)
+                if more:
+                    self.wakeup.set()  # 残りの販売を続けて送る
+                self.incoming.put(('status', True))
+            elif message['type'] in ('catalog', 'catalog_ack'):
+                if message['type'] == 'catalog_ack':
+                    # サーバーは受け取った順に ack を返す
+                    with self.lock:
+                        acked = self.catalogs_in_flight.popleft() if self.catalogs_in_flight else None
+                        if acked is not None and acked is self.pending_catalog:
+                            self.pending_catalog = None
+                self.catalog_revision = message['revision']
+                self.incoming.put((message['type'], message))
+
+
+class BackgroundLoader:
+    """履歴をワーカースレッドで読み込み、root.after で少しずつ Treeview に追加する"""
+    CHUNK_SIZE = 500
+    POLL_MS = 10
+
+    def __init__(self, root, parent, tree, rows_factory, text="読み込み中"):
+        self.root = root
+        self.tree = tree
+        self.rows_factory = rows_factory
+        self.text = text
+        self.queue = queue.Queue()
+        self.pending = []  # 読み込み中に追加された行（読み込み完了後に末尾へ追加）
+        self.loaded = 0
+        self.done = False
+        self.cancelled = False
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+
+        # 進捗表示
+        self.status_frame = tk.Frame(parent)
+        self.status_frame.pack(fill=tk.X, before=tree)
+        self.status_label = tk.Label(self.status_frame, text=f"{text}...")
+        self.status_label.pack(side=tk.LEFT, padx=5)
+        self.progress = ttk.Progressbar(self.status_frame, mode='indeterminate', length=150)
+        self.progress.pack(side=tk.LEFT, padx=5)
+
+    def start(self):
+        self.progress.start()
+        self.thread.start()
+        self.root.after(self.POLL_MS, self.poll)
+
+    def worker(self):
+        # Tk はメインスレッドからしか触れないため、ここでは読み込みと解析だけを行う
+        chunk = []
+        try:
+            for row in self.rows_factory():
+                if self.cancelled:
+                    return
+                chunk.append(row)
+                if len(chunk) >= self.CHUNK_SIZE:
+                    self.queue.put(chunk)
+                    chunk = []
+        finally:
+            if chunk:
+                self.queue.put(chunk)
+            self.queue.put(None)
+
+    def poll(self):
+        if self.cancelled or not self.tree.winfo_exists():
+            self.cancelled = True
+            return
+        try:
+            chunk = self.queue.get_nowait()
+        except queue.Empty:
+            self.root.after(self.POLL_MS, self.poll)
+            return
+        if chunk is None:
+            self.finish()
+            return
+        for row in chunk:
+            self.tree.insert("", "end", values=row)
+        self.loaded += len(chunk)
+        self.status_label.config(text=f"{self.text}... {self.loaded}件")
+        # 1チャンクごとにイベントループへ制御を返す
+        self.root.after(1, self.poll)
+
+    def finish(self):
+        for row in self.pending:
+            self.tree.insert("", "end", values=row)
+        self.pending = []
+        self.done = True
+        self.progress.stop()
+        self.status_frame.destroy()
+
+    def append(self, row):
+        """読み込み中に追加された行は、読み込み済みの行の後ろに並ぶように保留する"""
+        if self.done:
+            self.tree.insert("", "end", values=row)
+        else:
+            self.pending.append(row)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class StartupProfiler:
+    """起動処理の各段階の所要時間とウィジェット数を計測し、JSONとChromeトレース形式で書き出す"""
+
+    def __init__(self, root, enabled=False):
+        self.root = root
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.phases = []
+        self.depth = 0
+
+    def count_widgets(self):
+        """(ウィジェット数, Treeview のアイテム数) を数える"""
+        widgets, items = 0, 0
+        stack = [self.root]
+        while stack:
+            widget = stack.pop()
+            widgets += 1
+            if isinstance(widget, ttk.Treeview):
+                items += len(widget.get_children(''))
+            stack.extend(widget.winfo_children())
+        return widgets, items
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        widgets_before, items_before = self.count_widgets()
+        start = time.perf_counter()
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            end = time.perf_counter()
+            widgets_after, items_after = self.count_widgets()
+            self.phases.append({
+                'name': name,
+                'depth': self.depth,
+                'start_ms': (start - self.origin) * 1000,
+                'duration_ms': (end - start) * 1000,
+                'widgets_created': widgets_after - widgets_before,
+                'tree_items_created': items_after - items_before,
+            })
+
+    def write_report(self, report_path="startup_profile.json", trace_path="startup_trace.json"):
+        if not self.enabled:
+            return
+        widgets, items = self.count_widgets()
+        phases = sorted(self.phases, key=lambda p: p['start_ms'])
+        report = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'total_ms': (time.perf_counter() - self.origin) * 1000,
+            'widgets': widgets,
+            'tree_items': items,
+            'phases': phases,
+        }
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        # chrome://tracing や Perfetto で開ける形式
+        events = [{
+            'name': p['name'], 'ph': 'X', 'pid': 1, 'tid': 1,
+            'ts': p['start_ms'] * 1000, 'dur': p['duration_ms'] * 1000,
+            'args': {'widgets_created': p['widgets_created'], 'tree_items_created': p['tree_items_created']},
+        } for p in phases]
+        with open(trace_path, "w", encoding="utf-8") as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+
+
+class LatencyWatchdog:
+    """ボタン操作などの処理時間とメインループの遅延を計測する（--watchdog または環境変数 PGS_WATCHDOG で有効）
+
+    計測する関数はインスタンスの属性を計測用の関数に置き換えるので、無効のときは何も変わらない。
+    しきい値を超えた処理は latency.log（サイズで切り替え）に記録し、F12 で百分位数の一覧を表示する。
+    """
+    THRESHOLD_MS = 50
+    HEARTBEAT_MS = 100
+    SAMPLES = 2000  # 百分位数の計算に使う直近の件数（関数ごと）
+    HEARTBEAT = "メインループの遅延"
+
+    def __init__(self, root, enabled=False, log_path="latency.log"):
+        self.root = root
+        self.enabled = enabled
+        self.samples = {}  # 名前 -> 直近の処理時間（ミリ秒）
+        self.counts = {}   # 名前 -> 呼び出し回数
+        self.waiting = 0.0  # ダイアログで利用者の操作を待っていた秒数の合計
+        self.panel = None
+        if not enabled:
+            return
+        self.logger = logging.getLogger("PointGuiSale.latency")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        handler = RotatingFileHandler(log_path, maxBytes=1_000_000, backupCount=3, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        self.logger.addHandler(handler)
+        self.logger.info("計測を開始しました")
+
+    def record(self, name, ms):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=self.SAMPLES)
+        samples.append(ms)
+        self.counts[name] = self.counts.get(name, 0) + 1
+        if ms >= self.THRESHOLD_MS:
+            self.logger.warning(f"{name} {ms:.1f}ms")
+
+    def wrap(self, obj, names):
+        """obj の各メソッドを処理時間を計測する関数に置き換える"""
+        if not self.enabled:
+            return
+        for name in names:
+            setattr(obj, name, self.timed(name, getattr(obj, name)))
+
+    def timed(self, name, func):
+        perf_counter = time.perf_counter
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start, waiting = perf_counter(), self.waiting
+            try:
+                return func(*args, **kwargs)
+            finally:
+                # 確認ダイアログなどで待っていた時間は除く
+                self.record(name, (perf_counter() - start - (self.waiting - waiting)) * 1000)
+        return wrapper
+
+    @contextmanager
+    def paused(self):
+        """ダイアログで利用者の操作を待つ間を囲む（この間の時間は処理時間に含めない）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.waiting += time.perf_counter() - start
+
+    def start(self):
+        """root.after による一定間隔の呼び出しで、予定からの遅れをメインループの遅延として測る"""
+        if not self.enabled:
+            return
+        self.root.bind_all("<F12>", self.show_panel)
+        self.expected = time.perf_counter() + self.HEARTBEAT_MS / 1000
+        self.root.after(self.HEARTBEAT_MS, self.heartbeat)
+
+    def heartbeat(self):
+        now = time.perf_counter()
+        self.record(self.HEARTBEAT, max(0.0, (now - self.expected) * 1000))
+        self.expected = now + self.HEARTBEAT_MS / 1000
+        self.root.after(self.HEARTBEAT_MS, self.heartbeat)
+
+    def percentiles(self):
+        """(名前, 回数, p50, p95, p99, 最大) の一覧（ミリ秒、直近 SAMPLES 件から計算）"""
+        rows = []
+        for name, samples in sorted(self.samples.items()):
+            values = sorted(samples)
+            rows.append([name, self.counts[name]]
+                        + [values[min(len(values) - 1, int(q * len(values)))] for q in (0.5, 0.95, 0.99)]
+                        + [values[-1]])
+        return rows
+
+    def show_panel(self, event=None):
+        if self.panel is not None and self.panel.winfo_exists():
+            self.panel.lift()
+            return
+        self.panel = tk.Toplevel(self.root)
+        self.panel.title("応答時間（ミリ秒）")
+        tree = ttk.Treeview(self.panel, show='headings', height=12)
+        tree.pack(fill=tk.BOTH, expand=True)
+
+        def refresh():
+            if not self.panel.winfo_exists():
+                return
+            set_tree_table(tree, ["処理", "回数", "p50", "p95", "p99", "最大"],
+                           ([name, count] + [f"{value:.1f}" for value in values]
+                            for name, count, *values in self.percentiles()))
+            self.panel.after(1000, refresh)
+
+        refresh()
+
+    def write_summary(self):
+        """終了時に処理ごとの百分位数をログに残す"""
+        if not self.enabled:
+            return
+        for name, count, *values in self.percentiles():
+            p50, p95, p99, worst = (f"{value:.1f}" for value in values)
+            self.logger.info(f"集計 {name}: {count}回 p50={p50}ms p95={p95}ms p99={p99}ms 最大={worst}ms")
+
+
+def set_entry_text(entry, text):
+    """入力欄の内容が異なる場合のみ書き換える"""
+    if entry.get() != text:
+        entry.delete(0, tk.END)
+        entry.insert(0, text)
+
+
+def set_tree_table(tree, headings, rows):
+    """Treeview の列を見出しに合わせて作り直し、行を入れ替える"""
+    columns = [f'col{i}' for i in range(len(headings))]
+    tree.delete(*tree.get_children())
+    tree['columns'] = columns
+    for column, heading in zip(columns, headings):
+        tree.heading(column, text=heading)
+        tree.column(column, width=20)
+    for row in rows:
+        tree.insert("", "end", values=row)
+
+
+def diff_rows(old, new):
+    """位置ごとに旧リストと新リストを比較し、(変更, 追加, 削除) のインデックスを返す"""
+    common = min(len(old), len(new))
+    changed = [i for i in range(common) if old[i] != new[i]]
+    return changed, list(range(common, len(new))), list(range(common, len(old)))
+
+
 class ProductCounterApp:
-    def __init__(self, root):
+    # 応答時間を計測する操作（setup_*_tab はすべて計測する）
+    WATCHED_CALLBACKS = ('update_count', 'clear_count', 'clear_cart', 'refresh_cart', 'save_log',
+                         'restore_from_history', 'on_code_entry', 'refresh_catalog')
+
+    def __init__(self, root, profile=False, watchdog=False):
         self.root = root
         self.root.title("PointGuiSale")
+
+        # 起動時間の計測（--profile または環境変数 PGS_PROFILE で有効）
+        self.profiler = StartupProfiler(root, profile or bool(os.environ.get("PGS_PROFILE")))
+        # 操作ごとの応答時間の計測（--watchdog または環境変数 PGS_WATCHDOG で有効）
+        # ボタンに渡す前に置き換えるので、タブを作るより先に行う
+        self.watchdog = LatencyWatchdog(root, watchdog or bool(os.environ.get("PGS_WATCHDOG")))
+        self.watchdog.wrap(self, self.WATCHED_CALLBACKS + tuple(
+            name for name in dir(type(self)) if name.startswith("setup_") and name.endswith("_tab")))
         
         # 初期設定：商品数、資格数、およびデータの読み込み
-        self.load_product_count()
-        self.load_products_from_csv()
-        self.load_qualification_count()
-        self.load_qualifications_from_csv()
-        self.load_question_responses()
-        self.load_image_scale()
-        self.load_survey_count()
+        for loader in (self.load_config,
+                       self.load_product_count,
+                       self.load_products,
+                       self.load_qualification_count,
+                       self.load_qualifications,
+                       self.load_question_responses,
+                       self.load_image_scale,
+                       self.load_register_layout,
+                       self.load_list_mode,
+                       self.load_storage_mode,
+                       self.load_write_policy,
+                       self.load_segment_mode,
+                       self.open_storage,
+                       self.load_survey_count,
+                       self.load_aggregates,
+                       self.load_survey_tallies,
+                       self.load_columns,
+                       self.load_sync_settings):
+            with self.profiler.phase(loader.__name__):
+                loader()
         
-        self.product_counts = [0] * self.product_count
-        self.product_images = [None] * self.product_count  # 画像を格納するリスト
+        self.pricing = PricingEngine(self.products, self.qualifications)
+        self.cart = Cart(self.pricing.prices)
+        self.dirty_counts = set()  # 次の描画で個数の表示を更新する商品
+        self.cart_refresh_scheduled = False
+        self.log_loader = None
+        self.survey_loader = None
+        self.log_view = None
+        self.survey_view = None
+        self.history_index = None  # 検索タブで初めて検索したときに作成
+        self.thumbnail_cache = ThumbnailCache()  # レジタブと管理タブで共有するサムネイル
 
         # デフォルトのウィンドウサイズの初期化
         self.default_width = 500
         self.default_height = 260 + (20 + 20 * self.image_scale) * len(self.products)
         self.update_window_size()
 
-        self.setup_tabs()
-        self.load_survey_from_csv() 
+        # アンケート結果は setup_survey_tab の中で読み込まれる
+        with self.profiler.phase("setup_tabs"):
+            self.setup_tabs()
         self.update_total_price()
 
         # ウィンドウのサイズ変更を許可
 
-        self.root.resizable(True, True)
+        self.root.resizable(True, True)
+        # 終了時に書き込み待ちの販売記録を書き込む
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        self.start_sync()
+        self.watchdog.start()
+
+        if self.profiler.enabled:
+            # ウィンドウが表示されてイベントループが空いた時点を起動完了とする
+            self.root.after_idle(self.finish_startup_profile)
+
+    def finish_startup_profile(self):
+        with self.profiler.phase("first_draw"):
+            self.root.update_idletasks()
+        self.profiler.write_report()
+
+    def load_config(self):
+        """設定の読み込み（以前の個別の設定ファイルは初回に settings.json へ移行）"""
+        self.config = ConfigStore("settings.json", after=self.root.after)
+
+    def load_image_scale(self):
+        """画像倍率設定の読み込み"""
+        self.image_scale = int(self.config.get('image_scale'))
+
+    def save_image_scale(self):
+        """画像倍率設定の保存"""
+        self.config.set('image_scale', self.image_scale)
+
+    def load_register_layout(self):
+        """レジの商品表示の読み込み（rows: 商品ごとの行, catalog: 検索できる一覧）"""
+        self.register_layout = self.config.get('register_layout')
+        if self.register_layout not in ("rows", "catalog"):
+            self.register_layout = "rows"
+
+    def save_register_layout(self):
+        self.config.set('register_layout', self.register_layout)
+
+    def load_list_mode(self):
+        """履歴表示モードの読み込み（full: 全件表示, virtual: 仮想リスト）"""
+        self.list_mode = self.config.get('list_mode')
+        if self.list_mode not in ("full", "virtual"):
+            self.list_mode = "full"
+
+    def save_list_mode(self):
+        """履歴表示モードの保存"""
+        self.config.set('list_mode', self.list_mode)
+
+    def load_storage_mode(self):
+        """保存形式の読み込み（csv: CSVログ, sqlite: SQLite台帳）"""
+        self.storage_mode = self.config.get('storage_mode')
+        if self.storage_mode not in ("csv", "sqlite"):
+            self.storage_mode = "csv"
+
+    def save_storage_mode(self):
+        """保存形式の保存"""
+        self.config.set('storage_mode', self.storage_mode)
+
+    def load_write_policy(self):
+        """CSVログの書き込み方針の読み込み（always / interval / idle と間隔ミリ秒）"""
+        self.write_policy, self.write_interval_ms = self.config.get('write_policy')
+
+    def save_write_policy(self):
+        self.config.set('write_policy', [self.write_policy, self.write_interval_ms])
+
+    def load_segment_mode(self):
+        """販売履歴の区切り方の読み込み（day: 日ごと, event: イベントごとに手動で区切る）"""
+        self.segment_mode = self.config.get('segment_mode')
+        if self.segment_mode not in LogSegments.MODES:
+            self.segment_mode = "day"
+
+    def save_segment_mode(self):
+        self.config.set('segment_mode', self.segment_mode)
+
+    def open_storage(self):
+        """SQLite台帳またはCSVログの書き込みスレッドを開く（台帳とCSVログの差分は開くたびに互いに反映する）"""
+        self.close_storage()
+        # 起動時に開くのは書き込み中のセグメントとマニフェストだけ
+        self.segments = LogSegments("logs", self.segment_mode)
+        self.viewed_segments = {'sales': None, 'surveys': None}  # 履歴タブで表示中の閉じたセグメント
+        self.catalog_history = None  # 変更履歴は保存形式ごとに読み直す
+        if self.storage_mode == "sqlite":
+            self.ledger = SalesLedger("ledger.db")
+        else:
+            self.sale_writer = SaleWriter("log.csv", "survey_log.csv", "log_journal.jsonl",
+                                          self.write_policy, self.write_interval_ms)
+        if self.segments.legacy_pending():
+            # 以前の log.csv の年はウィンドウが表示されてから尋ね、台帳との差分の反映もその後に行う
+            self.root.after_idle(self.ask_legacy_log_year)
+        else:
+            self.sync_storage()
+
+    def sync_storage(self):
+        """台帳とCSVログの差分を反映し、前日までのセグメントを閉じる"""
+        if self.ledger:
+            self.ledger.sync_csv(".", self.segments)
+        else:
+            if os.path.exists("ledger.db"):
+                # SQLiteで記録した販売があればCSVの末尾に書き出す（ジャーナルの反映が終わってから）
+                ledger = SalesLedger("ledger.db")
+                try:
+                    if ledger.needs_csv_export():
+                        ledger.sync_csv(".", self.segments)
+                finally:
+                    ledger.close()
+            # ジャーナルの反映が終わってから前日までのセグメントを閉じる
+            if self.segments.needs_rotation():
+                self.rotate_segment()
+
+    def ask_legacy_log_year(self):
+        """以前のバージョンの log.csv を取り込んだときに、最初の販売の年を尋ねる（日付に年がないため）"""
+        if not self.segments.legacy_pending():
+            return
+        guessed = self.segments.active_started().year
+        with self.watchdog.paused():
+            year = simpledialog.askinteger("販売履歴の年", "以前の販売履歴（log.csv）の最初の販売は何年ですか？",
+                                           parent=self.root, initialvalue=guessed,
+                                           minvalue=2000, maxvalue=datetime.now().year)
+        self.segments.set_legacy_year(year or guessed)
+        self.sync_storage()
+
+    def rotate_segment(self, now=None):
+        """書き込み中のセグメントを閉じて新しいセグメントを始める"""
+        if not self.flush_sales():
+            # 再試行待ちの販売は今の log.csv に書き込まれるので、書き込めるまで閉じない
+            return
+        self.segments.rotate(now)
+        self.viewed_segments = {'sales': None, 'surveys': None}
+
+    def close_storage(self):
+        if getattr(self, 'sale_writer', None):
+            self.sale_writer.close()
+        if getattr(self, 'ledger', None):
+            self.ledger.close()
+        self.sale_writer = None
+        self.ledger = None
+
+    def flush_sales(self):
+        """書き込み待ちの販売記録をCSVに書き込む（CSVを直接読む前に呼ぶ）
+
+        書き込めずに再試行を待っている販売があれば False を返す（CSVにはその販売がまだない）。
+        """
+        if self.sale_writer:
+            return self.sale_writer.flush() == 0
+        return True
+
+    def on_close(self):
+        self.stop_sync()
+        self.close_storage()
+        if self.columns:
+            self.columns.close()
+        self.config.flush()
+        self.aggregates.flush()
+        self.survey_tallies.flush()
+        self.watchdog.write_summary()
+        self.root.destroy()
+
+    def load_sync_settings(self):
+        """複数レジの同期設定の読み込み（レジIDは初回に作って保存する）"""
+        self.register_id = self.config.get('register_id')
+        if not self.register_id:
+            self.register_id = f"R{uuid.uuid4().hex[:6]}"
+            self.config.set('register_id', self.register_id)
+        self.sync_server = self.config.get('sync_server')
+        self.sync_client = None
+
+    def start_sync(self):
+        """同期サーバーが設定されていれば同期を始める"""
+        if not self.sync_server:
+            return
+        try:
+            self.sync_client = SyncClient(self.register_id, self.sync_server, "sync_outbox.jsonl",
+                                          self.config.get('sync_catalog_revision'))
+        except ValueError:
+            messagebox.showwarning("警告", "同期サーバーは「ホスト:ポート」の形式で入力してください。")
+            return
+        self.sync_client.start()
+        self.root.after(self.SYNC_POLL_MS, self.poll_sync)
+
+    def stop_sync(self):
+        if self.sync_client:
+            self.sync_client.close()
+            self.sync_client = None
+
+    SYNC_POLL_MS = 500
+
+    def poll_sync(self):
+        """同期スレッドから届いたカタログの変更と接続状態を反映"""
+        client = self.sync_client
+        if client is None:
+            return
+        while True:
+            try:
+                kind, message = client.incoming.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'catalog':
+                self.apply_remote_catalog(message['catalog'])
+            if kind in ('catalog', 'catalog_ack'):
+                self.config.set('sync_catalog_revision', message['revision'])
+        if self.is_tab_built('management'):
+            state = "接続中" if client.connected else "未接続"
+            self.sync_status_label.config(text=f"{state}（送信待ち {client.pending()}件）")
+        self.root.after(self.SYNC_POLL_MS, self.poll_sync)
+
+    def catalog_snapshot(self):
+        return {'products': self.products, 'qualifications': self.qualifications,
+                'question_responses': self.survey_responses}
+
+    def push_catalog(self):
+        """商品・資格・質問の変更を他のレジに配る"""
+        if self.sync_client:
+            self.sync_client.push_catalog(copy.deepcopy(self.catalog_snapshot()))
+
+    def apply_remote_catalog(self, catalog):
+        """他のレジで変更された商品・資格・質問を反映（ここからは送り返さない）"""
+        if catalog['products'] != self.products:
+            old_products = self.products
+            self.products = catalog['products']
+            self.product_count = len(self.products)
+            # 他のレジで付けた商品IDと重ならないように次の番号を進める
+            next_id = max([product.get('id', 0) for product in self.products] + [0]) + 1
+            if next_id > self.config.get('next_product_id'):
+                self.config.set('next_product_id', next_id)
+            self.save_product_count()
+            self.save_products()
+            self.record_product_version()
+            if self.is_tab_built('management'):
+                set_entry_text(self.product_count_entry, str(self.product_count))
+            self.update_window_size()
+            self.sync_product_views(old_products)
+        if catalog['qualifications'] != self.qualifications:
+            old_qualifications = self.qualifications
+            self.qualifications = catalog['qualifications']
+            self.qualification_count = len(self.qualifications)
+            self.save_qualification_count()
+            self.save_qualifications()
+            self.record_qualification_version()
+            if self.is_tab_built('qualification'):
+                set_entry_text(self.qualification_count_entry, str(self.qualification_count))
+            self.sync_qualification_views(old_qualifications)
+        if catalog['question_responses'] != self.survey_responses:
+            old_questions = self.survey_responses
+            self.survey_responses = catalog['question_responses']
+            self.save_question_responses()
+            self.record_question_renames(old_questions)
+            if self.is_tab_built('question'):
+                set_entry_text(self.question_count_entry, str(len(self.survey_responses)))
+                self.sync_question_rows(old_questions)
+            self.sync_survey_menu()
+        self.update_total_price()
+
+    def change_sync_settings(self):
+        register_id = self.register_id_entry.get().strip()
+        if not register_id:
+            messagebox.showwarning("警告", "レジIDを入力してください。")
+            return
+        self.register_id = register_id
+        self.sync_server = self.sync_server_entry.get().strip()
+        self.config.set('register_id', self.register_id)
+        self.config.set('sync_server', self.sync_server)
+        self.stop_sync()
+        self.start_sync()
+
+    def load_columns(self):
+        """列ストアを開く（NumPy がない環境では使わない。未作成なら最初に集計するときに作る）"""
+        self.columns = ColumnarSales("columns") if np is not None else None
+
+    def ensure_columns(self):
+        """列ストアが未作成なら保存済みの履歴から作る（1度だけ）"""
+        if self.columns is None or self.columns.ready:
+            return
+        self.columns.create()
+        rows = self.iter_log_rows_with_start()
+        # 以前の行は商品の位置で記録されているので、販売した時刻の商品名から現在の商品のIDを探す
+        # （名前が変わっている商品は現在の同じ位置の商品とみなす）
+        ids = [product.get('id') for product in self.products]
+        ids_by_name = {product['name']: product.get('id') for product in self.products}
+        history = self.get_catalog_history()
+        batch = []
+        for started, row in rows:
+            if len(row) < 5:
+                continue
+            counts = [int(count or 0) for count in row[5:]]
+            try:
+                timestamp = int(row_datetime(row[0], row[1], started).timestamp())
+            except ValueError:
+                timestamp = int(started.timestamp())  # 日時が読めない行は1つ前の行の日時とする
+            pricing = history.pricing_for_sale(row, counts, timestamp)
+            items = {}
+            for i, (name, count, price) in enumerate(zip(pricing.names, counts, pricing.prices)):
+                product_id = ids_by_name.get(name, ids[i] if i < len(ids) else None)
+                if count and product_id is not None:
+                    quantity, amount = items.get(product_id, (0, 0))
+                    items[product_id] = (quantity + count, amount + count * price)
+            batch.append((timestamp, int(row[4]), pricing.price(counts, row[3])[0], row[3], items))
+            if len(batch) >= 50000:
+                self.columns.append_many(batch)
+                batch = []
+        self.columns.append_many(batch)
+
+    def get_catalog_history(self):
+        """商品・資格の変更履歴を最初に使うときに読み込む（以後は変更のたびに版を加える）"""
+        if self.catalog_history is None:
+            self.catalog_history = load_catalog_history(self.products, self.qualifications, self.ledger)
+        return self.catalog_history
 
-    def load_image_scale(self):
-        """画像倍率設定の読み込み"""
-        try:
-            with open("image_scale.txt", "r") as f:
-                self.image_scale = int(f.read().strip())
-        except FileNotFoundError:
-            self.image_scale = 1  # 初期設定はx1
-            self.save_image_scale()
+    def load_aggregates(self):
+        """販売集計のスナップショットの読み込み"""
+        self.aggregates = SalesAggregates("aggregates.json", after=self.root.after)
 
-    def save_image_scale(self):
-        """画像倍率設定の保存"""
-        with open("image_scale.txt", "w") as f:
-            f.write(str(self.image_scale))
+    def load_survey_tallies(self):
+        """アンケートの回答数のスナップショットの読み込み"""
+        self.survey_tallies = SurveyTallies("survey_tallies.json", after=self.root.after)
 
     def load_product_count(self):
-        try:
-            with open("product_count.csv", "r", newline="", encoding="utf-8") as f:
-                reader = csv.reader(f)
-                self.product_count = int(next(reader)[0])
-        except FileNotFoundError:
-            self.product_count = 6  # 初期値
-            self.save_product_count_to_csv()
+        self.product_count = int(self.config.get('product_count'))
 
     def load_survey_count(self):
-        try:
-            with open("survey_count.csv", "r", newline="", encoding="utf-8") as f:
-                reader = csv.reader(f)
-                self.survey_count = int(next(reader)[0])
-        except FileNotFoundError:
-            self.survey_count = 3  # 初期値
-            self.save_survey_count_to_csv()
+        self.survey_count = int(self.config.get('survey_count'))
     
-    def save_product_count_to_csv(self):
-        with open("product_count.csv", "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([self.product_count])
+    def save_product_count(self):
+        self.config.set('product_count', self.product_count)
 
-    def save_survey_count_to_csv(self):
-        with open("survey_count.csv", "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([self.survey_count])
+    def save_survey_count(self):
+        self.config.set('survey_count', self.survey_count)
 
     def load_qualification_count(self):
-        try:
-            with open("qualification_count.csv", "r", newline="", encoding="utf-8") as f:
-                reader = csv.reader(f)
-                self.qualification_count = int(next(reader)[0])
-        except FileNotFoundError:
-            self.qualification_count = 3  # 初期値
-            self.save_qualification_count_to_csv()
+        self.qualification_count = int(self.config.get('qualification_count'))
     
-    def save_qualification_count_to_csv(self):
-        with open("qualification_count.csv", "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([self.qualification_count])
+    def save_qualification_count(self):
+        self.config.set('qualification_count', self.qualification_count)
 
     def load_question_responses(self):
-        try:
-            with open("question_responses.csv", "r", newline="", encoding="utf-8") as f:
-                reader = csv.reader(f)
-                self.survey_responses = [row[0] for row in reader]
-        except FileNotFoundError:
-            self.survey_responses = ["未回答", "回答1", "回答2"]  # 初期値
-            self.save_question_responses_to_csv()
+        self.survey_responses = self.config.get('question_responses')
 
-    def save_question_responses_to_csv(self):
-        with open("question_responses.csv", "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            for response in self.survey_responses:
-                writer.writerow([response])
+    def save_question_responses(self):
+        self.config.set('question_responses', self.survey_responses)
     
     def setup_tabs(self):
         self.notebook = ttk.Notebook(self.root)
         self.notebook.pack(fill=tk.BOTH, expand=True)
-        
-        self.setup_log_tab()
-        self.setup_survey_tab()  # 新しいアンケートタブのセットアップ
-        self.setup_question_tab()  # 新しい質問タブのセットアップ
-        self.setup_qualification_tab()
-        self.setup_management_tab()
-        self.setup_register_tab()
+
+        # 各タブは最初に選択されるまで中身のない枠だけを置いておく
+        self.tab_builders = {
+            'log': self.setup_log_tab,
+            'survey': self.setup_survey_tab,  # 新しいアンケートタブのセットアップ
+            'analytics': self.setup_analytics_tab,
+            'search': self.setup_search_tab,
+            'question': self.setup_question_tab,  # 新しい質問タブのセットアップ
+            'qualification': self.setup_qualification_tab,
+            'management': self.setup_management_tab,
+            'register': self.setup_register_tab,
+        }
+        tab_texts = {'log': "履歴", 'survey': "回答", 'analytics': "集計", 'search': "検索",
+                     'question': "質問",
+                     'qualification': "資格", 'management': "管理", 'register': "レジ"}
+        self.tab_pages = {}
+        self.built_tabs = set()
+        self.dirty_tabs = set()
+        for key, text in tab_texts.items():
+            page = ttk.Frame(self.notebook)
+            self.notebook.add(page, text=text)
+            self.tab_pages[key] = page
+            self.dirty_tabs.add(key)
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+
+        # レジタブだけはすぐに使えるように作成して表示する
+        self.ensure_tab('register')
+        self.notebook.select(self.tab_pages['register'])
+
+    def on_tab_changed(self, event=None):
+        selected = self.notebook.select()
+        for key, page in self.tab_pages.items():
+            if str(page) == selected:
+                self.ensure_tab(key)
+                if key == 'analytics':
+                    self.refresh_analytics_tab()
+
+    def ensure_tab(self, key):
+        """タブが未作成または要更新なら作成する"""
+        if key in self.dirty_tabs:
+            self.dirty_tabs.discard(key)
+            with self.profiler.phase(self.tab_builders[key].__name__):
+                self.tab_builders[key]()
+            self.built_tabs.add(key)
+
+    def is_tab_built(self, key):
+        """タブが作成済みで最新の状態かどうか"""
+        return key in self.built_tabs and key not in self.dirty_tabs
+
+    def invalidate_tab(self, key):
+        """タブを要更新にする（表示中のタブだけはすぐに作り直す）"""
+        self.dirty_tabs.add(key)
+        if self.notebook.select() == str(self.tab_pages[key]):
+            self.ensure_tab(key)
 
     def setup_register_tab(self):
         if hasattr(self, 'register_frame'):
             self.register_frame.destroy()
         
-        self.register_frame = ttk.Frame(self.notebook)
-        self.notebook.add(self.register_frame, text="レジ")
+        self.register_frame = ttk.Frame(self.tab_pages['register'])
+        self.register_frame.pack(fill=tk.BOTH, expand=True)
         
         # 名前入力
         name_frame = tk.Frame(self.register_frame)
@@ -160,7 +3480,7 @@ class ProductCounterApp:
         self.qualification_menu['values'] = [q['name'] for q in self.qualifications]
         self.qualification_menu.current(0)
         self.qualification_menu.pack(side=tk.LEFT, padx=10)
-        self.qualification_var.trace("w", self.update_total_price)
+        self.qualification_var.trace("w", lambda *args: self.schedule_cart_refresh())
 
         # アンケートのチェックボックス
         tk.Label(quali_frame, text="質問:").pack(side=tk.LEFT)
@@ -170,6 +3490,17 @@ class ProductCounterApp:
         self.survey_menu.current(0)
         self.survey_menu.pack(side=tk.LEFT, padx=10)
 
+        # バーコードリーダーやキーボードからの商品コードの高速入力
+        code_frame = tk.Frame(self.register_frame)
+        code_frame.pack(fill=tk.X, padx=5, pady=5)
+        tk.Label(code_frame, text="コード:").pack(side=tk.LEFT)
+        self.code_entry = tk.Entry(code_frame, width=23)
+        self.code_entry.pack(side=tk.LEFT, padx=10)
+        self.code_entry.bind("<Return>", self.on_code_entry)
+        self.code_status_label = tk.Label(code_frame, text="", fg="red")
+        self.code_status_label.pack(side=tk.LEFT)
+        self.rebuild_code_index()
+
         send_frame = tk.Frame(self.register_frame)
         send_frame.pack(fill=tk.X, padx=5, pady=5)
         
@@ -190,54 +3521,251 @@ class ProductCounterApp:
         self.discount_label.pack(pady=5)
         
         self.entries = []
-        for i, product in enumerate(self.products):
-            frame = tk.Frame(self.register_frame)
-            frame.pack(fill=tk.X, padx=10, pady=5)
-
-            label = tk.Label(frame, text=product['name'], width=15)
-            label.pack(side=tk.LEFT)
-            
-            # 画像表示
-            image_label = tk.Label(frame, relief=tk.RAISED)
-            image_label.pack(side=tk.LEFT)
-            self.product_images[i] = image_label
-            self.update_product_image(i)
-            
-            entry = tk.Entry(frame, width=5, justify='center')
-            entry.insert(0, "0")
-            entry.config(state='readonly')
-            entry.pack(side=tk.LEFT, padx=10)
-            self.entries.append(entry)
-            
-            btn_frame = tk.Frame(frame)
-            btn_frame.pack(side=tk.LEFT, padx=10)
-            
-            tk.Button(btn_frame, text="+1", command=lambda i=i: self.update_count(i, 1)).pack(side=tk.LEFT)
-            tk.Button(btn_frame, text="+5", command=lambda i=i: self.update_count(i, 5)).pack(side=tk.LEFT)
-            tk.Button(btn_frame, text="+10", command=lambda i=i: self.update_count(i, 10)).pack(side=tk.LEFT)
-            tk.Label(btn_frame, text="   ").pack(side=tk.LEFT)
-            tk.Button(btn_frame, text="-1", command=lambda i=i: self.update_count(i, -1)).pack(side=tk.LEFT)
-            tk.Button(btn_frame, text="-5", command=lambda i=i: self.update_count(i, -5)).pack(side=tk.LEFT)
-            tk.Button(btn_frame, text="-10", command=lambda i=i: self.update_count(i, -10)).pack(side=tk.LEFT)
-            tk.Label(btn_frame, text="   ").pack(side=tk.LEFT)
-            tk.Button(btn_frame, text="クリア", command=lambda i=i: self.clear_count(i)).pack(side=tk.LEFT)
+        self.register_rows = []
+        self.catalog_view = None
+        if self.register_layout == "catalog":
+            self.setup_catalog_view()
+        else:
+            for i, product in enumerate(self.products):
+                self.add_register_row(i, product)
         
         # 合計金額表示
         self.total_label = tk.Label(self.register_frame, text="合計金額: 0円", font=("Helvetica", 16))
         self.total_label.pack(pady=10)
 
+        # 最近の販売（ファイルの末尾だけを読んで表示する）
+        tk.Label(self.register_frame, text="最近の販売").pack(anchor=tk.W, padx=10)
+        columns = ['time', 'name', 'qualification', 'total', 'survey']
+        self.recent_tree = ttk.Treeview(self.register_frame, columns=columns, show='headings',
+                                        height=self.RECENT_SALES)
+        self.recent_tree.pack(fill=tk.X, padx=10, pady=5)
+        for column, heading in zip(columns, ['時刻', '名前', '資格', '請求', '回答']):
+            self.recent_tree.heading(column, text=heading)
+            self.recent_tree.column(column, width=20)
+        self.recent_sales_list = deque(self.recent_sales(self.RECENT_SALES), maxlen=self.RECENT_SALES)
+        self.refresh_recent_sales()
+
+    RECENT_SALES = 5  # 最近の販売に表示する件数
+
+    def refresh_recent_sales(self):
+        self.recent_tree.delete(*self.recent_tree.get_children())
+        for log_row, survey_row in self.recent_sales_list:
+            self.recent_tree.insert("", "end", values=[log_row[1], log_row[2], log_row[3], log_row[4], survey_row[4]])
+
+    def rebuild_code_index(self):
+        """商品コードから商品番号を引く索引"""
+        self.code_index = {normalize_text(product['code']): i
+                           for i, product in enumerate(self.products) if product.get('code')}
+
+    def on_code_entry(self, event=None):
+        """入力されたコードの個数をすぐに増減し、描画は連続した入力の後にまとめて1回だけ行う"""
+        text = self.code_entry.get()
+        self.code_entry.delete(0, tk.END)
+        try:
+            entries = parse_code_entry(text)
+        except ValueError:
+            self.code_status_label.config(text=f"入力が無効です: {text}")
+            return
+        unknown = []
+        for code, delta in entries:
+            index = self.code_index.get(normalize_text(code))
+            if index is None:
+                unknown.append(code)
+                continue
+            self.cart.add(index, delta)
+            self.schedule_cart_refresh([index])
+        self.code_status_label.config(text=f"不明なコード: {' '.join(unknown)}" if unknown else "")
+
+    def setup_catalog_view(self):
+        """商品が多い場合のレジ表示（見えている行だけを作る一覧と商品名の検索）"""
+        search_frame = tk.Frame(self.register_frame)
+        search_frame.pack(fill=tk.X, padx=10, pady=2)
+        tk.Label(search_frame, text="検索:").pack(side=tk.LEFT)
+        self.catalog_search_entry = tk.Entry(search_frame, width=20)
+        self.catalog_search_entry.pack(side=tk.LEFT, padx=5)
+        self.catalog_search_entry.bind("<KeyRelease>", lambda event: self.refresh_catalog())
+        # Enter で最初に見つかった商品を1個追加する
+        self.catalog_search_entry.bind("<Return>", lambda event: self.add_first_catalog_match())
+        tk.Label(search_frame, text="分類:").pack(side=tk.LEFT)
+        self.catalog_category_menu = ttk.Combobox(search_frame, state="readonly", width=10)
+        self.catalog_category_menu.pack(side=tk.LEFT, padx=5)
+        self.catalog_category_menu.bind("<<ComboboxSelected>>", lambda event: self.refresh_catalog())
+        self.catalog_group_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(search_frame, text="分類ごとに表示", variable=self.catalog_group_var,
+                       command=self.refresh_catalog).pack(side=tk.LEFT)
+
+        list_frame = tk.Frame(self.register_frame)
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=2)
+        self.catalog_rows = CatalogRows(self.products, lambda: self.cart.counts)
+        self.catalog_view = VirtualTreeView(list_frame, ['name', 'price', 'count', 'category'], self.catalog_rows)
+        self.catalog_view.after_render = self.restore_catalog_selection
+        tree = self.catalog_view.tree
+        tree.config(height=12, selectmode='browse')
+        for column, heading, width in (('name', '商品', 120), ('price', '価格', 50),
+                                       ('count', '個数', 40), ('category', '分類', 60)):
+            tree.heading(column, text=heading)
+            tree.column(column, width=width)
+        tree.bind("<<TreeviewSelect>>", self.on_catalog_select)
+        tree.bind("<Double-1>", lambda event: self.update_catalog_count(1))
+        self.catalog_selected = None
+
+        btn_frame = tk.Frame(self.register_frame)
+        btn_frame.pack(padx=10, pady=2)
+        for text, delta in (("+1", 1), ("+5", 5), ("+10", 10), ("-1", -1), ("-5", -5), ("-10", -10)):
+            tk.Button(btn_frame, text=text, command=lambda delta=delta: self.update_catalog_count(delta)).pack(side=tk.LEFT)
+        tk.Button(btn_frame, text="クリア", command=self.clear_catalog_count).pack(side=tk.LEFT, padx=5)
+
+        self.rebuild_catalog_index()
+
+    def rebuild_catalog_index(self):
+        """商品リストが変わったときに検索の索引と分類の選択肢を作り直す"""
+        self.catalog_index = ProductSearchIndex(self.products)
+        self.catalog_rows.products = self.products
+        categories = sorted({product.get('category', "") for product in self.products} - {""})
+        self.catalog_category_menu['values'] = ["すべて"] + categories
+        if self.catalog_category_menu.get() not in categories:
+            self.catalog_category_menu.current(0)
+        self.refresh_catalog()
+
+    def refresh_catalog(self):
+        text = self.catalog_search_entry.get().strip()
+        indices = self.catalog_index.search(text) if text else range(len(self.products))
+        category = self.catalog_category_menu.get()
+        if category and category != "すべて":
+            indices = [i for i in indices if self.products[i].get('category', "") == category]
+        self.catalog_rows.set_filter(indices, self.catalog_group_var.get())
+        self.catalog_view.first = 0
+        self.catalog_view.render()
+
+    def on_catalog_select(self, event=None):
+        selection = self.catalog_view.tree.selection()
+        if selection and selection[0] in self.catalog_view.items:
+            position = self.catalog_view.first + self.catalog_view.items.index(selection[0])
+            index = self.catalog_rows.product_at(position)
+            if index is not None:
+                self.catalog_selected = index
+
+    def restore_catalog_selection(self):
+        """スクロールでアイテムの中身が入れ替わっても、選択中の商品の行を選択し直す"""
+        for k, item in enumerate(self.catalog_view.items):
+            if self.catalog_rows.product_at(self.catalog_view.first + k) == self.catalog_selected:
+                if self.catalog_view.tree.selection() != (item,):
+                    self.catalog_view.tree.selection_set(item)
+                return
+        if self.catalog_view.tree.selection():
+            self.catalog_view.tree.selection_remove(*self.catalog_view.tree.selection())
+
+    def add_first_catalog_match(self):
+        index = next((i for kind, i in self.catalog_rows.entries if kind == 'product'), None)
+        if index is not None:
+            self.catalog_selected = index
+            self.update_count(index, 1)
+
+    def update_catalog_count(self, delta):
+        if self.catalog_selected is not None:
+            self.update_count(self.catalog_selected, delta)
+
+    def clear_catalog_count(self):
+        if self.catalog_selected is not None:
+            self.clear_count(self.catalog_selected)
+
+    def show_count(self, index):
+        """商品の個数の表示を更新（カタログ表示では見えている行だけを描き直す）"""
+        if self.catalog_view:
+            self.catalog_view.render()
+            return
+        self.entries[index].config(state=tk.NORMAL)
+        self.entries[index].delete(0, tk.END)
+        self.entries[index].insert(0, str(self.cart.counts[index]))
+        self.entries[index].config(state='readonly')
+
+    def add_register_row(self, i, product, before=None):
+        frame = tk.Frame(self.register_frame)
+        frame.pack(fill=tk.X, padx=10, pady=5, before=before)
+
+        label = tk.Label(frame, text=product['name'], width=15)
+        label.pack(side=tk.LEFT)
+        
+        # 画像表示
+        image_label = tk.Label(frame, relief=tk.RAISED)
+        image_label.pack(side=tk.LEFT)
+        self.set_product_image(image_label, i)
+        
+        entry = tk.Entry(frame, width=5, justify='center')
+        entry.insert(0, str(self.cart.counts[i]))
+        entry.config(state='readonly')
+        entry.pack(side=tk.LEFT, padx=10)
+        self.entries.append(entry)
+        
+        btn_frame = tk.Frame(frame)
+        btn_frame.pack(side=tk.LEFT, padx=10)
+        
+        tk.Button(btn_frame, text="+1", command=lambda i=i: self.update_count(i, 1)).pack(side=tk.LEFT)
+        tk.Button(btn_frame, text="+5", command=lambda i=i: self.update_count(i, 5)).pack(side=tk.LEFT)
+        tk.Button(btn_frame, text="+10", command=lambda i=i: self.update_count(i, 10)).pack(side=tk.LEFT)
+        tk.Label(btn_frame, text="   ").pack(side=tk.LEFT)
+        tk.Button(btn_frame, text="-1", command=lambda i=i: self.update_count(i, -1)).pack(side=tk.LEFT)
+        tk.Button(btn_frame, text="-5", command=lambda i=i: self.update_count(i, -5)).pack(side=tk.LEFT)
+        tk.Button(btn_frame, text="-10", command=lambda i=i: self.update_count(i, -10)).pack(side=tk.LEFT)
+        tk.Label(btn_frame, text="   ").pack(side=tk.LEFT)
+        tk.Button(btn_frame, text="クリア", command=lambda i=i: self.clear_count(i)).pack(side=tk.LEFT)
+
+        self.register_rows.append({'frame': frame, 'label': label, 'image': image_label})
+
     def setup_log_tab(self):
         if hasattr(self, 'log_frame'):
             self.log_frame.destroy()
         
-        self.log_frame = ttk.Frame(self.notebook)
-        self.notebook.add(self.log_frame, text="履歴")
+        self.log_frame = ttk.Frame(self.tab_pages['log'])
+        self.log_frame.pack(fill=tk.BOTH, expand=True)
         
         # 日付、時刻、名前、資格、請求額のカラムを固定して、その後に商品が続くように設定
         columns = ['date', 'time', 'name', 'qualification', 'total'] + [f'product{i+1}' for i in range(self.product_count)]
-        self.log_tree = ttk.Treeview(self.log_frame, columns=columns, show='headings')
-        self.log_tree.pack(fill=tk.BOTH, expand=True)
+        self.add_segment_selector(self.log_frame, 'sales', 'log')
+        if self.list_mode == "virtual":
+            # 表示範囲の行だけを log.csv の索引から読み込む
+            self.log_view = VirtualTreeView(self.log_frame, columns, self.history_source('sales'))
+            self.log_tree = self.log_view.tree
+        else:
+            self.log_view = None
+            self.log_tree = ttk.Treeview(self.log_frame, columns=columns, show='headings')
+            self.log_tree.pack(fill=tk.BOTH, expand=True)
+        
+        self.set_log_headings()
         
+        # CSVから履歴を読み込む
+        self.load_log_from_csv()
+
+    def add_segment_selector(self, parent, table, key):
+        """閉じたセグメントがあれば、表示するセグメントの選択欄を置く"""
+        if self.ledger or not self.segments.segments:
+            return
+        segments = list(reversed(self.segments.segments))
+        labels = ["現在"] + [self.segments.label(segment) for segment in segments]
+        frame = tk.Frame(parent)
+        frame.pack(fill=tk.X, padx=5, pady=2)
+        tk.Label(frame, text="表示:").pack(side=tk.LEFT)
+        menu = ttk.Combobox(frame, values=labels, state="readonly", width=40)
+        menu.pack(side=tk.LEFT)
+        ids = [None] + [segment['id'] for segment in segments]
+        menu.current(ids.index(self.viewed_segments[table]) if self.viewed_segments[table] in ids else 0)
+
+        def on_select(event):
+            self.viewed_segments[table] = ids[menu.current()]
+            # 選択欄ごとタブを作り直すので、イベント処理が終わってから行う
+            self.root.after_idle(lambda: self.invalidate_tab(key))
+
+        menu.bind("<<ComboboxSelected>>", on_select)
+
+    def history_source(self, table):
+        """仮想リストの行ソース（閉じたセグメントは選ばれたときだけ展開する）"""
+        if self.ledger:
+            return self.ledger.row_source(table)
+        if self.viewed_segments[table]:
+            return SegmentRows(self.segments, table, self.viewed_segments[table])
+        return CsvRowIndex(SalesLedger.LOG_FILES[table])
+
+    def set_log_headings(self):
         # ヘッダーの設定
         self.log_tree.heading('date', text='日付')
         self.log_tree.heading('time', text='時刻')
@@ -255,20 +3783,264 @@ class ProductCounterApp:
         self.log_tree.column('total', width=20)
         for i in range(self.product_count):
             self.log_tree.column(f'product{i+1}', width=20)
-        
-        # CSVから履歴を読み込む
-        self.load_log_from_csv()
+
+    def setup_analytics_tab(self):
+        if hasattr(self, 'analytics_frame'):
+            self.analytics_frame.destroy()
+
+        self.analytics_frame = ttk.Frame(self.tab_pages['analytics'])
+        self.analytics_frame.pack(fill=tk.BOTH, expand=True)
+
+        # 集計の概要とリセットボタン
+        summary_frame = tk.Frame(self.analytics_frame)
+        summary_frame.pack(fill=tk.X, padx=5, pady=5)
+        self.analytics_summary_label = tk.Label(summary_frame, text="", justify=tk.LEFT)
+        self.analytics_summary_label.pack(side=tk.LEFT)
+        tk.Button(summary_frame, text="集計をリセット", command=self.reset_aggregates).pack(side=tk.RIGHT, padx=5)
+        tk.Button(summary_frame, text="履歴から再集計", command=self.rebuild_aggregates).pack(side=tk.RIGHT, padx=5)
+
+        # 期間を指定したレポートの書き出し（空欄の場合は全期間）
+        report_frame = tk.Frame(self.analytics_frame)
+        report_frame.pack(fill=tk.X, padx=5, pady=(0, 5))
+        tk.Label(report_frame, text="レポート期間（YYYY-MM-DD）:").pack(side=tk.LEFT)
+        self.report_from_entry = tk.Entry(report_frame, width=12)
+        self.report_from_entry.pack(side=tk.LEFT)
+        tk.Label(report_frame, text="〜").pack(side=tk.LEFT)
+        self.report_to_entry = tk.Entry(report_frame, width=12)
+        self.report_to_entry.pack(side=tk.LEFT)
+        self.report_button = tk.Button(report_frame, text="レポートを書き出す", command=self.export_report)
+        self.report_button.pack(side=tk.LEFT, padx=5)
+        self.report_status_label = tk.Label(report_frame, text="")
+        self.report_status_label.pack(side=tk.LEFT)
+
+        tables_frame = tk.Frame(self.analytics_frame)
+        tables_frame.pack(fill=tk.BOTH, expand=True)
+        self.analytics_trees = {}
+        for key, headings in (('products', ('商品', '個数', '売上')),
+                              ('qualifications', ('資格', '件数', '請求額', '割引額')),
+                              ('hours', ('時間', '件数', '請求額'))):
+            columns = [f'col{i}' for i in range(len(headings))]
+            tree = ttk.Treeview(tables_frame, columns=columns, show='headings')
+            tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=2)
+            for column, heading in zip(columns, headings):
+                tree.heading(column, text=heading)
+                tree.column(column, width=20)
+            self.analytics_trees[key] = tree
+
+        if self.aggregates.needs_rebuild:
+            self.rebuild_aggregates()
+
+    def refresh_analytics_tab(self):
+        """集計値だけから表示を作り直す（履歴は読み直さない）"""
+        self.analytics_refresh_scheduled = False
+        if not self.is_tab_built('analytics'):
+            return
+        data = self.aggregates.data
+        self.analytics_summary_label.config(
+            text=f"開始: {data['event_started']}   販売件数: {data['sales']}件   "
+                 f"売上: {data['revenue']}円   割引額: {data['discount']}円")
+        for key, tree in self.analytics_trees.items():
+            tree.delete(*tree.get_children())
+            for name, values in sorted(data[key].items()):
+                tree.insert("", "end", values=[name] + list(values))
+
+    def schedule_analytics_refresh(self):
+        if self.is_tab_built('analytics') and not getattr(self, 'analytics_refresh_scheduled', False):
+            self.analytics_refresh_scheduled = True
+            self.root.after_idle(self.refresh_analytics_tab)
+
+    def reset_aggregates(self):
+        if messagebox.askyesno("確認", "集計を0からやり直しますか？（履歴は消えません）"):
+            self.aggregates.reset()
+            self.aggregates.schedule_save()
+            self.refresh_analytics_tab()
+
+    def rebuild_aggregates(self):
+        if self.columns is not None:
+            # 列ストアがあれば履歴を読み直さずに配列のまま集計する（金額は販売した時点の価格表で記録済み）
+            self.ensure_columns()
+            started = datetime.fromisoformat(self.aggregates.data['event_started'])
+            start = datetime.combine(started.date(), datetime.min.time()).timestamp()
+            self.aggregates.replace(self.columns.summarize(self.products, start))
+        else:
+            self.aggregates.rebuild(self.iter_log_rows(), self.pricing, self.get_catalog_history())
+        self.refresh_analytics_tab()
+
+    def export_report(self):
+        """日別・期間の販売レポートを書き出す（集計は別スレッドからプロセスプールで並列に行う）"""
+        try:
+            date_from = parse_report_date(self.report_from_entry.get())
+            date_to = parse_report_date(self.report_to_entry.get())
+        except ValueError:
+            messagebox.showwarning("警告", "期間は YYYY-MM-DD の形式で入力してください。")
+            return
+        path = filedialog.asksaveasfilename(title="レポートの保存先", defaultextension=".html",
+                                            filetypes=[("HTML", "*.html"), ("CSV", "*.csv"), ("JSON", "*.json")])
+        if not path:
+            return
+
+        # 集計する範囲は書き出しを始めた時点で決める（その後の販売は含めない）
+        if not self.flush_sales():
+            if not messagebox.askyesno(
+                    "確認", f"{self.sale_writer.failed()}件の販売をまだ log.csv に書き込めていません。"
+                            "これらを含めずにレポートを書き出しますか？"):
+                return
+        parts = report_parts(self.segments, self.ledger, date_from, date_to)
+        products, qualifications = copy.deepcopy(self.products), copy.deepcopy(self.qualifications)
+        history = copy.deepcopy(self.get_catalog_history())
+        result = {}
+
+        def run():
+            try:
+                write_report(build_report(parts, products, qualifications, date_from, date_to,
+                                          history=history), path)
+            except Exception as e:  # 書き込めない場所を選んだ場合など
+                result['error'] = e
+            result['done'] = True
+
+        def poll():
+            if 'done' not in result:
+                self.root.after(200, poll)
+                return
+            if self.is_tab_built('analytics'):
+                self.report_button.config(state=tk.NORMAL)
+                self.report_status_label.config(text="")
+            if 'error' in result:
+                messagebox.showwarning("警告", f"レポートを書き出せませんでした: {result['error']}")
+            else:
+                messagebox.showinfo("完了", f"レポートを {path} に書き出しました。")
+
+        self.report_button.config(state=tk.DISABLED)
+        self.report_status_label.config(text="集計中…")
+        threading.Thread(target=run, daemon=True).start()
+        poll()
+
+    SEARCH_LIMIT = 1000  # 検索結果として表示する最大件数
+
+    def setup_search_tab(self):
+        if hasattr(self, 'search_frame'):
+            self.search_frame.destroy()
+
+        self.search_frame = ttk.Frame(self.tab_pages['search'])
+        self.search_frame.pack(fill=tk.BOTH, expand=True)
+
+        # 検索条件
+        filter_frame = tk.Frame(self.search_frame)
+        filter_frame.pack(fill=tk.X, padx=5, pady=5)
+        tk.Label(filter_frame, text="名前:").grid(row=0, column=0, sticky=tk.W)
+        self.search_name_entry = tk.Entry(filter_frame, width=12)
+        self.search_name_entry.grid(row=0, column=1, sticky=tk.W)
+        tk.Label(filter_frame, text="日付(YYYY-MM-DD):").grid(row=0, column=2, sticky=tk.W, padx=(10, 0))
+        self.search_date_from_entry = tk.Entry(filter_frame, width=10)
+        self.search_date_from_entry.grid(row=0, column=3, sticky=tk.W)
+        tk.Label(filter_frame, text="〜").grid(row=0, column=4)
+        self.search_date_to_entry = tk.Entry(filter_frame, width=10)
+        self.search_date_to_entry.grid(row=0, column=5, sticky=tk.W)
+        tk.Label(filter_frame, text="資格:").grid(row=1, column=0, sticky=tk.W)
+        self.search_qualification_menu = ttk.Combobox(
+            filter_frame, values=[""] + [q['name'] for q in self.qualifications], state="readonly", width=10)
+        self.search_qualification_menu.grid(row=1, column=1, sticky=tk.W)
+        tk.Label(filter_frame, text="回答:").grid(row=1, column=2, sticky=tk.W, padx=(10, 0))
+        self.search_survey_menu = ttk.Combobox(
+            filter_frame, values=[""] + self.survey_responses, state="readonly", width=10)
+        self.search_survey_menu.grid(row=1, column=3, columnspan=3, sticky=tk.W)
+        tk.Label(filter_frame, text="備考:").grid(row=2, column=0, sticky=tk.W)
+        self.search_text_entry = tk.Entry(filter_frame, width=24)
+        self.search_text_entry.grid(row=2, column=1, columnspan=3, sticky=tk.W)
+        tk.Button(filter_frame, text="検索", command=self.run_search).grid(row=2, column=4, padx=2)
+        tk.Button(filter_frame, text="クリア", command=self.clear_search).grid(row=2, column=5, padx=2)
+        for entry in (self.search_name_entry, self.search_date_from_entry,
+                      self.search_date_to_entry, self.search_text_entry):
+            entry.bind("<Return>", lambda event: self.run_search())
+
+        self.search_status_label = tk.Label(self.search_frame, text="", anchor=tk.W)
+        self.search_status_label.pack(fill=tk.X, padx=5)
+
+        columns = ['date', 'time', 'name', 'qualification', 'total', 'survey', 'remarks']
+        headings = ['日付', '時刻', '名前', '資格', '合計', '回答', '備考']
+        self.search_tree = ttk.Treeview(self.search_frame, columns=columns, show='headings')
+        self.search_tree.pack(fill=tk.BOTH, expand=True)
+        for column, heading in zip(columns, headings):
+            self.search_tree.heading(column, text=heading)
+            self.search_tree.column(column, width=50 if column == 'remarks' else 20)
+
+    def get_history_index(self):
+        """検索用の索引（最初の1回だけ保存済みの履歴全体から作成）"""
+        if self.history_index is None:
+            self.history_index = HistoryIndex().build(self.iter_log_rows_with_start(), self.iter_survey_rows())
+        return self.history_index
+
+    def run_search(self):
+        try:
+            date_from = parse_search_date(self.search_date_from_entry.get())
+            date_to = parse_search_date(self.search_date_to_entry.get())
+        except ValueError:
+            messagebox.showwarning("警告", "日付は YYYY-MM-DD（今年の日付は MM-DD でも可）の形式で入力してください。")
+            return
+        index = self.get_history_index()
+        ids = index.query(name=self.search_name_entry.get().strip(),
+                          date_from=date_from,
+                          date_to=date_to,
+                          qualification=self.search_qualification_menu.get(),
+                          survey=self.search_survey_menu.get(),
+                          text=self.search_text_entry.get().strip())
+        self.search_tree.delete(*self.search_tree.get_children())
+        # 新しい販売から順に表示する
+        for record_id in reversed(ids[-self.SEARCH_LIMIT:]):
+            log_row, survey_row = index.records[record_id]
+            row = (log_row or survey_row)[:4] + [log_row[4] if len(log_row) > 4 else "",
+                                                 survey_row[4] if len(survey_row) > 4 else "",
+                                                 index.remarks(record_id)]
+            self.search_tree.insert("", "end", values=row)
+        text = f"{len(ids)}件"
+        if len(ids) > self.SEARCH_LIMIT:
+            text += f"（新しい{self.SEARCH_LIMIT}件を表示）"
+        self.search_status_label.config(text=text)
+
+    def clear_search(self):
+        for entry in (self.search_name_entry, self.search_date_from_entry,
+                      self.search_date_to_entry, self.search_text_entry):
+            entry.delete(0, tk.END)
+        self.search_qualification_menu.set("")
+        self.search_survey_menu.set("")
+        self.search_tree.delete(*self.search_tree.get_children())
+        self.search_status_label.config(text="")
 
     def setup_survey_tab(self):
         if hasattr(self, 'survey_frame'):
             self.survey_frame.destroy()
 
-        self.survey_frame = ttk.Frame(self.notebook)
-        self.notebook.add(self.survey_frame, text="回答")
+        self.survey_frame = ttk.Frame(self.tab_pages['survey'])
+        self.survey_frame.pack(fill=tk.BOTH, expand=True)
+
+        # 回答の集計（回答ごとの件数・割合と、資格ごと・時間帯ごとのクロス集計）
+        summary_frame = tk.Frame(self.survey_frame)
+        summary_frame.pack(fill=tk.X, padx=5, pady=5)
+        header_frame = tk.Frame(summary_frame)
+        header_frame.pack(fill=tk.X)
+        self.survey_summary_label = tk.Label(header_frame, text="", justify=tk.LEFT)
+        self.survey_summary_label.pack(side=tk.LEFT)
+        tk.Button(header_frame, text="履歴から再集計", command=self.rebuild_survey_tallies).pack(side=tk.RIGHT, padx=5)
+        tables_frame = tk.Frame(summary_frame)
+        tables_frame.pack(fill=tk.X)
+        self.survey_answer_tree = ttk.Treeview(tables_frame, show='headings', height=6)
+        self.survey_answer_tree.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=2)
+        self.survey_hour_tree = ttk.Treeview(tables_frame, show='headings', height=6)
+        self.survey_hour_tree.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=2)
+        if self.survey_tallies.needs_rebuild:
+            self.survey_tallies.rebuild(self.iter_survey_rows())
+        self.root.after_idle(self.refresh_survey_summary)
 
         columns = ['date', 'time', 'name', 'qualification', 'survey', 'remarks']
-        self.survey_tree = ttk.Treeview(self.survey_frame, columns=columns, show='headings')
-        self.survey_tree.pack(fill=tk.BOTH, expand=True)
+        self.add_segment_selector(self.survey_frame, 'surveys', 'survey')
+        if self.list_mode == "virtual":
+            # 表示範囲の行だけを survey_log.csv の索引から読み込む
+            self.survey_view = VirtualTreeView(self.survey_frame, columns, self.history_source('surveys'))
+            self.survey_tree = self.survey_view.tree
+        else:
+            self.survey_view = None
+            self.survey_tree = ttk.Treeview(self.survey_frame, columns=columns, show='headings')
+            self.survey_tree.pack(fill=tk.BOTH, expand=True)
 
         # ヘッダーの設定
         self.survey_tree.heading('date', text='日付')
@@ -287,28 +4059,63 @@ class ProductCounterApp:
         
         self.load_survey_from_csv()
 
+    def refresh_survey_summary(self):
+        """回答数のスナップショットだけから集計表を作り直す（履歴は読み直さない）"""
+        self.survey_summary_refresh_scheduled = False
+        if not self.is_tab_built('survey'):
+            return
+        data = self.survey_tallies.data
+        total = data['total']
+        answers = self.survey_tallies.ordered_answers(self.survey_responses)
+        names = [qualification['name'] for qualification in self.qualifications]
+        qualifications = names + sorted(set(data['qualifications']) - set(names))
+        self.survey_summary_label.config(text=f"回答数: {total}件")
+        set_tree_table(self.survey_answer_tree, ['回答', '件数', '割合'] + qualifications,
+                       ([answer, data['answers'].get(answer, 0),
+                         f"{data['answers'].get(answer, 0) * 100 / total:.1f}%" if total else "-"]
+                        + [data['qualifications'].get(name, {}).get(answer, 0) for name in qualifications]
+                        for answer in answers))
+        set_tree_table(self.survey_hour_tree, ['時間'] + answers,
+                       ([hour] + [counts.get(answer, 0) for answer in answers]
+                        for hour, counts in sorted(data['hours'].items())))
+
+    def schedule_survey_summary_refresh(self):
+        if self.is_tab_built('survey') and not getattr(self, 'survey_summary_refresh_scheduled', False):
+            self.survey_summary_refresh_scheduled = True
+            self.root.after_idle(self.refresh_survey_summary)
+
+    def rebuild_survey_tallies(self):
+        self.survey_tallies.rebuild(self.iter_survey_rows())
+        self.refresh_survey_summary()
+
+    def record_question_renames(self, old_questions):
+        """位置が同じまま名前が変わった質問を回答数に反映する"""
+        for i in diff_rows(old_questions, self.survey_responses)[0]:
+            old, new = old_questions[i], self.survey_responses[i]
+            # 質問を並べ替えただけの場合は別の質問の回答と混ざらないようにそのままにする
+            if old not in self.survey_responses and new not in old_questions:
+                self.survey_tallies.rename(old, new)
+        self.schedule_survey_summary_refresh()
+
     def load_survey_from_csv(self):
+        if self.survey_view:
+            self.flush_sales()
+            self.survey_view.refresh(follow_tail=True)
+            return
         for item in self.survey_tree.get_children():
             self.survey_tree.delete(item)
-        try:
-            with open("survey_log.csv", "r", newline="", encoding="utf-8") as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    self.survey_tree.insert("", "end", values=row)
-        except FileNotFoundError:
-            pass
-
-    def append_survey_to_csv(self, survey_entry):
-        with open("survey_log.csv", "a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(survey_entry)
+        if self.survey_loader:
+            self.survey_loader.cancel()
+        self.survey_loader = BackgroundLoader(self.root, self.survey_frame, self.survey_tree,
+                                              self.history_snapshot('surveys'), "回答を読み込み中")
+        self.survey_loader.start()
 
     def setup_question_tab(self):
         if hasattr(self, 'question_frame'):
             self.question_frame.destroy()
 
-        self.question_frame = ttk.Frame(self.notebook)
-        self.notebook.add(self.question_frame, text="質問")
+        self.question_frame = ttk.Frame(self.tab_pages['question'])
+        self.question_frame.pack(fill=tk.BOTH, expand=True)
 
         # 質問の数の設定
         count_frame = tk.Frame(self.question_frame)
@@ -323,19 +4130,25 @@ class ProductCounterApp:
 
         # 質問名の入力フィールド
         self.question_entries = []
+        self.question_rows = []
         for i, question in enumerate(self.survey_responses):
-            frame = tk.Frame(self.question_frame)
-            frame.pack(fill=tk.X, padx=5, pady=5)
-            
-            tk.Label(frame, text=f"質問 {i+1}").pack(side=tk.LEFT)
-            
-            question_entry = tk.Entry(frame, width=15)
-            question_entry.insert(0, question)
-            question_entry.pack(side=tk.LEFT, padx=5)
-            
-            self.question_entries.append(question_entry)
-
-        tk.Button(self.question_frame, text="決定", command=self.save_question_changes).pack(pady=20)
+            self.add_question_row(i, question)
+
+        self.question_save_button = tk.Button(self.question_frame, text="決定", command=self.save_question_changes)
+        self.question_save_button.pack(pady=20)
+
+    def add_question_row(self, i, question, before=None):
+        frame = tk.Frame(self.question_frame)
+        frame.pack(fill=tk.X, padx=5, pady=5, before=before)
+        
+        tk.Label(frame, text=f"質問 {i+1}").pack(side=tk.LEFT)
+        
+        question_entry = tk.Entry(frame, width=15)
+        question_entry.insert(0, question)
+        question_entry.pack(side=tk.LEFT, padx=5)
+        
+        self.question_entries.append(question_entry)
+        self.question_rows.append({'frame': frame})
 
     def update_question_count(self):
         new_count_str = self.question_count_entry.get().strip()
@@ -353,9 +4166,12 @@ class ProductCounterApp:
             # 質問数が減った場合、余分な質問を削除
             new_questions = current_questions[:new_count]
 
+        old_questions = self.survey_responses
         self.survey_responses = new_questions
-        self.save_question_responses_to_csv()
-        self.setup_question_tab()  # 質問タブを再セットアップして、新しい質問数を反映
+        self.save_question_responses()
+        self.sync_question_rows(old_questions)  # 増減した質問の行だけを質問タブに反映
+        self.schedule_survey_summary_refresh()
+        self.push_catalog()
 
     def save_question_changes(self):
         new_questions = [entry.get().strip() for entry in self.question_entries]
@@ -364,17 +4180,40 @@ class ProductCounterApp:
             messagebox.showwarning("警告", "全ての質問名を入力してください。")
             return
 
+        old_questions = self.survey_responses
         self.survey_responses = new_questions
-        self.save_question_responses_to_csv()
-        self.setup_register_tab()  # 質問の変更を反映するため、再度レジタブをセットアップ
+        self.save_question_responses()
+        self.record_question_renames(old_questions)  # 以前の回答も変更後の質問名で数える
+        self.sync_survey_menu()  # 質問の変更をレジタブの選択肢に反映
+        self.push_catalog()
         messagebox.showinfo("成功", "質問が更新されました。")
 
+    def sync_question_rows(self, old_questions):
+        """質問リストの差分だけ質問タブの行を追加・削除・更新"""
+        changed, added, removed = diff_rows(old_questions, self.survey_responses)
+        for i in reversed(removed):
+            self.question_rows.pop()['frame'].destroy()
+            self.question_entries.pop()
+        for i in changed:
+            set_entry_text(self.question_entries[i], self.survey_responses[i])
+        for i in added:
+            self.add_question_row(i, self.survey_responses[i], before=self.question_save_button)
+
+    def sync_survey_menu(self):
+        """レジタブの質問の選択肢を更新（選択中の回答が残っていれば維持）"""
+        current = self.survey_var.get()
+        self.survey_menu['values'] = self.survey_responses
+        if current not in self.survey_responses:
+            self.survey_menu.current(0)
+        if self.is_tab_built('search'):
+            self.search_survey_menu['values'] = [""] + self.survey_responses
+
     def setup_management_tab(self):
         if hasattr(self, 'management_frame'):
             self.management_frame.destroy()
         
-        self.management_frame = ttk.Frame(self.notebook)
-        self.notebook.add(self.management_frame, text="管理")
+        self.management_frame = ttk.Frame(self.tab_pages['management'])
+        self.management_frame.pack(fill=tk.BOTH, expand=True)
 
         # 店名の入力フィールド
         shop_name_frame = tk.Frame(self.management_frame)
@@ -410,54 +4249,217 @@ class ProductCounterApp:
         tk.Button(size_frame, text="x1", command=lambda: self.change_image_size(1)).pack(side=tk.LEFT)
         tk.Button(size_frame, text="x2", command=lambda: self.change_image_size(2)).pack(side=tk.LEFT)
         tk.Button(size_frame, text="x3", command=lambda: self.change_image_size(3)).pack(side=tk.LEFT)
+        self.image_import_button = tk.Button(size_frame, text="画像を一括取り込み", command=self.import_product_images)
+        self.image_import_button.pack(side=tk.LEFT, padx=10)
+        self.image_import_label = tk.Label(size_frame, text="")
+        self.image_import_label.pack(side=tk.LEFT)
+
+        # レジの商品表示の切り替えボタン
+        layout_frame = tk.Frame(self.management_frame)
+        layout_frame.pack(fill=tk.X, padx=5, pady=5)
+        tk.Label(layout_frame, text="レジ表示:").pack(side=tk.LEFT)
+        tk.Button(layout_frame, text="一覧", command=lambda: self.change_register_layout("rows")).pack(side=tk.LEFT)
+        tk.Button(layout_frame, text="カタログ", command=lambda: self.change_register_layout("catalog")).pack(side=tk.LEFT)
+
+        # 履歴表示モード切り替えボタン
+        list_mode_frame = tk.Frame(self.management_frame)
+        list_mode_frame.pack(fill=tk.X, padx=5, pady=5)
+        tk.Label(list_mode_frame, text="履歴表示:").pack(side=tk.LEFT)
+        tk.Button(list_mode_frame, text="全件", command=lambda: self.change_list_mode("full")).pack(side=tk.LEFT)
+        tk.Button(list_mode_frame, text="仮想", command=lambda: self.change_list_mode("virtual")).pack(side=tk.LEFT)
+
+        # 保存形式切り替えボタン
+        storage_frame = tk.Frame(self.management_frame)
+        storage_frame.pack(fill=tk.X, padx=5, pady=5)
+        tk.Label(storage_frame, text="保存形式:").pack(side=tk.LEFT)
+        tk.Button(storage_frame, text="CSV", command=lambda: self.change_storage_mode("csv")).pack(side=tk.LEFT)
+        tk.Button(storage_frame, text="SQLite", command=lambda: self.change_storage_mode("sqlite")).pack(side=tk.LEFT)
+        tk.Button(storage_frame, text="CSV書き出し", command=self.export_ledger_to_csv).pack(side=tk.LEFT, padx=10)
+
+        # 販売履歴の区切り方の切り替えボタン
+        segment_frame = tk.Frame(self.management_frame)
+        segment_frame.pack(fill=tk.X, padx=5, pady=5)
+        tk.Label(segment_frame, text="履歴の区切り:").pack(side=tk.LEFT)
+        tk.Button(segment_frame, text="日ごと", command=lambda: self.change_segment_mode("day")).pack(side=tk.LEFT)
+        tk.Button(segment_frame, text="イベントごと", command=lambda: self.change_segment_mode("event")).pack(side=tk.LEFT)
+        tk.Button(segment_frame, text="ここで区切る", command=self.start_new_segment).pack(side=tk.LEFT, padx=10)
+
+        # 複数レジの同期設定
+        sync_frame = tk.Frame(self.management_frame)
+        sync_frame.pack(fill=tk.X, padx=5, pady=5)
+        tk.Label(sync_frame, text="レジID:").pack(side=tk.LEFT)
+        self.register_id_entry = tk.Entry(sync_frame, width=8)
+        self.register_id_entry.insert(0, self.register_id)
+        self.register_id_entry.pack(side=tk.LEFT, padx=5)
+        tk.Label(sync_frame, text="同期サーバー:").pack(side=tk.LEFT)
+        self.sync_server_entry = tk.Entry(sync_frame, width=20)
+        self.sync_server_entry.insert(0, self.sync_server)
+        self.sync_server_entry.pack(side=tk.LEFT, padx=5)
+        tk.Button(sync_frame, text="接続", command=self.change_sync_settings).pack(side=tk.LEFT)
+        self.sync_status_label = tk.Label(sync_frame, text="" if self.sync_server else "未使用")
+        self.sync_status_label.pack(side=tk.LEFT, padx=5)
 
         # 商品名、価格、画像の入力フィールド
         self.management_entries = []
+        self.management_rows = []
         for i, product in enumerate(self.products):
-            frame = tk.Frame(self.management_frame)
-            frame.pack(fill=tk.X, padx=5, pady=5)
-            
-            tk.Label(frame, text=f"商品_{i+1}").pack(side=tk.LEFT, padx=10)
-
-            # 画像表示
-            image_label = tk.Label(frame, relief=tk.RAISED)
-            image_label.pack(side=tk.LEFT, padx=10)
-            self.product_images[i] = image_label
-            self.update_product_image(i)
-            
-            name_entry = tk.Entry(frame, width=15)
-            name_entry.insert(0, product['name'])
-            name_entry.pack(side=tk.LEFT, padx=10)
-            
-            price_entry = tk.Entry(frame, width=10)
-            price_entry.insert(0, product['price'])
-            price_entry.pack(side=tk.LEFT, padx=10)
-            
-            image_button = tk.Button(frame, text="画像選択", command=lambda i=i: self.select_image(i))
-            image_button.pack(side=tk.LEFT, padx=5)
-            
-            self.management_entries.append((name_entry, price_entry))
-        
-        tk.Button(self.management_frame, text="決定", command=self.save_management_changes).pack(pady=20)
+            self.add_management_row(i, product)
+        
+        self.management_save_button = tk.Button(self.management_frame, text="決定", command=self.save_management_changes)
+        self.management_save_button.pack(pady=20)
+
+    def add_management_row(self, i, product, before=None):
+        frame = tk.Frame(self.management_frame)
+        frame.pack(fill=tk.X, padx=5, pady=5, before=before)
+        
+        tk.Label(frame, text=f"商品_{i+1}").pack(side=tk.LEFT, padx=10)
+
+        # 画像表示
+        image_label = tk.Label(frame, relief=tk.RAISED)
+        image_label.pack(side=tk.LEFT, padx=10)
+        self.set_product_image(image_label, i)
+        
+        name_entry = tk.Entry(frame, width=15)
+        name_entry.insert(0, product['name'])
+        name_entry.pack(side=tk.LEFT, padx=10)
+        
+        price_entry = tk.Entry(frame, width=10)
+        price_entry.insert(0, product['price'])
+        price_entry.pack(side=tk.LEFT, padx=10)
+        
+        # 分類（カタログ表示で分類ごとにまとめる）
+        category_entry = tk.Entry(frame, width=8)
+        category_entry.insert(0, product.get('category', ""))
+        category_entry.pack(side=tk.LEFT, padx=5)
+
+        # 商品コード（高速入力欄で使う）
+        code_entry = tk.Entry(frame, width=8)
+        code_entry.insert(0, product.get('code', ""))
+        code_entry.pack(side=tk.LEFT, padx=5)
+
+        image_button = tk.Button(frame, text="画像選択", command=lambda i=i: self.select_image(i))
+        image_button.pack(side=tk.LEFT, padx=5)
+        
+        self.management_entries.append((name_entry, price_entry, category_entry, code_entry))
+        self.management_rows.append({'frame': frame, 'image': image_label})
+
+    def sync_product_views(self, old_products):
+        """商品リストの差分だけレジ・管理・履歴タブに反映"""
+        self.pricing = PricingEngine(self.products, self.qualifications)
+        self.cart.set_prices(self.pricing.prices)
+        changed, added, removed = diff_rows(old_products, self.products)
+        # 未作成のタブは最初に表示するときに新しい商品リストで作られる
+        management = self.is_tab_built('management')
+        log = self.is_tab_built('log')
+        rows = not self.catalog_view
+        for i in reversed(removed):
+            if rows:
+                self.register_rows.pop()['frame'].destroy()
+                self.entries.pop()
+            if management:
+                self.management_rows.pop()['frame'].destroy()
+                self.management_entries.pop()
+        for i in changed:
+            product = self.products[i]
+            if old_products[i]['name'] != product['name']:
+                if rows:
+                    self.register_rows[i]['label'].config(text=product['name'])
+                if log:
+                    self.log_tree.heading(f'product{i+1}', text=product['name'])
+            if management:
+                name_entry, price_entry, category_entry, code_entry = self.management_entries[i]
+                set_entry_text(name_entry, product['name'])
+                set_entry_text(price_entry, product['price'])
+                set_entry_text(category_entry, product.get('category', ""))
+                set_entry_text(code_entry, product.get('code', ""))
+        for i in added:
+            if rows:
+                self.add_register_row(i, self.products[i], before=self.total_label)
+            if management:
+                self.add_management_row(i, self.products[i], before=self.management_save_button)
+        if log and (added or removed):
+            # 商品数が変わった場合のみ履歴タブの列を組み直す
+            self.log_tree['columns'] = ['date', 'time', 'name', 'qualification', 'total'] + [f'product{i+1}' for i in range(self.product_count)]
+            self.set_log_headings()
+        if changed or added or removed:
+            self.rebuild_code_index()
+        if not rows and (changed or added or removed):
+            self.rebuild_catalog_index()
 
     def change_image_size(self, scale):
         self.image_scale = scale
         self.save_image_scale()
         self.update_window_size()
-        self.setup_management_tab()
-        self.setup_register_tab()
+        for i in range(len(self.products)):
+            self.update_product_image(i)
+
+    def change_register_layout(self, layout):
+        if layout == self.register_layout:
+            return
+        self.register_layout = layout
+        self.save_register_layout()
+        self.update_window_size()
+        # レジタブは常に使える状態にしておくため、表示中でなくてもすぐに作り直す
+        self.dirty_tabs.add('register')
+        self.ensure_tab('register')
+        self.update_total_price()
+
+    def change_list_mode(self, mode):
+        self.list_mode = mode
+        self.save_list_mode()
+        self.rebuild_history_tabs()
+
+    def change_segment_mode(self, mode):
+        self.segment_mode = mode
+        self.save_segment_mode()
+        self.segments.mode = mode
+
+    def start_new_segment(self):
+        """イベントの区切りで書き込み中のセグメントを閉じる"""
+        if not self.sale_writer:
+            messagebox.showwarning("警告", "保存形式がCSVのときのみ区切れます。")
+            return
+        if messagebox.askyesno("確認", "ここまでの販売履歴を閉じて圧縮し、新しいセグメントを始めますか？"):
+            self.rotate_segment()
+            self.rebuild_history_tabs()
+
+    def change_storage_mode(self, mode):
+        self.storage_mode = mode
+        self.save_storage_mode()
+        self.open_storage()
+        self.history_index = None
+        self.recent_sales_list = deque(self.recent_sales(self.RECENT_SALES), maxlen=self.RECENT_SALES)
+        self.refresh_recent_sales()
+        self.rebuild_history_tabs()
+
+    def export_ledger_to_csv(self):
+        if not self.ledger:
+            messagebox.showwarning("警告", "保存形式がSQLiteのときのみ書き出せます。")
+            return
+        directory = filedialog.askdirectory(title="書き出し先を選択")
+        if directory:
+            self.ledger.export_csv(directory)
+            messagebox.showinfo("成功", "CSVに書き出しました。")
+
+    def rebuild_history_tabs(self):
+        self.invalidate_tab('log')
+        self.invalidate_tab('survey')
 
     def update_window_size(self):
         # 商品数と選択された画像サイズに基づいてウィンドウサイズを更新
-        self.default_height = 260 + (20 + 20 * self.image_scale) * len(self.products)
+        if self.register_layout == "catalog":
+            # カタログ表示では一覧をスクロールするので商品数によらない
+            self.default_height = 700
+        else:
+            self.default_height = 260 + (20 + 20 * self.image_scale) * len(self.products)
         self.root.geometry(f"{self.default_width}x{self.default_height}")
 
     def setup_qualification_tab(self):
         if hasattr(self, 'qualification_frame'):
             self.qualification_frame.destroy()
         
-        self.qualification_frame = ttk.Frame(self.notebook)
-        self.notebook.add(self.qualification_frame, text="資格")
+        self.qualification_frame = ttk.Frame(self.tab_pages['qualification'])
+        self.qualification_frame.pack(fill=tk.BOTH, expand=True)
         
         # 資格数の入力フィールドと更新ボタン
         count_frame = tk.Frame(self.qualification_frame)
@@ -472,23 +4474,55 @@ class ProductCounterApp:
         
         # 資格名と割引率の入力フィールド
         self.qualification_entries = []
+        self.qualification_rows = []
         for i, qualification in enumerate(self.qualifications):
-            frame = tk.Frame(self.qualification_frame)
-            frame.pack(fill=tk.X, padx=5, pady=5)
-            
-            tk.Label(frame, text=f"資格 {i+1}").pack(side=tk.LEFT)
-            
-            name_entry = tk.Entry(frame, width=15)
-            name_entry.insert(0, qualification['name'])
-            name_entry.pack(side=tk.LEFT, padx=5)
-            
-            discount_entry = tk.Entry(frame, width=10)
-            discount_entry.insert(0, qualification['discount'])
-            discount_entry.pack(side=tk.LEFT, padx=5)
-            
-            self.qualification_entries.append((name_entry, discount_entry))
-        
-        tk.Button(self.qualification_frame, text="決定", command=self.save_qualification_changes).pack(pady=20)
+            self.add_qualification_row(i, qualification)
+        
+        self.qualification_save_button = tk.Button(self.qualification_frame, text="決定", command=self.save_qualification_changes)
+        self.qualification_save_button.pack(pady=20)
+
+    def add_qualification_row(self, i, qualification, before=None):
+        frame = tk.Frame(self.qualification_frame)
+        frame.pack(fill=tk.X, padx=5, pady=5, before=before)
+        
+        tk.Label(frame, text=f"資格 {i+1}").pack(side=tk.LEFT)
+        
+        name_entry = tk.Entry(frame, width=15)
+        name_entry.insert(0, qualification['name'])
+        name_entry.pack(side=tk.LEFT, padx=5)
+        
+        discount_entry = tk.Entry(frame, width=10)
+        discount_entry.insert(0, qualification['discount'])
+        discount_entry.pack(side=tk.LEFT, padx=5)
+        
+        self.qualification_entries.append((name_entry, discount_entry))
+        self.qualification_rows.append({'frame': frame})
+
+    def sync_qualification_views(self, old_qualifications):
+        """資格リストの差分だけ資格タブとレジタブに反映"""
+        self.pricing = PricingEngine(self.products, self.qualifications)
+        changed, added, removed = diff_rows(old_qualifications, self.qualifications)
+        if self.is_tab_built('qualification'):
+            for i in reversed(removed):
+                self.qualification_rows.pop()['frame'].destroy()
+                self.qualification_entries.pop()
+            for i in changed:
+                name_entry, discount_entry = self.qualification_entries[i]
+                set_entry_text(name_entry, self.qualifications[i]['name'])
+                set_entry_text(discount_entry, self.qualifications[i]['discount'])
+            for i in added:
+                self.add_qualification_row(i, self.qualifications[i], before=self.qualification_save_button)
+
+        if changed or added or removed:
+            # レジタブの資格の選択肢を更新（選択中の資格が残っていれば維持）
+            names = [q['name'] for q in self.qualifications]
+            current = self.qualification_var.get()
+            self.qualification_menu['values'] = names
+            if current not in names:
+                self.qualification_menu.current(0)
+            if self.is_tab_built('search'):
+                self.search_qualification_menu['values'] = [""] + names
+            self.update_total_price()
     
     def select_image(self, index):
         filepath = filedialog.askopenfilename(
@@ -496,64 +4530,122 @@ class ProductCounterApp:
             title="画像を選択"
         )
         if filepath:
-            image_dir = "images"
-            if not os.path.exists(image_dir):
-                os.makedirs(image_dir)
-            image_path = os.path.join(image_dir, f"image{index+1}.png")
-            Image.open(filepath).save(image_path)  # 選択された画像をコピー
-            
-            # レジタブの画像を更新
+            # 選択された画像を切り抜き・縮小して保存し、縮小画像も作っておく
+            index, error = ingest_product_image((index, filepath, product_image_path(index)))
+            if error:
+                messagebox.showwarning("警告", f"画像を読み込めませんでした: {error}")
+                return
+
+            # レジタブと管理タブの画像を更新
             self.update_product_image(index)
-            self.setup_management_tab()
-            self.setup_register_tab()
+
+    def import_product_images(self):
+        """フォルダの画像をまとめて商品画像として取り込む（変換は別スレッドからプロセスプールで並列に行う）"""
+        directory = filedialog.askdirectory(title="商品画像のフォルダを選択")
+        if not directory:
+            return
+        matches = match_product_images(directory, self.products)
+        if not matches:
+            messagebox.showwarning("警告", "商品名・商品コード・image番号と一致する画像がありません。"
+                                           "（mapping.csv に「ファイル名,商品名」を書くと対応を指定できます）")
+            return
+        jobs = [(index, path, product_image_path(index)) for index, path in sorted(matches.items())]
+        progress = {'done': 0, 'errors': [], 'finished': False}
+
+        def run():
+            try:
+                for index, error in ingest_product_images(jobs):
+                    progress['done'] += 1
+                    if error:
+                        progress['errors'].append(error)
+            except Exception as e:  # 変換用のプロセスが起動できなかった場合など
+                progress['errors'].append(str(e))
+            finally:
+                progress['finished'] = True
+
+        def poll():
+            if self.is_tab_built('management'):
+                self.image_import_label.config(text=f"取り込み中 {progress['done']}/{len(jobs)}")
+            if not progress['finished']:
+                self.root.after(200, poll)
+                return
+            # 画像は最後にまとめて表示し直す
+            for index in matches:
+                self.update_product_image(index)
+            if self.is_tab_built('management'):
+                self.image_import_button.config(state=tk.NORMAL)
+                self.image_import_label.config(text="")
+            message = f"{len(jobs) - len(progress['errors'])}件の画像を取り込みました。"
+            if progress['errors']:
+                messagebox.showwarning("警告", message + "\n読み込めなかった画像:\n" + "\n".join(progress['errors'][:10]))
+            else:
+                messagebox.showinfo("完了", message)
+
+        self.image_import_button.config(state=tk.DISABLED)
+        threading.Thread(target=run, daemon=True).start()
+        poll()
 
     def update_product_image(self, index):
-        image_dir = "images"
-        image_path = os.path.join(image_dir, f"image{index+1}.png")
-        if os.path.exists(image_path):
-            image = Image.open(image_path)
+        rows_list = [self.register_rows]
+        if self.is_tab_built('management'):
+            rows_list.append(self.management_rows)
+        for rows in rows_list:
+            if index < len(rows):
+                self.set_product_image(rows[index]['image'], index)
+
+    def set_product_image(self, image_label, index):
+        photo = self.thumbnail_cache.get(product_image_path(index), self.image_scale)
+        if photo:
             size = 20 * self.image_scale
-            image = image.resize((size, size), Image.LANCZOS)
-            photo = ImageTk.PhotoImage(image)
-            self.product_images[index].config(image=photo, width=size + 4, height=size + 4)
-            self.product_images[index].image = photo
+            image_label.config(image=photo, width=size + 4, height=size + 4)
+            image_label.image = photo
         else:
             # 画像がない場合は枠だけ表示
-            self.product_images[index].config(image='', relief=tk.RAISED)
+            image_label.config(image='', relief=tk.RAISED)
     
     def update_count(self, index, delta):
-        new_count = max(0, self.product_counts[index] + delta)
-        self.product_counts[index] = new_count
-        self.entries[index].config(state=tk.NORMAL)
-        self.entries[index].delete(0, tk.END)
-        self.entries[index].insert(0, str(new_count))
-        self.entries[index].config(state='readonly')
-        self.update_total_price()
+        self.cart.add(index, delta)
+        self.schedule_cart_refresh([index])
     
     def clear_count(self, index):
-        self.product_counts[index] = 0
-        self.entries[index].config(state=tk.NORMAL)
-        self.entries[index].delete(0, tk.END)
-        self.entries[index].insert(0, "0")
-        self.entries[index].config(state='readonly')
+        self.cart.set(index, 0)
+        self.schedule_cart_refresh([index])
+
+    def clear_cart(self):
+        """すべての商品を0個にする（描画は1回だけ）"""
+        self.schedule_cart_refresh(self.cart.clear())
+
+    def schedule_cart_refresh(self, indices=()):
+        """個数と金額の表示の更新を after_idle でまとめ、1回の操作につき1回だけ描画する"""
+        self.dirty_counts.update(indices)
+        if not self.cart_refresh_scheduled:
+            self.cart_refresh_scheduled = True
+            self.root.after_idle(self.refresh_cart)
+
+    def refresh_cart(self):
+        self.cart_refresh_scheduled = False
+        indices, self.dirty_counts = self.dirty_counts, set()
+        if self.catalog_view:
+            if indices:
+                self.catalog_view.render()
+        else:
+            for index in indices:
+                if index < len(self.entries):
+                    self.show_count(index)
         self.update_total_price()
     
     def update_total_price(self, *args):
-        total = sum(count * int(product['price']) for count, product in zip(self.product_counts, self.products))
-        qualification_name = self.qualification_var.get()
-        qualification = next((q for q in self.qualifications if q['name'] == qualification_name), None)
-        discount_rate = int(qualification['discount']) if qualification else 0
-        discount = total * (discount_rate / 100)
-        final_total = total - discount
+        total, discount, final_total = self.cart.totals(self.pricing.discount_rate(self.qualification_var.get()))
         
         self.total_label.config(text=f"合計金額: {total}円")
-        self.discount_label.config(text=f"割引額: {int(discount)}円")
-        self.final_label.config(text=f"請求額: {int(final_total)}円")
+        self.discount_label.config(text=f"割引額: {discount}円")
+        self.final_label.config(text=f"請求額: {final_total}円")
     
     def save_log(self):
         name = self.name_entry.get().strip()
         if not name:
-            messagebox.showwarning("警告", "名前を入力してください。")
+            with self.watchdog.paused():
+                messagebox.showwarning("警告", "名前を入力してください。")
             return
         
         qualification = self.qualification_var.get()
@@ -561,110 +4653,206 @@ class ProductCounterApp:
         survey_response = self.survey_var.get()
         
         current_time = datetime.now()
+        if self.sale_writer and self.segments.needs_rotation(current_time):
+            # 日付が変わったら前日までのセグメントを閉じてから記録する
+            self.rotate_segment(current_time)
+            self.rebuild_history_tabs()
         date_str = current_time.strftime('%m-%d')
         time_str = current_time.strftime('%H:%M')
-        total = sum(count * int(product['price']) for count, product in zip(self.product_counts, self.products))
-        discount_rate = int(next((q['discount'] for q in self.qualifications if q['name'] == qualification), 0))
-        discount = total * (discount_rate / 100)
-        final_total = total - discount
-        
-        log_entry = [date_str, time_str, name, qualification, int(final_total)] + self.product_counts
+        total, discount, final_total = self.cart.totals(self.pricing.discount_rate(qualification))
+        counts = list(self.cart.counts)
         
-        # 履歴をTreeviewに追加
-        self.log_tree.insert("", "end", values=log_entry)
+        log_entry = [date_str, time_str, name, qualification, final_total] + counts
         
-        # 履歴をCSVに保存
-        self.append_log_to_csv(log_entry)
-        
-        # アンケート結果をCSVに保存
+        # 履歴とアンケート結果を保存
         survey_entry = [date_str, time_str, name, qualification, survey_response, remarks]
-        self.survey_tree.insert("", "end", values=survey_entry)
-        self.append_survey_to_csv(survey_entry)
+        self.record_sale(log_entry, survey_entry, current_time)
+        if self.sync_client:
+            # 同期サーバーへは別スレッドで送る（つながらない間は送信待ちに残る）
+            self.sync_client.add_sale(log_entry, survey_entry)
+
+        # 販売集計を差分で更新
+        items = [(product['name'], count, count * price)
+                 for product, count, price in zip(self.products, counts, self.pricing.prices)]
+        self.aggregates.add_sale(date_str, time_str, qualification, items, total, discount, final_total)
+        self.schedule_analytics_refresh()
+        self.survey_tallies.add(survey_entry)
+        self.schedule_survey_summary_refresh()
+        if self.columns is not None and self.columns.ready:
+            self.columns.append(int(current_time.timestamp()), final_total, total, qualification,
+                                {product.get('id'): (count, count * price)
+                                 for product, count, price in zip(self.products, counts, self.pricing.prices) if count})
+
+        # 最近の販売は保存した販売を先頭に加えるだけでファイルは読み直さない
+        self.recent_sales_list.appendleft((log_entry, survey_entry))
+        self.refresh_recent_sales()
+
+        # 検索用の索引は作成済みなら追記分だけ加える
+        if self.history_index is not None:
+            self.history_index.add(log_entry, survey_entry, current_time)
+
+        # 履歴をTreeviewに追加（仮想リストでは追記分を索引に加える）
+        # 未作成の履歴タブは表示するときに保存済みの履歴から読み込まれる
+        # 閉じたセグメントを表示中のタブには追加しない
+        if self.is_tab_built('log') and not self.log_view and not self.viewed_segments['sales']:
+            self.log_loader.append(log_entry)
+        if self.is_tab_built('survey') and not self.survey_view and not self.viewed_segments['surveys']:
+            self.survey_loader.append(survey_entry)
+        self.refresh_virtual_views()
         
         # 入力をクリア
         self.name_entry.delete(0, tk.END)
         self.remarks_entry.delete(0, tk.END)
         self.survey_menu.current(0)
         self.qualification_menu.current(0)
-        for i in range(len(self.products)):
-            self.clear_count(i)
+        self.clear_cart()
     
-    def append_log_to_csv(self, log_entry):
-        with open("log.csv", "a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(log_entry)
+    def refresh_virtual_views(self):
+        """書き込み待ちの販売記録がCSVに書き込まれてから仮想リストを更新"""
+        if self.sale_writer and self.sale_writer.pending():
+            self.root.after(20, self.refresh_virtual_views)
+            return
+        self.report_write_errors()
+        for key, view in (('log', self.log_view), ('survey', self.survey_view)):
+            if self.is_tab_built(key) and view:
+                view.refresh(follow_tail=True)
 
-    def append_survey_to_csv(self, survey_entry):
-        with open("survey_log.csv", "a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(survey_entry)
+    def report_write_errors(self):
+        """販売記録をCSVに書き込めなかった場合に知らせる（記録はジャーナルに残り、書き込みは再試行される）"""
+        if not self.sale_writer:
+            return
+        errors = self.sale_writer.take_errors()
+        if errors:
+            with self.watchdog.paused():
+                messagebox.showwarning(
+                    "警告", f"販売記録を log.csv / survey_log.csv に書き込めませんでした: {errors[-1]}\n"
+                            f"{self.sale_writer.failed()}件の販売は log_journal.jsonl に残り、"
+                            f"{SaleWriter.RETRY_SECONDS}秒ごとに書き込みを再試行します。"
+                            "ファイルを開いているアプリを閉じるか、ディスクの空きを確認してください。")
+
+    def record_sale(self, log_entry, survey_entry, recorded=None):
+        """販売履歴とアンケート結果を保存（SQLite台帳では1トランザクションで、年を含む記録日時とともに記録）"""
+        if self.ledger:
+            self.ledger.record_sale(log_entry, survey_entry, recorded)
+        else:
+            # CSVへの書き込みは書き込みスレッドがジャーナル経由でまとめて行う
+            self.sale_writer.record(log_entry, survey_entry)
     
     def load_log_from_csv(self):
-        try:
-            with open("log.csv", "r", newline="", encoding="utf-8") as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    self.log_tree.insert("", "end", values=row)
-        except FileNotFoundError:
-            pass
+        if self.log_view:
+            self.flush_sales()
+            self.log_view.refresh(follow_tail=True)
+            return
+        # 読み込みは別スレッドで行い、画面には少しずつ追加する
+        if self.log_loader:
+            self.log_loader.cancel()
+        self.log_loader = BackgroundLoader(self.root, self.log_frame, self.log_tree,
+                                           self.history_snapshot('sales'), "履歴を読み込み中")
+        self.log_loader.start()
+
+    def history_snapshot(self, table):
+        """現時点までに保存された履歴だけを読む関数を返す（読み込み中の販売は含めない）"""
+        if self.ledger:
+            count = self.ledger.count(table)
+            return lambda: self.ledger.iter_rows_snapshot(table, count)
+        segment_id = self.viewed_segments[table]
+        if segment_id:
+            return lambda: self.segments.iter_segment(table, segment_id)
+        self.flush_sales()
+        path = SalesLedger.LOG_FILES[table]
+        size = file_size(path)
+        return lambda: iter_csv_prefix(path, size)
+
+    def iter_log_rows(self):
+        """販売履歴の行を古い順に返す（保存形式に依存しない。閉じたセグメントも含む）"""
+        if self.ledger:
+            yield from self.ledger.iter_rows('sales')
+            return
+        self.flush_sales()
+        yield from self.segments.iter_rows('sales')
+
+    def iter_log_rows_with_start(self):
+        """販売履歴を (年の補完に使う日時, 行) の組で古い順に返す"""
+        if self.ledger:
+            yield from self.ledger.iter_rows_with_start('sales')
+            return
+        self.flush_sales()
+        yield from self.segments.iter_rows_with_start('sales')
+
+    def iter_survey_rows(self):
+        """アンケート結果の行を古い順に返す（保存形式に依存しない。閉じたセグメントも含む）"""
+        if self.ledger:
+            yield from self.ledger.iter_rows('surveys')
+            return
+        self.flush_sales()
+        yield from self.segments.iter_rows('surveys')
     
-    def load_products_from_csv(self):
-        try:
-            with open("products.csv", "r", newline="", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                self.products = [row for row in reader]
-                
-                # products.csv が現在の product_count より少ない場合、新しい商品を追加
-                while len(self.products) < self.product_count:
-                    self.products.append({'name': f'品{len(self.products) + 1}', 'price': '10000'})
-                
-                # products.csv が現在の product_count より多い場合、余分な商品を削除
-                self.products = self.products[:self.product_count]
-                
-        except FileNotFoundError:
+    def load_products(self):
+        self.products = self.config.get('products')
+        if self.products is None:
             self.products = [{'name': f'品{i+1}', 'price': '10000'} for i in range(self.product_count)]
-            self.save_products_to_csv()
+            self.save_products()
+            return
+        
+        # 保存されている商品が現在の product_count より少ない場合、新しい商品を追加
+        while len(self.products) < self.product_count:
+            self.products.append({'name': f'品{len(self.products) + 1}', 'price': '10000'})
+        
+        # 保存されている商品が現在の product_count より多い場合、余分な商品を削除
+        self.products = self.products[:self.product_count]
+        if self.ensure_product_ids():
+            self.save_products()
     
-    def save_products_to_csv(self):
-        with open("products.csv", "w", newline="", encoding="utf-8") as f:
-            fieldnames = ['name', 'price']
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            for product in self.products:
-                writer.writerow(product)
+    def save_products(self):
+        self.ensure_product_ids()
+        self.config.set('products', self.products)
+
+    def ensure_product_ids(self):
+        """商品IDのない商品に、これまでに使っていないIDを付ける（付けた場合は True）"""
+        next_id = self.config.get('next_product_id')
+        assigned = False
+        for product in self.products:
+            if 'id' not in product:
+                product['id'] = next_id
+                next_id += 1
+                assigned = True
+        if assigned:
+            self.config.set('next_product_id', next_id)
+        return assigned
     
     def load_shop_name(self):
-        try:
-            with open("shop_name.txt", "r", encoding="utf-8") as f:
-                self.shop_name_entry.insert(0, f.read().strip())
-        except FileNotFoundError:
-            pass
+        self.shop_name_entry.insert(0, self.config.get('shop_name'))
     
+    def get_shop_name(self):
+        """店舗名を取得（管理タブが未作成なら保存済みの設定から読む）"""
+        if self.is_tab_built('management'):
+            return self.shop_name_entry.get().strip()
+        return self.config.get('shop_name')
+
     def save_shop_name(self):
-        with open("shop_name.txt", "w", encoding="utf-8") as f:
-            f.write(self.shop_name_entry.get().strip())
+        self.config.set('shop_name', self.shop_name_entry.get().strip())
 
     def load_persistent_text(self):
-        try:
-            with open("persistent_text.txt", "r", encoding="utf-8") as f:
-                self.persistent_text_entry.insert(0, f.read().strip())
-        except FileNotFoundError:
-            pass
+        self.persistent_text_entry.insert(0, self.config.get('persistent_text'))
     
+    def get_persistent_text(self):
+        """お手紙の文面を取得（管理タブが未作成なら保存済みの設定から読む）"""
+        if self.is_tab_built('management'):
+            return self.persistent_text_entry.get().strip()
+        return self.config.get('persistent_text')
+
     def save_persistent_text(self):
-        with open("persistent_text.txt", "w", encoding="utf-8") as f:
-            f.write(self.persistent_text_entry.get().strip())
+        self.config.set('persistent_text', self.persistent_text_entry.get().strip())
     
     def save_management_changes(self):
         # 店名とテキストの保存
         self.save_shop_name()
         self.save_persistent_text()
         current_time = datetime.now()
-        date_str = current_time.strftime('%y-%m-%d')
-        time_str = current_time.strftime('%H:%M:%S')
         
         new_products = []
-        for i, (name_entry, price_entry) in enumerate(self.management_entries):
+        codes = set()
+        for i, (name_entry, price_entry, category_entry, code_entry) in enumerate(self.management_entries):
             name = name_entry.get().strip()
             if not name:
                 messagebox.showwarning("警告", "名前を入力してください。")
@@ -673,22 +4861,48 @@ class ProductCounterApp:
             if not name or not price.isdigit():
                 messagebox.showwarning("警告", f"商品 {i+1} の名前または価格が無効です。")
                 return
-            new_products.append({'name': name, 'price': price})
+            product = {'name': name, 'price': price}
+            if 'id' in self.products[i]:
+                # 名前や価格を変えても同じ商品として扱う
+                product['id'] = self.products[i]['id']
+            category = category_entry.get().strip()
+            if category:
+                product['category'] = category
+            code = code_entry.get().strip()
+            if code:
+                if normalize_text(code) in codes or " " in code or "*" in code or code.startswith("-"):
+                    messagebox.showwarning("警告", f"商品 {i+1} のコード「{code}」は重複しているか、使えない文字を含んでいます。")
+                    return
+                codes.add(normalize_text(code))
+                product['code'] = code
+            new_products.append(product)
         
+        old_products = self.products
         self.products = new_products
-        self.save_products_to_csv()
+        self.save_products()
+        self.record_product_version(current_time)
         
-        management_log_entry = [date_str, time_str] + [f"{p['name']}:{p['price']}" for p in self.products]
-        self.append_management_log_to_csv(management_log_entry)
-        
-        # 商品名と価格の表示を更新
-        self.setup_log_tab()       # 商品名の変更を反映するため、履歴タブも再セットアップ
-        self.setup_qualification_tab()
-        self.setup_management_tab()
-        self.setup_register_tab()  # 商品数が変更された場合に再度レジタブをセットアップ
+        # 変更された商品名と価格の表示だけを更新
+        self.sync_product_views(old_products)
+        self.update_total_price()
+        self.push_catalog()
         messagebox.showinfo("成功", "商品の設定が更新されました。")
     
+    def record_product_version(self, current_time=None):
+        """現在の商品名と価格を変更履歴に記録する（読み込み済みの版の履歴にも加える）"""
+        current_time = (current_time or datetime.now()).replace(microsecond=0)
+        management_log_entry = ([current_time.strftime('%y-%m-%d'), current_time.strftime('%H:%M:%S')]
+                                + [f"{p['name']}:{p['price']}" for p in self.products])
+        self.append_management_log_to_csv(management_log_entry)
+        if self.catalog_history is not None:
+            self.catalog_history.add_version('products', current_time.timestamp(),
+                                             [{'name': p['name'], 'price': p['price']} for p in self.products])
+            self.catalog_history.set_current(self.products, self.qualifications)
+
     def append_management_log_to_csv(self, log_entry):
+        if self.ledger:
+            self.ledger.record_change('management_log', log_entry)
+            return
         with open("management_log.csv", "a", newline="", encoding="utf-8") as f:
             writer = csv.writer(f)
             writer.writerow(log_entry)
@@ -701,18 +4915,17 @@ class ProductCounterApp:
         
         new_count = int(new_count_str)
         self.product_count = new_count
-        self.save_product_count_to_csv()
+        self.save_product_count()
         
-        # すべてのタブを再構築
-        self.load_products_from_csv()
-        self.product_counts = [0] * self.product_count
-        self.product_images = [None] * self.product_count
+        # 増減した商品の行だけを各タブに反映
+        old_products = self.products
+        self.load_products()
+        self.record_product_version()  # 追加した商品の価格も変更履歴に残す
         
         self.update_window_size()  # 商品数変更時にウィンドウサイズを更新
-        self.setup_log_tab()
-        self.setup_qualification_tab()
-        self.setup_management_tab()
-        self.setup_register_tab()
+        self.sync_product_views(old_products)
+        self.update_total_price()
+        self.push_catalog()
         
         messagebox.showinfo("成功", "商品数が更新されました。")
     
@@ -724,45 +4937,36 @@ class ProductCounterApp:
         
         new_count = int(new_count_str)
         self.qualification_count = new_count
-        self.save_qualification_count_to_csv()
+        self.save_qualification_count()
         
-        # 資格情報の再設定
-        self.load_qualifications_from_csv()
-        self.setup_qualification_tab()
-        self.setup_management_tab()
-        self.setup_register_tab()  # 資格数が変更された場合に再度レジタブをセットアップ
+        # 資格情報の再設定（増減した資格の行だけを反映）
+        old_qualifications = self.qualifications
+        self.load_qualifications()
+        self.record_qualification_version()  # 追加した資格の割引率も変更履歴に残す
+        self.sync_qualification_views(old_qualifications)
+        self.push_catalog()
         
         messagebox.showinfo("成功", "資格数が更新されました。")
     
-    def load_qualifications_from_csv(self):
-        try:
-            with open("qualifications.csv", "r", newline="", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                self.qualifications = [row for row in reader]
-                
-                # qualifications.csv が現在の qualification_count より少ない場合、新しい資格を追加
-                while len(self.qualifications) < self.qualification_count:
-                    self.qualifications.append({'name': f'資格 {len(self.qualifications) + 1}', 'discount': '0'})
-                
-                # qualifications.csv が現在の qualification_count より多い場合、余分な資格を削除
-                self.qualifications = self.qualifications[:self.qualification_count]
-                
-        except FileNotFoundError:
+    def load_qualifications(self):
+        self.qualifications = self.config.get('qualifications')
+        if self.qualifications is None:
             self.qualifications = [{'name': f'資格 {i+1}', 'discount': '0'} for i in range(self.qualification_count)]
-            self.save_qualifications_to_csv()
+            self.save_qualifications()
+            return
+        
+        # 保存されている資格が現在の qualification_count より少ない場合、新しい資格を追加
+        while len(self.qualifications) < self.qualification_count:
+            self.qualifications.append({'name': f'資格 {len(self.qualifications) + 1}', 'discount': '0'})
+        
+        # 保存されている資格が現在の qualification_count より多い場合、余分な資格を削除
+        self.qualifications = self.qualifications[:self.qualification_count]
     
-    def save_qualifications_to_csv(self):
-        with open("qualifications.csv", "w", newline="", encoding="utf-8") as f:
-            fieldnames = ['name', 'discount']
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            for qualification in self.qualifications:
-                writer.writerow(qualification)
+    def save_qualifications(self):
+        self.config.set('qualifications', self.qualifications)
     
     def save_qualification_changes(self):
         current_time = datetime.now()
-        date_str = current_time.strftime('%y-%m-%d')
-        time_str = current_time.strftime('%H:%M:%S')
         
         new_qualifications = []
         for i, (name_entry, discount_entry) in enumerate(self.qualification_entries):
@@ -773,25 +4977,39 @@ class ProductCounterApp:
                 return
             new_qualifications.append({'name': name, 'discount': discount})
         
+        old_qualifications = self.qualifications
         self.qualifications = new_qualifications
-        self.save_qualifications_to_csv()
+        self.save_qualifications()
+        self.record_qualification_version(current_time)
         
-        qualification_log_entry = [date_str, time_str] + [f"{q['name']}:{q['discount']}%" for q in self.qualifications]
-        self.append_qualification_log_to_csv(qualification_log_entry)
-        
-        # 資格名と割引額の表示を更新
-        self.setup_register_tab()  # 資格の変更を反映するため、再度レジタブをセットアップ
+        # 資格名と割引額の表示を更新（変更された資格だけを反映）
+        self.sync_qualification_views(old_qualifications)
+        self.push_catalog()
         
         messagebox.showinfo("成功", "資格の設定が更新されました。")
     
+    def record_qualification_version(self, current_time=None):
+        """現在の資格名と割引率を変更履歴に記録する（読み込み済みの版の履歴にも加える）"""
+        current_time = (current_time or datetime.now()).replace(microsecond=0)
+        qualification_log_entry = ([current_time.strftime('%y-%m-%d'), current_time.strftime('%H:%M:%S')]
+                                   + [f"{q['name']}:{q['discount']}%" for q in self.qualifications])
+        self.append_qualification_log_to_csv(qualification_log_entry)
+        if self.catalog_history is not None:
+            self.catalog_history.add_version('qualifications', current_time.timestamp(),
+                                             [{'name': q['name'], 'discount': q['discount']} for q in self.qualifications])
+            self.catalog_history.set_current(self.products, self.qualifications)
+
     def append_qualification_log_to_csv(self, log_entry):
+        if self.ledger:
+            self.ledger.record_change('qualification_log', log_entry)
+            return
         with open("qualification_log.csv", "a", newline="", encoding="utf-8") as f:
             writer = csv.writer(f)
             writer.writerow(log_entry)
     
     def copy_name_and_message(self):
         name = self.name_entry.get().strip()
-        message = self.persistent_text_entry.get().strip()
+        message = self.get_persistent_text()
         self.root.clipboard_clear()
         self.root.clipboard_append(f"{name}さん、{message}")
         self.root.update()
@@ -803,22 +5021,23 @@ class ProductCounterApp:
         self.root.update()
     
     def copy_shop_name(self):
-        shop_name = self.shop_name_entry.get().strip()
+        shop_name = self.get_shop_name()
         self.root.clipboard_clear()
         self.root.clipboard_append(shop_name)
         self.root.update()
 
     def restore_from_history(self):
-        # 警告ダイアログの表示
-        if messagebox.askyesno("確認", "現在のレジ内容が消えますが、よろしいですか？"):
+        # 警告ダイアログの表示（応答を待つ間は応答時間の計測から除く）
+        with self.watchdog.paused():
+            confirmed = messagebox.askyesno("確認", "現在のレジ内容が消えますが、よろしいですか？")
+        if confirmed:
             # 最後の履歴を取得
-            if not self.log_tree.get_children():
-                messagebox.showwarning("警告", "履歴が空です。")
+            last_log, last_survey = self.get_last_history()
+            if last_log is None or last_survey is None:
+                with self.watchdog.paused():
+                    messagebox.showwarning("警告", "履歴が空です。")
                 return
     
-            last_log = self.log_tree.item(self.log_tree.get_children()[-1])['values']
-            last_survey = self.survey_tree.item(self.survey_tree.get_children()[-1])['values']
-    
             # 名前、資格、アンケート回答、備考の復元
             self.name_entry.delete(0, tk.END)
             self.name_entry.insert(0, last_log[2])
@@ -830,20 +5049,27 @@ class ProductCounterApp:
             self.remarks_entry.delete(0, tk.END)
             self.remarks_entry.insert(0, last_survey[5])
 
-            # 商品の数量の復元
-            for i in range(len(self.products)):
-                self.product_counts[i] = int(last_log[5 + i])
-                self.entries[i].config(state=tk.NORMAL)
-                self.entries[i].delete(0, tk.END)
-                self.entries[i].insert(0, str(self.product_counts[i]))
-                self.entries[i].config(state='readonly')
-
-            # 合計金額と割引額の更新
-            self.update_total_price()
+            # 商品の数量の復元（記録した後に追加された商品は0個とする）
+            self.cart.load(last_log[5:])
+            self.schedule_cart_refresh(range(len(self.products)))
         else:
             # 「戻る」を選んだ場合は何もせずに終了
             return
 
+    def get_last_history(self):
+        """最後の販売履歴とアンケート結果を取得（履歴タブには読み込まず、ファイルの末尾だけを読む）"""
+        pairs = self.recent_sales(1)
+        return pairs[0] if pairs else (None, None)
+
+    def recent_sales(self, count):
+        """最近の販売を新しい順に (販売履歴の行, アンケート結果の行) で返す"""
+        if self.ledger:
+            return self.ledger.recent_sales(count)
+        self.flush_sales()
+        # 片方にしかない行を読み飛ばしても count 件そろうように少し多めに読む
+        return pair_sales(self.segments.tail('sales', count + 8),
+                          self.segments.tail('surveys', count + 8))[:count]
+
     def clear_register(self):
         # 警告ダイアログの表示
         if messagebox.askyesno("確認", "現在のレジ内容が消えますが、よろしいですか？"):
@@ -853,8 +5079,7 @@ class ProductCounterApp:
             self.remarks_entry.delete(0, tk.END)
             self.survey_menu.current(0)  # 質問を「未回答」にリセット
             self.qualification_menu.current(0)  # 資格を「資格 1」にリセット
-            for i in range(len(self.products)):
-                self.clear_count(i)
+            self.clear_cart()
         else:
             # 「戻る」を選んだ場合は何もせずに終了
             return
@@ -862,5 +5087,5 @@ class ProductCounterApp:
 
 if __name__ == "__main__":
     root = tk.Tk()
-    app = ProductCounterApp(root)
+    app = ProductCounterApp(root, profile="--profile" in sys.argv, watchdog="--watchdog" in sys.argv)
     root.mainloop()
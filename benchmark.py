@@ -0,0 +1,294 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+"""
+############################################################
+# PointGuiSale ベンチマーク
+# 合成したイベント日のデータで起動・履歴読み込み・会計処理などの時間を計測し、
+# 結果をJSONファイルに書き出す。
+#
+# 使い方:
+#   python benchmark.py --sales 10000 --products 50
+#   xvfb-run python benchmark.py --sales 100000   # 仮想ディスプレイでGUIも計測
+#   python benchmark.py --headless                # Tkを使わないコア部分のみ計測
+############################################################
+"""
+
+NAMES = ["佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "山本", "中村", "小林", "加藤"]
+EVENT_START = datetime(2024, 8, 27, 10, 0)  # 合成するイベント日の開店時刻
+
+
+def generate_event_data(directory, sales=1000, products=6, qualifications=3, answers=3, images=False, seed=0):
+    """イベント日を模した products.csv / qualifications.csv / management_log.csv / log.csv / survey_log.csv を作成
+
+    昼に最初の商品を100円値上げしたものとし、products.csv は値上げ後、management_log.csv に
+    値上げ前と後の価格表を記録する。
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+
+    product_rows = [{'name': f'品{i+1}', 'price': str(rng.choice([300, 500, 800, 1000, 1500, 3000]))}
+                    for i in range(products)]
+    qualification_rows = [{'name': f'資格 {i+1}', 'discount': str(0 if i == 0 else rng.choice([5, 10, 20]))}
+                          for i in range(qualifications)]
+    responses = ["未回答"] + [f"回答{i}" for i in range(1, answers)]
+
+    with open(os.path.join(directory, "product_count.csv"), "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow([products])
+    with open(os.path.join(directory, "qualification_count.csv"), "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow([qualifications])
+    with open(os.path.join(directory, "question_responses.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        for response in responses:
+            writer.writerow([response])
+    with open(os.path.join(directory, "products.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=['name', 'price'])
+        writer.writeheader()
+        writer.writerows(product_rows)
+    with open(os.path.join(directory, "qualifications.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=['name', 'discount'])
+        writer.writeheader()
+        writer.writerows(qualification_rows)
+
+    prices = [int(p['price']) for p in product_rows]
+    rates = {q['name']: int(q['discount']) for q in qualification_rows}
+    start = EVENT_START
+    price_change = start + timedelta(hours=4)
+    old_prices = [prices[0] - 100] + prices[1:]
+    with open(os.path.join(directory, "management_log.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        for when, version in ((start - timedelta(hours=1), old_prices), (price_change, prices)):
+            writer.writerow([when.strftime('%y-%m-%d'), when.strftime('%H:%M:%S')]
+                            + [f"{p['name']}:{price}" for p, price in zip(product_rows, version)])
+    # 1件あたり平均数十秒の間隔で来客があるものとする
+    step = max(1, int(8 * 3600 / max(1, sales)))
+    with open(os.path.join(directory, "log.csv"), "w", newline="", encoding="utf-8") as log_file, \
+         open(os.path.join(directory, "survey_log.csv"), "w", newline="", encoding="utf-8") as survey_file:
+        log_writer = csv.writer(log_file)
+        survey_writer = csv.writer(survey_file)
+        for i in range(sales):
+            when = start + timedelta(seconds=i * step)
+            date_str, time_str = when.strftime('%m-%d'), when.strftime('%H:%M')
+            name = f"{rng.choice(NAMES)}{i}"
+            qualification = rng.choice(qualification_rows)['name']
+            counts = [0] * products
+            for _ in range(rng.randint(1, 3)):
+                counts[rng.randrange(products)] += rng.choice([1, 1, 1, 2, 5])
+            total = sum(c * p for c, p in zip(counts, old_prices if when < price_change else prices))
+            final_total = total * (100 - rates[qualification]) // 100
+            log_writer.writerow([date_str, time_str, name, qualification, final_total] + counts)
+            survey_writer.writerow([date_str, time_str, name, qualification, rng.choice(responses),
+                                    "" if rng.random() < 0.8 else f"備考{i}"])
+
+    if images:
+        from PIL import Image
+        image_dir = os.path.join(directory, "images")
+        os.makedirs(image_dir, exist_ok=True)
+        for i in range(products):
+            color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+            Image.new("RGB", (800, 800), color).save(os.path.join(image_dir, f"image{i+1}.png"))
+
+
+def measure(func, repeat=1):
+    """func を repeat 回実行し、各回の経過秒数のリストを返す"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings, count=1):
+    timings = sorted(timings)
+    result = {
+        'runs': len(timings),
+        'min': timings[0],
+        'median': statistics.median(timings),
+        'max': timings[-1],
+    }
+    if len(timings) >= 20:
+        result['p95'] = timings[int(len(timings) * 0.95) - 1]
+    if count > 1:
+        result['per_second'] = count / sum(timings)
+    return result
+
+
+def bench_core(results, args):
+    """Tkを使わないコア部分（索引作成・価格計算）の計測"""
+    import PointGuiSale
+
+    def build_index():
+        index = PointGuiSale.CsvRowIndex("log.csv")
+        index.refresh()
+        return index
+
+    results['core_log_index'] = summarize(measure(build_index, args.repeat))
+
+    def parse_log():
+        with open("log.csv", "r", newline="", encoding="utf-8") as f:
+            return sum(1 for _ in csv.reader(f))
+
+    results['core_log_parse'] = summarize(measure(parse_log, args.repeat))
+
+    with open("products.csv", "r", newline="", encoding="utf-8") as f:
+        products = list(csv.DictReader(f))
+    with open("qualifications.csv", "r", newline="", encoding="utf-8") as f:
+        qualifications = list(csv.DictReader(f))
+    engine = PointGuiSale.PricingEngine(products, qualifications)
+    counts = [1] * len(products)
+    results['core_price_single'] = summarize(
+        measure(lambda: engine.price(counts, qualifications[-1]['name']), args.iterations))
+    with open("log.csv", "r", newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    results['core_reprice_current'] = summarize(measure(lambda: engine.reprice_log(rows), args.repeat))
+
+    # 変更履歴から販売した時刻の価格表で計算し直す（日付に年がないので合成したイベントの年を補う）
+    history = PointGuiSale.load_catalog_history(products, qualifications)
+    segments = PointGuiSale.LogSegments("logs", read_only=True, legacy_year=EVENT_START.year)
+    timed_rows = [(PointGuiSale.row_datetime(row[0], row[1], started).timestamp(), row)
+                  for started, row in segments.iter_rows_with_start('sales')]
+    results['core_reprice_history'] = summarize(measure(lambda: history.reprice_log(timed_rows), args.repeat))
+    charged = history.reprice_log(timed_rows)[2]
+    mismatches = sum(1 for value, (_, row) in zip(charged, timed_rows) if value != int(row[4]))
+    if mismatches:
+        print(f"警告: 変更履歴から計算し直した請求額のうち {mismatches} 件が記録と一致しません")
+
+
+def bench_gui(results, args):
+    """ProductCounterApp の各処理の計測（ディスプレイが必要）"""
+    import tkinter as tk
+    import PointGuiSale
+
+    # 計測中に確認ダイアログで止まらないようにする
+    PointGuiSale.messagebox.showinfo = lambda *a, **k: None
+    PointGuiSale.messagebox.showwarning = lambda *a, **k: None
+    PointGuiSale.messagebox.askyesno = lambda *a, **k: True
+    PointGuiSale.simpledialog.askinteger = lambda *a, **k: EVENT_START.year
+
+    try:
+        tk.Tk().destroy()
+    except tk.TclError as e:  # ディスプレイがない環境ではGUIの計測を省略
+        results['gui_skipped'] = str(e)
+        return
+
+    cold_start = []
+    for _ in range(args.repeat):
+        root = tk.Tk()
+        start = time.perf_counter()
+        app = PointGuiSale.ProductCounterApp(root)
+        root.update()
+        cold_start.append(time.perf_counter() - start)
+        root.destroy()
+    results['app_cold_start'] = summarize(cold_start)
+
+    root = tk.Tk()
+    app = PointGuiSale.ProductCounterApp(root)
+    root.update()
+    # タブは最初に表示されるまで作られないので、計測対象のタブを先に作っておく
+    for key in ('log', 'survey', 'management'):
+        app.ensure_tab(key)
+    root.update()
+
+    def reload_log():
+        for item in app.log_tree.get_children():
+            app.log_tree.delete(item)
+        app.load_log_from_csv()
+        # 履歴はバックグラウンドで読み込まれるので、すべて表示されるまで待つ
+        while app.log_loader and not app.log_loader.done:
+            root.update()
+
+    results['load_log_from_csv'] = summarize(measure(reload_log, args.repeat))
+
+    def update_one():
+        app.update_count(0, 1)
+        # 表示の更新は after_idle にまとめられるので、描画まで含めて計測する
+        root.update_idletasks()
+
+    results['update_count'] = summarize(measure(update_one, args.iterations))
+
+    def save_one():
+        app.name_entry.insert(0, "ベンチ")
+        app.update_count(0, 1)
+        app.save_log()
+        root.update_idletasks()
+
+    results['save_log'] = summarize(measure(save_one, args.iterations), count=args.iterations)
+
+    def rebuild_product_count():
+        app.product_count_entry.delete(0, tk.END)
+        app.product_count_entry.insert(0, str(app.product_count))
+        app.update_product_count()
+        root.update()
+
+    results['update_product_count'] = summarize(measure(rebuild_product_count, args.repeat))
+
+    scales = [2, 3, 1]
+
+    def rebuild_image_size():
+        app.change_image_size(scales[0])
+        scales.append(scales.pop(0))
+        root.update()
+
+    results['change_image_size'] = summarize(measure(rebuild_image_size, args.repeat))
+    root.destroy()
+
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PointGuiSale ベンチマーク")
+    parser.add_argument("--sales", type=int, default=1000, help="販売履歴の件数（1000〜1000000）")
+    parser.add_argument("--products", type=int, default=6, help="商品数（6〜1000）")
+    parser.add_argument("--qualifications", type=int, default=3, help="資格数")
+    parser.add_argument("--images", action="store_true", help="商品画像も作成する")
+    parser.add_argument("--repeat", type=int, default=3, help="重い処理の計測回数")
+    parser.add_argument("--iterations", type=int, default=200, help="軽い処理の計測回数")
+    parser.add_argument("--headless", action="store_true", help="Tkを使わないコア部分のみ計測する")
+    parser.add_argument("--data-dir", help="作成したデータを置くディレクトリ（省略時は一時ディレクトリ）")
+    parser.add_argument("--output", default="benchmark_results.json", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="pgs_bench_")
+    generate_event_data(data_dir, args.sales, args.products, args.qualifications, images=args.images)
+
+    # アプリはカレントディレクトリのファイルを読み書きする
+    os.chdir(data_dir)
+    results = {}
+    bench_core(results, args)
+    if not args.headless:
+        bench_gui(results, args)
+
+    report = {
+        'version': git_version(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {'sales': args.sales, 'products': args.products,
+                   'qualifications': args.qualifications, 'images': args.images},
+        'results': results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for name, value in results.items():
+        print(name, value if isinstance(value, str) else f"{value['median'] * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+import time
+
+import PointGuiSale
+
+"""
+############################################################
+# PointGuiSale 販売レポート
+# 販売履歴（閉じたセグメントと書き込み中のセグメント、またはSQLite台帳）から
+# 日別・期間の売上、商品ごとの個数、割引額、アンケートの回答数をまとめて書き出す。
+# データのフォルダは読むだけで、settings.json や logs/manifest.json などは作らない。
+#
+# 使い方:
+#   python report.py --output report.html                          # 全期間
+#   python report.py --from 2024-08-01 --to 2024-08-31 --output august.csv
+#   python report.py --dir ../event2023 --format json --output 2023.json
+#   python report.py --dir old --year 2023 --output old.csv         # manifest.json のない以前の log.csv
+############################################################
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PointGuiSale 販売レポート")
+    parser.add_argument("--dir", default=".", help="PointGuiSale のデータがあるフォルダ")
+    parser.add_argument("--from", dest="date_from", default="", help="期間の最初の日（YYYY-MM-DD）")
+    parser.add_argument("--to", dest="date_to", default="", help="期間の最後の日（YYYY-MM-DD）")
+    parser.add_argument("--output", default="report.html", help="書き出すファイル")
+    parser.add_argument("--format", choices=["csv", "json", "html"], help="省略時は出力ファイルの拡張子で決める")
+    parser.add_argument("--workers", type=int, help="並列に集計するプロセス数（省略時はCPU数）")
+    parser.add_argument("--year", type=int,
+                        help="manifest.json のない以前の log.csv の最初の販売の年（省略時は今年）")
+    args = parser.parse_args()
+
+    try:
+        date_from = PointGuiSale.parse_report_date(args.date_from)
+        date_to = PointGuiSale.parse_report_date(args.date_to)
+    except ValueError:
+        parser.error("期間は YYYY-MM-DD の形式で指定してください")
+
+    output = os.path.abspath(args.output)
+    # アプリはカレントディレクトリのファイルを読む（レポートでは何も書き込まない）
+    os.chdir(args.dir)
+    config = PointGuiSale.ConfigStore("settings.json", read_only=True)
+    products = config.get('products') or []
+    qualifications = config.get('qualifications') or []
+    segments = PointGuiSale.LogSegments("logs", config.get('segment_mode'), legacy_year=args.year, read_only=True)
+    if args.year is None and not os.path.exists(segments.manifest_path) and os.path.exists("log.csv"):
+        print("manifest.json がないため、log.csv の最初の販売を今年とみなします（--year で年を指定できます）",
+              file=sys.stderr)
+    ledger = None
+    if config.get('storage_mode') == "sqlite" and os.path.exists("ledger.db"):
+        ledger = PointGuiSale.SalesLedger("ledger.db", read_only=True)
+
+    start = time.perf_counter()
+    # 価格や割引率を変更する前の販売は、変更履歴から当時の価格表で集計する
+    history = PointGuiSale.load_catalog_history(products, qualifications, ledger)
+    parts = PointGuiSale.report_parts(segments, ledger, date_from, date_to)
+    report = PointGuiSale.build_report(parts, products, qualifications, date_from, date_to, args.workers, history)
+    if ledger:
+        ledger.close()
+    try:
+        PointGuiSale.write_report(report, output, args.format)
+    except ValueError as e:
+        sys.exit(str(e))
+    total = report['total']
+    print(f"{report['from']}〜{report['to']}: {total['sales']}件 {total['revenue']}円 "
+          f"（{len(parts)}単位を{time.perf_counter() - start:.2f}秒で集計）→ {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+"""
+############################################################
+# PointGuiSale 同期サーバー
+# 複数のレジ（PointGuiSale）から送られてくる販売を1つの台帳にまとめ、
+# 商品・資格・質問の変更を他のレジに配る。
+#
+# 使い方:
+#   python sync_server.py --host 0.0.0.0 --port 8765   # LAN内のレジから接続を受け付ける
+#   python sync_server.py --export merged              # まとめた販売を merged/ にCSVで書き出す
+#
+# 通信は1行1メッセージのJSON:
+#   レジ → サーバー: hello / sales / catalog
+#   サーバー → レジ: ack / catalog / catalog_ack / error（hello の前に販売や変更が送られた場合）
+############################################################
+"""
+
+
+class MergedLedger:
+    """各レジの販売を販売IDで重複を除いてまとめる台帳"""
+
+    def __init__(self, path="sync_ledger.db"):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sales (
+                    id TEXT PRIMARY KEY, register TEXT, recorded TEXT, received TEXT,
+                    log TEXT, survey TEXT);
+                CREATE INDEX IF NOT EXISTS sales_recorded ON sales(recorded);
+                CREATE TABLE IF NOT EXISTS catalog (
+                    revision INTEGER PRIMARY KEY, register TEXT, updated TEXT, data TEXT);
+            """)
+
+    def add_sales(self, sales):
+        """販売を記録し、受け取った（記録済みを含む）販売IDを返す"""
+        received = datetime.now().isoformat(timespec='seconds')
+        with self.conn:
+            # 再送された販売は販売IDが同じなので無視される
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO sales (id, register, recorded, received, log, survey) VALUES (?, ?, ?, ?, ?, ?)",
+                [(sale['id'], sale['register'], sale['recorded'], received,
+                  json.dumps(sale['log'], ensure_ascii=False), json.dumps(sale['survey'], ensure_ascii=False))
+                 for sale in sales])
+        return [sale['id'] for sale in sales]
+
+    def latest_catalog(self):
+        row = self.conn.execute("SELECT revision, data FROM catalog ORDER BY revision DESC LIMIT 1").fetchone()
+        if row is None:
+            return 0, None
+        return row[0], json.loads(row[1])
+
+    def set_catalog(self, register, catalog):
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO catalog (register, updated, data) VALUES (?, ?, ?)",
+                (register, datetime.now().isoformat(timespec='seconds'), json.dumps(catalog, ensure_ascii=False)))
+        return cursor.lastrowid
+
+    def export_csv(self, directory):
+        """まとめた販売を記録日時の順に log.csv / survey_log.csv として書き出す"""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "log.csv"), "w", newline="", encoding="utf-8") as log_file, \
+                open(os.path.join(directory, "survey_log.csv"), "w", newline="", encoding="utf-8") as survey_file:
+            log_writer = csv.writer(log_file)
+            survey_writer = csv.writer(survey_file)
+            for log, survey in self.conn.execute("SELECT log, survey FROM sales ORDER BY recorded, id"):
+                log_writer.writerow(json.loads(log))
+                survey_writer.writerow(json.loads(survey))
+
+
+class SyncServer:
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self.clients = {}  # writer -> レジID
+
+    async def send(self, writer, message):
+        writer.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        register = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if message['type'] == 'hello':
+                    register = message['register']
+                    self.clients[writer] = register
+                    revision, catalog = self.ledger.latest_catalog()
+                    # レジ側に未送信の変更がなければ、新しいカタログを配る
+                    if catalog is not None and revision > message.get('catalog_revision', 0) \
+                            and not message.get('catalog_dirty'):
+                        await self.send(writer, {'type': 'catalog', 'revision': revision, 'catalog': catalog})
+                    print(f"{register} が接続しました")
+                elif register is None:
+                    # hello の前の販売・変更はどのレジのものかわからないので受け付けずに切断する
+                    await self.send(writer, {'type': 'error', 'message': "最初に hello を送ってください"})
+                    print(f"hello の前に {message['type']} が送られたので切断します")
+                    break
+                elif message['type'] == 'sales':
+                    ids = self.ledger.add_sales(message['sales'])
+                    await self.send(writer, {'type': 'ack', 'ids': ids})
+                elif message['type'] == 'catalog':
+                    revision = self.ledger.set_catalog(register, message['catalog'])
+                    await self.send(writer, {'type': 'catalog_ack', 'revision': revision})
+                    await self.broadcast(writer, {'type': 'catalog', 'revision': revision,
+                                                  'catalog': message['catalog']})
+        except (ConnectionError, ValueError, KeyError) as e:
+            print(f"{register} との通信を終了しました: {e}")
+        finally:
+            self.clients.pop(writer, None)
+            writer.close()
+            if register:
+                print(f"{register} が切断しました")
+
+    async def broadcast(self, sender, message):
+        """変更を送ってきたレジ以外に配る"""
+        for writer in list(self.clients):
+            if writer is not sender:
+                try:
+                    await self.send(writer, message)
+                except ConnectionError:
+                    self.clients.pop(writer, None)
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"同期サーバーを {host}:{port} で起動しました")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PointGuiSale 同期サーバー")
+    parser.add_argument("--host", default="127.0.0.1", help="待ち受けるアドレス（LANで使う場合は 0.0.0.0）")
+    parser.add_argument("--port", type=int, default=8765, help="待ち受けるポート")
+    parser.add_argument("--db", default="sync_ledger.db", help="まとめた販売を保存するSQLiteファイル")
+    parser.add_argument("--export", metavar="DIR", help="まとめた販売をCSVで書き出して終了する")
+    args = parser.parse_args()
+
+    ledger = MergedLedger(args.db)
+    if args.export:
+        ledger.export_csv(args.export)
+        return
+    try:
+        asyncio.run(SyncServer(ledger).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
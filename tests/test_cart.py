@@ -0,0 +1,69 @@
+import random
+
+from PointGuiSale import Cart, PricingEngine
+
+PRODUCTS = [{'name': "A", 'price': "150"}, {'name': "B", 'price': "333"}, {'name': "C", 'price': "7"}]
+QUALIFICATIONS = [{'name': "なし", 'discount': "0"}, {'name': "一部", 'discount': "15"},
+                  {'name': "全額", 'discount': "100"}]
+
+
+def new_cart():
+    return Cart([int(product['price']) for product in PRODUCTS])
+
+
+def test_counts_never_go_below_zero():
+    cart = new_cart()
+    assert cart.add(0, 2) == 2
+    assert cart.add(0, -5) == 0
+    assert cart.counts == [0, 0, 0]
+    assert cart.subtotal == 0
+    assert cart.nonzero == set()
+
+
+def test_running_subtotal_matches_pricing_engine():
+    engine = PricingEngine(PRODUCTS, QUALIFICATIONS)
+    cart = new_cart()
+    rng = random.Random(0)
+    for _ in range(500):
+        index = rng.randrange(len(PRODUCTS))
+        if rng.random() < 0.2:
+            cart.set(index, rng.randrange(5))
+        else:
+            cart.add(index, rng.choice([-1, 1, 3]))
+        qualification = rng.choice(QUALIFICATIONS)['name']
+        assert cart.totals(engine.discount_rate(qualification)) == engine.price(cart.counts, qualification)
+        assert cart.nonzero == {i for i, count in enumerate(cart.counts) if count}
+
+
+def test_clear_returns_only_selected_products():
+    cart = new_cart()
+    cart.add(0, 1)
+    cart.add(2, 4)
+    cart.add(1, 1)
+    cart.add(1, -1)
+    assert cart.clear() == {0, 2}
+    assert cart.counts == [0, 0, 0] and cart.subtotal == 0
+    assert cart.clear() == set()
+
+
+def test_load_pads_and_truncates_counts():
+    cart = new_cart()
+    cart.load(["2", "", -1, 5])
+    assert cart.counts == [2, 0, 0]
+    assert cart.subtotal == 300
+    cart.load([1])
+    assert cart.counts == [1, 0, 0]
+    assert cart.nonzero == {0}
+
+
+def test_set_prices_resizes_counts_and_recomputes():
+    cart = new_cart()
+    cart.add(1, 2)
+    cart.add(2, 1)
+    cart.set_prices([100, 200])
+    assert cart.counts == [0, 2]
+    assert cart.subtotal == 400
+    cart.set_prices([100, 200, 50, 10])
+    assert cart.counts == [0, 2, 0, 0]
+    cart.add(3, 3)
+    assert cart.subtotal == 430
@@ -0,0 +1,83 @@
+import csv
+from datetime import datetime
+
+from PointGuiSale import CatalogHistory, SalesLedger, load_catalog_history
+
+PRODUCTS = [{'name': "A2", 'price': "150"}, {'name': "B", 'price': "50"}]
+QUALIFICATIONS = [{'name': "会員", 'discount': "10"}]
+
+
+def change_row(when, entries):
+    return [when.strftime('%y-%m-%d'), when.strftime('%H:%M:%S')] + entries
+
+
+MANAGEMENT_ROWS = [
+    change_row(datetime(2024, 8, 27, 9), ["A:100", "B:50"]),
+    # 12:00:30 に A を A2 に改名して値上げした
+    change_row(datetime(2024, 8, 27, 12, 0, 30), ["A2:150", "B:50"]),
+]
+QUALIFICATION_ROWS = [change_row(datetime(2024, 8, 27, 9), ["会員:20%"])]
+
+
+def history():
+    return CatalogHistory(PRODUCTS, QUALIFICATIONS, MANAGEMENT_ROWS, QUALIFICATION_ROWS)
+
+
+def ts(hour, minute=0):
+    return datetime(2024, 8, 27, hour, minute).timestamp()
+
+
+def test_parse_row_rejects_broken_rows():
+    assert CatalogHistory.parse_row(["24-08-27"], 'products') is None
+    assert CatalogHistory.parse_row(change_row(datetime(2024, 8, 27), ["A:abc"]), 'products') is None
+    timestamp, version = CatalogHistory.parse_row(change_row(datetime(2024, 8, 27), ["会員:5%"]), 'qualifications')
+    assert version == [{'name': "会員", 'discount': "5"}]
+
+
+def test_pricing_at_picks_version_in_effect():
+    catalog = history()
+    assert catalog.pricing_at(ts(8)).prices == [100, 50]    # 最初の変更より前は最も古い版
+    assert catalog.pricing_at(ts(11)).names == ["A", "B"]
+    assert catalog.pricing_at(ts(13)).names == ["A2", "B"]
+    assert catalog.pricing_at(ts(13)).discount_rate("会員") == 20
+    assert catalog.pricing_at(ts(11)) is catalog.pricing_at(ts(10))  # 版ごとに使い回す
+
+
+def test_pricing_for_sale_resolves_change_within_the_minute():
+    catalog = history()
+    # 12:00 の販売は変更の前後どちらもありうるので、記録された請求額で決める
+    before = ["08-27", "12:00", "客", "会員", "80", "1", "0"]
+    after = ["08-27", "12:00", "客", "会員", "120", "1", "0"]
+    assert catalog.pricing_for_sale(before, [1, 0], ts(12)).names == ["A", "B"]
+    assert catalog.pricing_for_sale(after, [1, 0], ts(12)).names == ["A2", "B"]
+
+
+def test_reprice_log_matches_recorded_charges():
+    rows = [(ts(10), ["08-27", "10:00", "客1", "会員", "240", "2", "2"]),
+            (ts(13), ["08-27", "13:00", "客2", "会員", "160", "1", "1"]),
+            (ts(13), ["08-27", "13:00", "客3", "なし", "150", "1"])]
+    gross, discount, charged = history().reprice_log(rows)
+    assert gross == [300, 200, 150]
+    assert discount == [60, 40, 0]
+    assert charged == [int(row[4]) for _, row in rows]
+
+
+def test_without_changes_uses_current_settings():
+    catalog = CatalogHistory(PRODUCTS, QUALIFICATIONS)
+    assert catalog.pricing_at(ts(10)).prices == [150, 50]
+    assert catalog.pricing_at(ts(10)).discount_rate("会員") == 10
+
+
+def test_load_from_csv_and_ledger(tmp_path):
+    with open(tmp_path / "management_log.csv", "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(MANAGEMENT_ROWS)
+    loaded = load_catalog_history(PRODUCTS, QUALIFICATIONS, directory=str(tmp_path))
+    assert loaded.pricing_at(ts(10)).names == ["A", "B"]
+
+    ledger = SalesLedger(str(tmp_path / "ledger.db"))
+    for row in QUALIFICATION_ROWS:
+        ledger.record_change('qualification_log', row)
+    loaded = load_catalog_history(PRODUCTS, QUALIFICATIONS, ledger)
+    assert loaded.pricing_at(ts(10)).discount_rate("会員") == 20
+    assert loaded.pricing_at(ts(10)).names == ["A2", "B"]
+    ledger.close()
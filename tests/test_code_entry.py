@@ -0,0 +1,41 @@
+import pytest
+
+from PointGuiSale import ProductSearchIndex, normalize_text, parse_code_entry
+
+
+def test_single_codes_and_quantities():
+    assert parse_code_entry("A01") == [("A01", 1)]
+    assert parse_code_entry("A01*3") == [("A01", 3)]
+    assert parse_code_entry("-A01") == [("A01", -1)]
+    assert parse_code_entry("-A01*2") == [("A01", -2)]
+
+
+def test_several_tokens_in_one_entry():
+    # バーコードリーダーで続けて読み取った場合や、全角の空白で区切った場合
+    assert parse_code_entry(" A01 B02*2\t-A01　C03 ") == [("A01", 1), ("B02", 2), ("A01", -1), ("C03", 1)]
+    assert parse_code_entry("") == []
+    assert parse_code_entry("   ") == []
+
+
+def test_missing_quantity_after_star_counts_one():
+    assert parse_code_entry("A01*") == [("A01", 1)]
+
+
+@pytest.mark.parametrize("text", ["*3", "-", "-*2", "A01*x", "B02 *2"])
+def test_invalid_tokens_raise(text):
+    with pytest.raises(ValueError):
+        parse_code_entry(text)
+
+
+def test_codes_are_looked_up_normalized():
+    code_index = {normalize_text(code): i for i, code in enumerate(["ab-1", "Ｃ２"])}
+    assert [code_index.get(normalize_text(code)) for code, _ in parse_code_entry("AB-1 c2 ｃ２ X")] == [0, 1, 1, None]
+
+
+def test_catalog_search_matches_code_prefixes():
+    index = ProductSearchIndex([{'name': "りんご", 'code': "F001"}, {'name': "みかん", 'code': "F002"},
+                                {'name': "ぶどう ジュース", 'code': "D001"}])
+    assert index.search("f00") == [0, 1]
+    assert index.search("Ｄ") == [2]
+    assert index.search("ジュ") == [2]
+    assert index.search("Z") == []
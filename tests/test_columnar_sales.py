@@ -0,0 +1,54 @@
+import json
+from datetime import datetime
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from PointGuiSale import ColumnarSales  # noqa: E402
+
+PRODUCTS = [{'id': "p1", 'name': "A", 'price': "200"}, {'id': "p2", 'name': "B", 'price': "50"}]
+
+
+def timestamp(hour):
+    return int(datetime(2024, 8, 27, hour).timestamp())
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ColumnarSales(str(tmp_path / "columns"))
+    store.create()
+    yield store
+    store.close()
+
+
+def test_summarize_uses_prices_recorded_at_sale_time(store):
+    # A は 100円で2個売れた後に200円へ値上げして1個売れた
+    store.append(timestamp(10), 200, 200, "なし", {"p1": (2, 200)})
+    store.append(timestamp(11), 180, 200, "一部", {"p1": (1, 200)})
+    store.append(timestamp(11), 50, 50, "なし", {"p2": (1, 50)})
+    data = store.summarize(PRODUCTS)
+    assert data['products'] == {"A": [3, 400], "B": [1, 50]}
+    assert (data['sales'], data['gross'], data['discount'], data['revenue']) == (3, 450, 20, 430)
+    assert data['qualifications'] == {"なし": [2, 250, 0], "一部": [1, 180, 20]}
+    assert data['hours'] == {"08-27 10時": [1, 200], "08-27 11時": [2, 230]}
+    assert store.summarize(PRODUCTS, start=timestamp(11))['products'] == {"A": [1, 200], "B": [1, 50]}
+
+
+def test_store_grows_and_reopens(tmp_path, store):
+    sales = [(timestamp(10) + i, 200, 200, "なし", {"p1": (1, 200)}) for i in range(ColumnarSales.INITIAL_CAPACITY + 5)]
+    store.append_many(sales)
+    store.close()
+    reopened = ColumnarSales(str(tmp_path / "columns"))
+    assert reopened.ready and len(reopened) == len(sales)
+    assert reopened.summarize(PRODUCTS)['products'] == {"A": [len(sales), 200 * len(sales)]}
+    reopened.close()
+
+
+def test_old_format_is_rebuilt(tmp_path, store):
+    store.close()
+    meta_path = tmp_path / "columns" / "meta.json"
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    meta['version'] = 1
+    meta_path.write_text(json.dumps(meta), encoding="utf-8")
+    assert not ColumnarSales(str(tmp_path / "columns")).ready
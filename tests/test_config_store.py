@@ -0,0 +1,118 @@
+import csv
+import json
+import os
+
+import pytest
+
+from PointGuiSale import ConfigStore, read_legacy_settings
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(rows)
+
+
+def write_text(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+@pytest.fixture
+def legacy_dir(tmp_path):
+    """以前のバージョンが書いた個別の設定ファイルのあるフォルダ"""
+    write_csv(tmp_path / "product_count.csv", [[2]])
+    write_csv(tmp_path / "survey_count.csv", [[4]])
+    write_csv(tmp_path / "qualification_count.csv", [[1]])
+    write_csv(tmp_path / "question_responses.csv", [["未回答"], ["よい"], ["ふつう"], ["わるい"]])
+    write_text(tmp_path / "image_scale.txt", "2")
+    write_csv(tmp_path / "products.csv", [["name", "price"], ["りんご", "150"], ["みかん", "80"]])
+    write_csv(tmp_path / "qualifications.csv", [["name", "discount"], ["学生", "10"]])
+    write_text(tmp_path / "shop_name.txt", "駅前店\n")
+    write_text(tmp_path / "persistent_text.txt", "毎週火曜定休")
+    write_text(tmp_path / "list_mode.txt", "virtual")
+    write_text(tmp_path / "storage_mode.txt", "sqlite")
+    write_csv(tmp_path / "write_policy.csv", [["idle", 500]])
+    return tmp_path
+
+
+EXPECTED = {
+    'product_count': 2,
+    'survey_count': 4,
+    'qualification_count': 1,
+    'question_responses': ["未回答", "よい", "ふつう", "わるい"],
+    'image_scale': 2,
+    'products': [{'name': "りんご", 'price': "150"}, {'name': "みかん", 'price': "80"}],
+    'qualifications': [{'name': "学生", 'discount': "10"}],
+    'shop_name': "駅前店",
+    'persistent_text': "毎週火曜定休",
+    'list_mode': "virtual",
+    'storage_mode': "sqlite",
+    'write_policy': ["idle", 500],
+}
+
+
+def test_read_legacy_settings(legacy_dir):
+    assert read_legacy_settings(str(legacy_dir)) == EXPECTED
+
+
+def test_first_start_migrates_legacy_files_into_settings_json(legacy_dir):
+    config = ConfigStore(str(legacy_dir / "settings.json"))
+    for key, value in EXPECTED.items():
+        assert config.get(key) == value
+    # 以前のバージョンになかった設定は初期値のまま
+    assert config.get('segment_mode') == ConfigStore.DEFAULTS['segment_mode']
+
+    stored = json.loads((legacy_dir / "settings.json").read_text(encoding="utf-8"))
+    assert stored['version'] == ConfigStore.VERSION
+    assert stored['settings']['products'] == EXPECTED['products']
+    # 2回目以降は settings.json だけを読む
+    (legacy_dir / "shop_name.txt").unlink()
+    assert ConfigStore(str(legacy_dir / "settings.json")).get('shop_name') == "駅前店"
+
+
+def test_read_only_writes_nothing(legacy_dir):
+    before = {name: (legacy_dir / name).read_bytes() for name in os.listdir(legacy_dir)}
+    config = ConfigStore(str(legacy_dir / "settings.json"), read_only=True)
+    assert config.get('products') == EXPECTED['products']
+    config.set('shop_name', "別の店")
+    config.flush()
+    assert {name: (legacy_dir / name).read_bytes() for name in os.listdir(legacy_dir)} == before
+
+
+def test_missing_or_broken_legacy_files_keep_defaults(tmp_path):
+    write_text(tmp_path / "image_scale.txt", "x2")
+    write_csv(tmp_path / "product_count.csv", [])
+    config = ConfigStore(str(tmp_path / "settings.json"))
+    assert config.get('image_scale') == ConfigStore.DEFAULTS['image_scale']
+    assert config.get('product_count') == ConfigStore.DEFAULTS['product_count']
+    assert config.get('products') is None
+
+
+def test_write_policy_without_interval_uses_200ms(tmp_path):
+    write_csv(tmp_path / "write_policy.csv", [["always"]])
+    assert read_legacy_settings(str(tmp_path)) == {'write_policy': ["always", 200]}
+
+
+def test_set_is_debounced_and_bumps_revision(tmp_path):
+    scheduled = []
+    path = tmp_path / "settings.json"
+    config = ConfigStore(str(path), after=lambda ms, callback: scheduled.append(callback))
+    revision = json.loads(path.read_text(encoding="utf-8"))['revision']
+    config.set('shop_name', "駅前店")
+    config.set('persistent_text', "定休日")
+    assert len(scheduled) == 1
+    assert json.loads(path.read_text(encoding="utf-8"))['settings']['shop_name'] == ""
+    scheduled[0]()
+    stored = json.loads(path.read_text(encoding="utf-8"))
+    assert stored['revision'] == revision + 1
+    assert stored['settings']['shop_name'] == "駅前店" and stored['settings']['persistent_text'] == "定休日"
+    # 取り出した値を変えても保存された設定は変わらない
+    config.get('question_responses').append("追加")
+    assert config.get('question_responses') == ConfigStore.DEFAULTS['question_responses']
+
+
+def test_newer_settings_version_is_rejected(tmp_path):
+    path = tmp_path / "settings.json"
+    path.write_text(json.dumps({'version': ConfigStore.VERSION + 1, 'settings': {}}), encoding="utf-8")
+    with pytest.raises(ValueError):
+        ConfigStore(str(path))
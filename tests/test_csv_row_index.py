@@ -0,0 +1,60 @@
+import csv
+
+from PointGuiSale import CsvRowIndex
+
+
+def make_rows(start, stop):
+    return [["08-27", "10:00", f"客{i}", "資格 1", "未回答", "改行\nあり" if i % 7 == 0 else f'引用"{i}"']
+            for i in range(start, stop)]
+
+
+def append(path, rows):
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(rows)
+
+
+def test_rows_across_pages(tmp_path):
+    path = tmp_path / "survey_log.csv"
+    rows = make_rows(0, 450)
+    append(path, rows)
+    index = CsvRowIndex(str(path))
+    index.refresh()
+    assert len(index) == 450
+    assert index.rows(0, 450) == rows
+    assert index.rows(195, 205) == rows[195:205]
+    assert index.rows(440, 1000) == rows[440:]
+    assert index.rows(-5, 2) == rows[:2]
+
+
+def test_incremental_refresh_and_partial_last_line(tmp_path):
+    path = tmp_path / "log.csv"
+    append(path, make_rows(0, 10))
+    index = CsvRowIndex(str(path))
+    index.refresh()
+    assert index.rows(9, 10) == make_rows(9, 10)  # 末尾のページを読み込んでおく
+
+    # 書き込み途中の行（引用符で囲まれた改行の途中）は索引に加えない
+    with open(path, "a", encoding="utf-8", newline="") as f:
+        f.write('08-27,10:00,客10,資格 1,未回答,"改行\n')
+    index.refresh()
+    assert len(index) == 10
+    with open(path, "a", encoding="utf-8", newline="") as f:
+        f.write('あり"\r\n')
+    append(path, make_rows(11, 12))
+    index.refresh()
+    assert len(index) == 12
+    assert index.rows(9, 12) == make_rows(9, 10) + [["08-27", "10:00", "客10", "資格 1", "未回答", "改行\nあり"]] \
+        + make_rows(11, 12)
+
+
+def test_recreated_or_missing_file_resets(tmp_path):
+    path = tmp_path / "log.csv"
+    append(path, make_rows(0, 5))
+    index = CsvRowIndex(str(path))
+    index.refresh()
+    path.unlink()
+    index.refresh()
+    assert len(index) == 0
+    append(path, make_rows(100, 102))
+    index.refresh()
+    assert index.rows(0, 10) == make_rows(100, 102)
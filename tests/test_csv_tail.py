@@ -0,0 +1,67 @@
+import csv
+
+import pytest
+
+from PointGuiSale import pair_sales, read_csv_tail
+
+
+def write_rows(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(rows)
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 64, 8192])
+def test_read_csv_tail_matches_full_read(tmp_path, block_size):
+    path = tmp_path / "survey_log.csv"
+    # 引用符で囲まれた改行や引用符を含む備考があっても行の途中で切らない
+    rows = [["08-27", f"10:{i:02d}", f"客{i}", "資格 1", "未回答", "改行\nあり" if i % 3 == 0 else f'引用"{i}"']
+            for i in range(40)]
+    write_rows(path, rows)
+    for count in (1, 5, 39, 40, 100):
+        assert read_csv_tail(str(path), count, block_size) == rows[-count:]
+
+
+def test_read_csv_tail_edge_cases(tmp_path):
+    assert read_csv_tail(str(tmp_path / "missing.csv"), 5) == []
+    path = tmp_path / "log.csv"
+    write_rows(path, [["a"]])
+    assert read_csv_tail(str(path), 0) == []
+    path.write_bytes(b"")
+    assert read_csv_tail(str(path), 3) == []
+
+
+def sale(i, time_str="10:00"):
+    return ["08-27", time_str, f"客{i}", "資格 1", "100"]
+
+
+def survey(i, time_str="10:00"):
+    return ["08-27", time_str, f"客{i}", "資格 1", "未回答", ""]
+
+
+def test_pair_sales_newest_first():
+    pairs = pair_sales([sale(1), sale(2)], [survey(1), survey(2)])
+    assert [(log[2], answer[2]) for log, answer in pairs] == [("客2", "客2"), ("客1", "客1")]
+
+
+def test_pair_sales_skips_rows_missing_on_one_side():
+    # 販売の書き込みの途中で止まり、アンケート結果だけが残った行と、その逆
+    logs = [sale(1, "10:00"), sale(2, "10:01"), sale(4, "10:03")]
+    surveys = [survey(1, "10:00"), survey(3, "10:02"), survey(4, "10:03")]
+    pairs = pair_sales(logs, surveys)
+    assert [log[2] for log, _ in pairs] == ["客4", "客1"]
+    assert pair_sales([], surveys) == []
+
+
+def test_pair_sales_keeps_the_matching_row_at_the_same_time():
+    # 同じ時刻の販売のうち B のアンケート結果だけがない場合も A は対応付ける
+    assert pair_sales([sale("A"), sale("B")], [survey("A")]) == [(sale("A"), survey("A"))]
+    assert pair_sales([sale("A"), sale("B")], [survey("B")]) == [(sale("B"), survey("B"))]
+    # A の販売履歴だけがない場合
+    assert pair_sales([sale("B")], [survey("A"), survey("B")]) == [(sale("B"), survey("B"))]
+
+
+def test_pair_sales_across_the_new_year():
+    logs = [["12-31", "23:59", "客1", "資格 1", "100"], ["01-01", "00:01", "客2", "資格 1", "100"]]
+    surveys = [["12-31", "23:59", "客1", "資格 1", "未回答", ""], ["01-01", "00:00", "客3", "資格 1", "未回答", ""],
+               ["01-01", "00:01", "客2", "資格 1", "未回答", ""]]
+    assert [log[2] for log, _ in pair_sales(logs, surveys)] == ["客2", "客1"]
@@ -0,0 +1,40 @@
+from datetime import datetime
+
+from PointGuiSale import HistoryIndex, parse_search_date
+
+
+def test_date_filter_does_not_mix_years():
+    rows = [
+        (datetime(2024, 8, 27, 9), ["08-27", "10:00", "前年", "資格 1", "100"]),
+        (datetime(2025, 8, 27, 9), ["08-27", "11:00", "今年", "資格 1", "100"]),
+        (datetime(2025, 8, 27, 9), ["08-28", "09:00", "翌日", "資格 1", "100"]),
+    ]
+    index = HistoryIndex().build(rows, [])
+    assert index.query(date_from="2025-08-27", date_to="2025-08-27") == [1]
+    assert index.query(date_from="2024-08-27", date_to="2024-08-27") == [0]
+    assert index.query(date_from="2025-08-27") == [1, 2]
+    index.add(["08-29", "12:00", "追加", "資格 1", "100"], [], datetime(2025, 8, 29, 12))
+    assert index.query(date_to="2024-12-31") == [0]
+    assert index.query(date_from="2025-08-29") == [3]
+
+
+def test_parse_search_date():
+    assert parse_search_date("") == ""
+    assert parse_search_date("2024-8-27") == "2024-08-27"
+    assert parse_search_date("08-27", today=datetime(2025, 1, 1)) == "2025-08-27"
+
+
+def test_build_pairs_rows_by_key_not_position():
+    started = datetime(2025, 8, 27, 9)
+    logs = [(started, ["08-27", "10:00", f"客{i}", "資格 1", "100"]) for i in range(3)]
+    # 客1 のアンケート結果は書き込めず、最後に販売履歴のないアンケート結果がある
+    surveys = [["08-27", "10:00", "客0", "資格 1", "回答1", ""],
+               ["08-27", "10:00", "客2", "資格 1", "回答2", "備考"],
+               ["08-27", "11:00", "客3", "資格 1", "回答1", ""]]
+    index = HistoryIndex().build(logs, surveys)
+    assert [(log[2] if log else None, survey[2] if survey else None) for log, survey in index.records] == [
+        ("客0", "客0"), ("客1", None), ("客2", "客2"), (None, "客3")]
+    assert index.query(survey="回答2") == [2]
+    assert index.query(name="客3") == [3]
+    assert index.query(date_from="2025-08-27", date_to="2025-08-27") == [0, 1, 2, 3]
+    assert "None" not in index.by_name and "[]" not in index.by_survey
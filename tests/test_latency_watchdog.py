@@ -0,0 +1,32 @@
+import time
+
+from PointGuiSale import LatencyWatchdog
+
+
+def test_time_paused_for_dialogs_is_not_counted(tmp_path):
+    watchdog = LatencyWatchdog(None, enabled=True, log_path=str(tmp_path / "latency.log"))
+
+    def callback():
+        with watchdog.paused():
+            time.sleep(0.2)  # 確認ダイアログで待っている間
+
+    watchdog.timed("callback", callback)()
+    watchdog.timed("slow", lambda: time.sleep(0.06))()
+    samples = {name: max(values) for name, values in watchdog.samples.items()}
+    assert samples["callback"] < 50
+    assert samples["slow"] >= 50
+    assert "slow" in (tmp_path / "latency.log").read_text(encoding="utf-8")
+
+
+def test_disabled_watchdog_leaves_callbacks_untouched():
+    class App:
+        def save_log(self):
+            return "saved"
+
+    app = App()
+    watchdog = LatencyWatchdog(None)
+    watchdog.wrap(app, ["save_log"])
+    assert "save_log" not in vars(app)
+    with watchdog.paused():
+        pass
+    assert app.save_log() == "saved"
@@ -0,0 +1,114 @@
+import csv
+import gzip
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from PointGuiSale import LogSegments, iter_report_days, row_datetime
+
+
+def write_rows(path, rows):
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(rows)
+
+
+def sale(date_str, i):
+    return [date_str, "10:00", f"客{i}", "資格 1", "100", "1"]
+
+
+def new_segments(tmp_path, **kwargs):
+    return LogSegments(str(tmp_path / "logs"), active_dir=str(tmp_path), **kwargs)
+
+
+def test_rotate_compresses_and_records_offsets(tmp_path):
+    segments = new_segments(tmp_path)
+    write_rows(tmp_path / "log.csv", [sale("08-27", 0), sale("08-27", 1)])
+    write_rows(tmp_path / "survey_log.csv", [["08-27", "10:00", "客0"], ["08-27", "10:00", "客1"]])
+    size = os.path.getsize(tmp_path / "log.csv")
+    first = segments.rotate(datetime(2024, 8, 28, 9))
+    assert first['sales']['rows'] == 2 and first['sales']['bytes'] == size
+    assert os.path.getsize(tmp_path / "log.csv") == 0
+    with gzip.open(tmp_path / "logs" / first['sales']['file'], "rt", encoding="utf-8") as f:
+        assert len(f.read().splitlines()) == 2
+
+    write_rows(tmp_path / "log.csv", [sale("08-28", 2)])
+    write_rows(tmp_path / "survey_log.csv", [["08-28", "10:00", "客2"]])
+    second = segments.rotate(datetime(2024, 8, 29, 9))
+    assert second['sales']['first_row'] == 2 and second['sales']['offset'] == size
+    # 空のセグメントは残さない
+    assert segments.rotate(datetime(2024, 8, 30, 9)) is None
+    assert [row[2] for row in segments.iter_rows('sales')] == ["客0", "客1", "客2"]
+    assert segments.count_rows('sales') == 3
+
+
+def test_interrupted_rotation_is_finished_on_load(tmp_path):
+    segments = new_segments(tmp_path)
+    write_rows(tmp_path / "log.csv", [sale("08-27", 0)])
+    write_rows(tmp_path / "survey_log.csv", [["08-27", "10:00", "客0"]])
+    # マニフェストに記録した直後（書き込み中のファイルを空にする前）に止まった状態を作る
+    segments.drop_closed_bytes = lambda: None
+    segments.rotate(datetime(2024, 8, 28, 9))
+    write_rows(tmp_path / "log.csv", [sale("08-28", 1)])
+    manifest = json.loads((tmp_path / "logs" / "manifest.json").read_text(encoding="utf-8"))
+    assert 'closed_bytes' in manifest['active']
+
+    # 読み取り専用では書き込み中のファイルを変えずに、移した分を読み飛ばす
+    read_only = new_segments(tmp_path, read_only=True)
+    assert [row[2] for row in read_only.iter_rows('sales')] == ["客0", "客1"]
+    assert 'closed_bytes' in json.loads((tmp_path / "logs" / "manifest.json").read_text(encoding="utf-8"))['active']
+
+    reopened = new_segments(tmp_path)
+    assert 'closed_bytes' not in reopened.manifest['active']
+    assert [row[2] for row in reopened.iter_rows('sales')] == ["客0", "客1"]
+    with open(tmp_path / "log.csv", newline="", encoding="utf-8") as f:
+        assert [row[2] for row in csv.reader(f)] == ["客1"]
+
+
+def test_legacy_log_uses_recorded_year_not_mtime(tmp_path):
+    write_rows(tmp_path / "log.csv", [sale("08-27", 0), sale("12-31", 1), sale("01-01", 2)])
+    asked = []
+    segments = new_segments(tmp_path, legacy_year=lambda: asked.append(True) or 2024)
+    assert asked == [True]
+    assert segments.active_started() == datetime(2024, 8, 27, 10, 0)
+    # 12月の次の1月は翌年とみなす
+    years = [started.year for started, _ in segments.iter_rows_with_start('sales')]
+    assert years == [2024, 2024, 2025]
+    # 2回目以降はマニフェストに記録した開始日時を使い、年は尋ねない
+    assert new_segments(tmp_path, legacy_year=lambda: 1999).active_started() == datetime(2024, 8, 27, 10, 0)
+
+
+def test_report_days_roll_over_to_next_year():
+    rows = [sale("12-31", 0), sale("01-01", 1), sale("01-02", 2)]
+    days = [day for day, _ in iter_report_days(rows, datetime(2023, 12, 30))]
+    assert [day.isoformat() for day in days] == ["2023-12-31", "2024-01-01", "2024-01-02"]
+
+
+def test_read_only_does_not_create_manifest(tmp_path):
+    write_rows(tmp_path / "log.csv", [sale("08-27", 0)])
+    segments = new_segments(tmp_path, legacy_year=2024, read_only=True)
+    assert segments.active_started().year == 2024
+    assert not (tmp_path / "logs").exists()
+
+
+def test_legacy_year_is_guessed_until_confirmed(tmp_path):
+    write_rows(tmp_path / "log.csv", [sale("08-27", 0), sale("08-28", 1)])
+    segments = new_segments(tmp_path)
+    # 年を尋ねずに、最初の販売を今日から遡って直近の日付とみなす
+    assert segments.legacy_pending()
+    assert segments.active_started() == row_datetime("08-27", "10:00", datetime.now())
+    assert new_segments(tmp_path).legacy_pending()
+    segments.set_legacy_year(2023)
+    assert not segments.legacy_pending()
+    reopened = new_segments(tmp_path)
+    assert not reopened.legacy_pending()
+    assert reopened.active_started() == datetime(2023, 8, 27, 10, 0)
+
+
+def test_row_datetime_falls_back_for_february_29():
+    # 前後1年にうるう年がない場合は、それより前の直近のうるう年とする
+    assert row_datetime("02-29", "10:00", datetime(2026, 3, 1)) == datetime(2024, 2, 29, 10, 0)
+    assert row_datetime("02-29", "10:00", datetime(2025, 3, 1)) == datetime(2024, 2, 29, 10, 0)
+    with pytest.raises(ValueError):
+        row_datetime("02-30", "10:00", datetime(2025, 3, 1))
@@ -0,0 +1,75 @@
+import random
+
+import pytest
+
+import PointGuiSale
+from PointGuiSale import PricingEngine
+
+PRODUCTS = [{'name': "A", 'price': "150"}, {'name': "B", 'price': "333"}, {'name': "C", 'price': "7"}]
+QUALIFICATIONS = [{'name': "なし", 'discount': "0"}, {'name': "一部", 'discount': "15"},
+                  {'name': "全額", 'discount': "100"}]
+
+
+@pytest.fixture(params=["numpy", "python"])
+def engine(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(PointGuiSale, "np", None)
+    return PricingEngine(PRODUCTS, QUALIFICATIONS)
+
+
+def as_lists(result):
+    return tuple([int(value) for value in column] for column in result)
+
+
+def test_price_truncates_discount_and_charge(engine):
+    # 2*150 + 333 = 633 の15%引き: 割引 94.95 -> 94円、請求 538.05 -> 538円（どちらも切り捨て）
+    assert engine.price([2, 1, 0], "一部") == (633, 94, 538)
+
+
+def test_price_has_no_float_error(engine):
+    # 浮動小数点で 100 * 0.93 を計算すると 92.99... になり92円と表示されていた
+    products = [{'name': "A", 'price': "100"}]
+    qualifications = [{'name': "7%", 'discount': "7"}]
+    pricing = PricingEngine(products, qualifications)
+    assert pricing.price([1], "7%") == (100, 7, 93)
+    assert as_lists(pricing.price_batch([[1]], ["7%"])) == ([100], [7], [93])
+
+
+@pytest.mark.parametrize("qualification, expected", [
+    ("なし", (633, 0, 633)),
+    ("全額", (633, 633, 0)),
+    ("未登録", (633, 0, 633)),
+])
+def test_price_with_rate_0_and_100(engine, qualification, expected):
+    assert engine.price([2, 1, 0], qualification) == expected
+
+
+def test_price_batch_matches_price(engine):
+    rng = random.Random(1)
+    names = [q['name'] for q in QUALIFICATIONS] + ["未登録"]
+    counts_list = [[rng.randint(0, 9) for _ in PRODUCTS] for _ in range(500)]
+    qualifications = [rng.choice(names) for _ in counts_list]
+    expected = [engine.price(counts, q) for counts, q in zip(counts_list, qualifications)]
+    assert as_lists(engine.price_batch(counts_list, qualifications)) == tuple(
+        list(column) for column in zip(*expected))
+
+
+def test_price_batch_ignores_extra_and_missing_columns(engine):
+    result = as_lists(engine.price_batch([[1, 1, 1, 5], [1]], ["なし", "一部"]))
+    assert result == ([490, 150], [0, 22], [490, 127])
+
+
+def test_price_batch_empty_input(engine):
+    assert as_lists(engine.price_batch([], [])) == ([], [], [])
+
+
+def test_numpy_and_python_agree(monkeypatch):
+    pytest.importorskip("numpy")
+    rng = random.Random(2)
+    counts_list = [[rng.randint(0, 50) for _ in PRODUCTS] for _ in range(200)]
+    qualifications = [rng.choice(QUALIFICATIONS)['name'] for _ in counts_list]
+    vectorized = as_lists(PricingEngine(PRODUCTS, QUALIFICATIONS).price_batch(counts_list, qualifications))
+    monkeypatch.setattr(PointGuiSale, "np", None)
+    assert as_lists(PricingEngine(PRODUCTS, QUALIFICATIONS).price_batch(counts_list, qualifications)) == vectorized
@@ -0,0 +1,126 @@
+import csv
+import json
+import os
+import subprocess
+import sys
+from datetime import date, datetime
+
+import pytest
+
+from PointGuiSale import (CatalogHistory, LogSegments, SalesLedger, build_report, report_parts,
+                          write_report)
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRODUCTS = [{'name': "A", 'price': "200"}, {'name': "B", 'price': "50"}]
+QUALIFICATIONS = [{'name': "なし", 'discount': "0"}, {'name': "会員", 'discount': "10"}]
+# 8月27日の12時に A を100円から200円に値上げした
+MANAGEMENT_ROWS = [["24-08-27", "09:00:00", "A:100", "B:50"], ["24-08-27", "12:00:00", "A:200", "B:50"]]
+
+
+def append(path, rows):
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(rows)
+
+
+def record(directory, date_str, time_str, qualification, total, counts, answer):
+    append(directory / "log.csv", [[date_str, time_str, "客", qualification, total] + counts])
+    append(directory / "survey_log.csv", [[date_str, time_str, "客", qualification, answer, ""]])
+
+
+@pytest.fixture
+def segments(tmp_path):
+    segments = LogSegments(str(tmp_path / "logs"), active_dir=str(tmp_path), legacy_year=2024)
+    segments.manifest['active']['started'] = "2024-08-27T09:00:00"
+    record(tmp_path, "08-27", "10:00", "なし", 250, [2, 1], "回答1")
+    record(tmp_path, "08-27", "13:00", "会員", 180, [1, 0], "回答1")
+    segments.rotate(datetime(2024, 8, 27, 23, 59))
+    record(tmp_path, "08-28", "10:00", "なし", 50, [0, 1], "回答2")
+    return segments
+
+
+def history():
+    return CatalogHistory(PRODUCTS, QUALIFICATIONS, MANAGEMENT_ROWS)
+
+
+def test_report_uses_prices_at_sale_time(segments):
+    report = build_report(report_parts(segments), PRODUCTS, QUALIFICATIONS, workers=1, history=history())
+    assert report['from'] == "2024-08-27" and report['to'] == "2024-08-28"
+    first = report['days']["2024-08-27"]
+    assert (first['sales'], first['gross'], first['discount'], first['revenue']) == (2, 450, 20, 430)
+    assert first['products'] == {"A": [3, 400], "B": [1, 50]}
+    assert first['qualifications'] == {"なし": [1, 250, 0], "会員": [1, 180, 20]}
+    assert first['answers'] == {"回答1": [2]}
+    assert report['total']['sales'] == 3 and report['total']['revenue'] == 480
+    assert report['total']['answers'] == {"回答1": [2], "回答2": [1]}
+
+
+def test_period_skips_other_segments(segments):
+    parts = report_parts(segments, date_from=date(2024, 8, 28), date_to=date(2024, 8, 28))
+    assert all(not part['path'].endswith(".gz") for part in parts)
+    report = build_report(parts, PRODUCTS, QUALIFICATIONS, date(2024, 8, 28), date(2024, 8, 28), workers=1)
+    assert list(report['days']) == ["2024-08-28"]
+    assert report['total']['revenue'] == 50
+
+
+def test_parallel_matches_serial(segments):
+    parts = report_parts(segments)
+    serial = build_report(parts, PRODUCTS, QUALIFICATIONS, workers=1, history=history())
+    parallel = build_report(parts, PRODUCTS, QUALIFICATIONS, workers=2, history=history())
+    assert serial['days'] == parallel['days'] and serial['total'] == parallel['total']
+
+
+def test_ledger_parts(tmp_path):
+    ledger = SalesLedger(str(tmp_path / "ledger.db"))
+    today = datetime.now().strftime('%m-%d')
+    for i in range(5):
+        ledger.record_sale([today, "10:00", f"客{i}", "なし", 250, 1, 1], [today, "10:00", f"客{i}", "なし", "回答1", ""])
+    parts = report_parts(ledger=ledger, chunk_rows=2)
+    assert len(parts) == 6  # 販売とアンケートそれぞれ 2+2+1 行
+    report = build_report(parts, PRODUCTS, QUALIFICATIONS, workers=1)
+    ledger.close()
+    assert report['total']['sales'] == 5 and report['total']['answers'] == {"回答1": [5]}
+
+
+def test_ledger_parts_use_recorded_dates(tmp_path):
+    ledger = SalesLedger(str(tmp_path / "ledger.db"))
+    for i, recorded in enumerate([datetime(2022, 8, 27, 10), datetime(2022, 8, 28, 10), datetime(2023, 8, 27, 10)]):
+        day = recorded.strftime('%m-%d')
+        ledger.record_sale([day, "10:00", f"客{i}", "なし", 250, 1, 1], [day, "10:00", f"客{i}", "なし", "回答1", ""],
+                           recorded)
+    parts = report_parts(ledger=ledger, chunk_rows=1)
+    assert [part['started'] for part in parts if part['table'] == 'sales'] == [
+        "2022-08-27T10:00:00", "2022-08-28T10:00:00", "2023-08-27T10:00:00"]
+    report = build_report(parts, PRODUCTS, QUALIFICATIONS, workers=1)
+    assert list(report['days']) == ["2022-08-27", "2022-08-28", "2023-08-27"]
+    # 期間外の行範囲は集計の単位に含めない
+    parts = report_parts(ledger=ledger, date_from=date(2023, 1, 1), chunk_rows=1)
+    ledger.close()
+    assert len(parts) == 2
+
+
+@pytest.mark.parametrize("extension", ["csv", "json", "html"])
+def test_write_report_formats(segments, tmp_path, extension):
+    report = build_report(report_parts(segments), PRODUCTS, QUALIFICATIONS, workers=1)
+    path = tmp_path / f"report.{extension}"
+    write_report(report, str(path))
+    text = path.read_text(encoding="utf-8")
+    assert "2024-08-28" in text
+    if extension == "json":
+        assert json.loads(text)['total']['sales'] == 3
+
+
+def test_command_line_is_read_only(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    with open(data / "products.csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=['name', 'price'])
+        writer.writeheader()
+        writer.writerows(PRODUCTS)
+    record(data, "08-27", "10:00", "なし", 450, [2, 1], "回答1")
+    before = sorted(os.listdir(data))
+    output = tmp_path / "report.json"
+    subprocess.run([sys.executable, os.path.join(REPO, "report.py"), "--dir", str(data), "--year", "2024",
+                    "--from", "2024-08-27", "--to", "2024-08-27", "--output", str(output), "--workers", "1"],
+                   check=True, capture_output=True)
+    assert sorted(os.listdir(data)) == before
+    assert json.loads(output.read_text(encoding="utf-8"))['total']['revenue'] == 450
@@ -0,0 +1,109 @@
+import csv
+import json
+import threading
+import time
+
+import pytest
+
+from PointGuiSale import SaleWriter
+
+
+def read_rows(path):
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def sale(i):
+    return ["08-27", "10:00", f"客{i}", "資格 1", 100 * i, i], ["08-27", "10:00", f"客{i}", "資格 1", "未回答", ""]
+
+
+def flush_with_timeout(writer, seconds=5):
+    """flush が戻らない場合にテストが止まらないように別スレッドで待つ"""
+    thread = threading.Thread(target=writer.flush, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    return not thread.is_alive()
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return (str(tmp_path / "log.csv"), str(tmp_path / "survey_log.csv"), str(tmp_path / "log_journal.jsonl"))
+
+
+@pytest.mark.parametrize("policy", SaleWriter.POLICIES)
+def test_records_are_written_in_order(paths, policy):
+    writer = SaleWriter(*paths, policy=policy, interval_ms=10)
+    for i in range(20):
+        writer.record(*sale(i))
+    writer.close()
+    assert [row[2] for row in read_rows(paths[0])] == [f"客{i}" for i in range(20)]
+    assert [row[4] for row in read_rows(paths[1])] == ["未回答"] * 20
+    assert open(paths[2], encoding="utf-8").read() == ""
+
+
+def test_failed_write_keeps_thread_alive_and_retries(tmp_path):
+    log_dir = tmp_path / "nodir"
+    writer = SaleWriter(str(log_dir / "log.csv"), str(tmp_path / "survey_log.csv"),
+                        str(tmp_path / "log_journal.jsonl"), policy="always")
+    writer.RETRY_SECONDS = 0.05
+    writer.record(*sale(1))
+    writer.record(*sale(2))
+    assert flush_with_timeout(writer)
+    assert writer.thread.is_alive()
+    assert writer.take_errors()
+    assert writer.pending() == 0
+    assert writer.failed() == 2
+    # 再試行を待っている販売はまだCSVにないので、flush はその件数を返す
+    assert writer.flush() == 2
+    assert writer.unfinished == 2
+    # 書き込めなかった販売はジャーナルに残っている
+    journal = json.loads(open(tmp_path / "log_journal.jsonl", encoding="utf-8").readline())
+    assert [s[0][2] for s in journal['sales']] == ["客1", "客2"]
+
+    log_dir.mkdir()
+    writer.record(*sale(3))
+    assert writer.flush() == 0
+    assert writer.unfinished == 0
+    writer.close()
+    assert [row[2] for row in read_rows(log_dir / "log.csv")] == ["客1", "客2", "客3"]
+    assert [row[2] for row in read_rows(tmp_path / "survey_log.csv")] == ["客1", "客2", "客3"]
+    assert writer.failed() == 0
+
+
+def test_replay_repairs_torn_csv_and_ignores_torn_journal_line(paths):
+    log_path, survey_path, journal_path = paths
+    with open(log_path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow(sale(0)[0])
+    with open(survey_path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow(sale(0)[1])
+    sizes = {'log_size': len(open(log_path, "rb").read()), 'survey_size': len(open(survey_path, "rb").read())}
+    # CSVへの反映の途中で止まった状態（行の途中まで書かれている）
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write("08-27,10:00,客")
+    with open(journal_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(dict(sizes, sales=[sale(1), sale(2)]), ensure_ascii=False) + "\n")
+        f.write('{"log_size": 0, "sur')  # ジャーナル自体が書きかけ
+
+    writer = SaleWriter(log_path, survey_path, journal_path)
+    writer.close()
+    assert [row[2] for row in read_rows(log_path)] == ["客0", "客1", "客2"]
+    assert [row[2] for row in read_rows(survey_path)] == ["客0", "客1", "客2"]
+    assert open(journal_path, encoding="utf-8").read() == ""
+
+
+def test_retry_without_new_sales_clears_failed(tmp_path):
+    log_dir = tmp_path / "nodir"
+    writer = SaleWriter(str(log_dir / "log.csv"), str(tmp_path / "survey_log.csv"),
+                        str(tmp_path / "log_journal.jsonl"), policy="interval", interval_ms=10)
+    writer.RETRY_SECONDS = 0.05
+    writer.record(*sale(1))
+    assert writer.flush() == 1
+    log_dir.mkdir()
+    deadline = time.monotonic() + 5
+    while writer.failed() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert writer.failed() == 0
+    assert writer.flush() == 0
+    assert writer.unfinished == 0
+    writer.close()
+    assert [row[2] for row in read_rows(log_dir / "log.csv")] == ["客1"]
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+
+from PointGuiSale import CatalogHistory, PricingEngine, SalesAggregates
+
+PRODUCTS = [{'name': "A2", 'price': "150"}, {'name': "B", 'price': "50"}]
+QUALIFICATIONS = [{'name': "なし", 'discount': "0"}, {'name': "会員", 'discount': "10"}]
+
+
+def today_at(hour, minute=0, second=0):
+    return datetime.combine(datetime.now().date(), datetime.min.time()).replace(hour=hour, minute=minute,
+                                                                                second=second)
+
+
+def change_row(when, entries):
+    return [when.strftime('%y-%m-%d'), when.strftime('%H:%M:%S')] + entries
+
+
+def new_aggregates(tmp_path, name="aggregates.json"):
+    aggregates = SalesAggregates(str(tmp_path / name))
+    aggregates.data['event_started'] = today_at(0).isoformat(timespec='seconds')
+    return aggregates
+
+
+def sale_row(engine, time_str, qualification, counts, day=None):
+    final_total = engine.price(counts, qualification)[2]
+    return [(day or datetime.now()).strftime('%m-%d'), time_str, "客", qualification, str(final_total)] + \
+        [str(count) for count in counts]
+
+
+def test_incremental_updates_match_rebuild(tmp_path):
+    engine = PricingEngine(PRODUCTS, QUALIFICATIONS)
+    rows = [sale_row(engine, "10:00", "なし", [1, 2]), sale_row(engine, "10:30", "会員", [3, 0]),
+            sale_row(engine, "11:05", "会員", [0, 1])]
+    incremental = new_aggregates(tmp_path, "incremental.json")
+    for row in rows:
+        counts = [int(count) for count in row[5:]]
+        gross, discount, final_total = engine.price(counts, row[3])
+        items = [(name, count, count * price) for name, count, price in zip(engine.names, counts, engine.prices)]
+        incremental.add_sale(row[0], row[1], row[3], items, gross, discount, final_total)
+
+    rebuilt = new_aggregates(tmp_path, "rebuilt.json")
+    rebuilt.rebuild(rows, engine)
+    assert rebuilt.data == incremental.data
+    assert rebuilt.data['products'] == {"A2": [4, 600], "B": [3, 150]}
+    assert rebuilt.data['qualifications']["会員"] == [2, 405 + 45, 45 + 5]
+    assert rebuilt.data['hours'][f"{rows[0][0]} 10時"] == [2, 250 + 405]
+
+
+def test_rebuild_skips_rows_before_the_event(tmp_path):
+    engine = PricingEngine(PRODUCTS, QUALIFICATIONS)
+    yesterday = datetime.now() - timedelta(days=1)
+    rows = [sale_row(engine, "23:00", "なし", [1, 0], day=yesterday), sale_row(engine, "09:00", "なし", [0, 1])]
+    aggregates = new_aggregates(tmp_path)
+    aggregates.rebuild(rows, engine)
+    assert aggregates.data['sales'] == 1
+    assert aggregates.data['products'] == {"B": [1, 50]}
+
+
+def test_rebuild_prices_each_sale_from_history(tmp_path):
+    history = CatalogHistory(
+        PRODUCTS, QUALIFICATIONS,
+        [change_row(today_at(0), ["A:100", "B:50"]), change_row(today_at(12, 0, 30), ["A2:150", "B:50"])],
+        [change_row(today_at(0), ["なし:0%", "会員:20%"])])
+    date_str = datetime.now().strftime('%m-%d')
+    rows = [
+        [date_str, "10:00", "客1", "会員", "80", "1", "0"],    # 改名前の A は100円、会員は20%引き
+        [date_str, "13:00", "客2", "会員", "160", "1", "1"],
+        # 時刻が読めない行は例外にせず、現在の価格表で計算する
+        [date_str, "xx", "客3", "会員", "45", "0", "1"],
+    ]
+    aggregates = new_aggregates(tmp_path)
+    aggregates.rebuild(rows, PricingEngine(PRODUCTS, QUALIFICATIONS), history)
+    assert aggregates.data['products'] == {"A": [1, 100], "A2": [1, 150], "B": [2, 100]}
+    assert aggregates.data['qualifications']["会員"] == [3, 80 + 160 + 45, 20 + 40 + 5]
+    assert aggregates.data['gross'] == 100 + 200 + 50
+
+
+def test_snapshot_round_trip(tmp_path):
+    engine = PricingEngine(PRODUCTS, QUALIFICATIONS)
+    aggregates = new_aggregates(tmp_path)
+    aggregates.rebuild([sale_row(engine, "10:00", "会員", [1, 1])], engine)
+    reloaded = SalesAggregates(str(tmp_path / "aggregates.json"))
+    assert not reloaded.needs_rebuild
+    assert reloaded.data == aggregates.data
+    assert SalesAggregates(str(tmp_path / "missing.json")).needs_rebuild
+
+
+def test_replace_keeps_event_start(tmp_path):
+    aggregates = new_aggregates(tmp_path)
+    started = aggregates.data['event_started']
+    aggregates.replace({'sales': 5, 'revenue': 500})
+    assert aggregates.data['event_started'] == started
+    assert aggregates.data['sales'] == 5
@@ -0,0 +1,144 @@
+import csv
+import sqlite3
+from datetime import datetime
+
+from PointGuiSale import LogSegments, SalesLedger, append_csv_rows, row_datetime
+
+
+def sale(i):
+    return ["08-27", "10:00", f"客{i}", "資格 1", str(100 * i), str(i)]
+
+
+def survey(i):
+    return ["08-27", "10:00", f"客{i}", "資格 1", "未回答", ""]
+
+
+def read_names(path):
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        return [row[2] for row in csv.reader(f) if row]
+
+
+def record_csv(directory, i):
+    append_csv_rows(str(directory / "log.csv"), [sale(i)])
+    append_csv_rows(str(directory / "survey_log.csv"), [survey(i)])
+
+
+def open_ledger(directory):
+    segments = LogSegments(str(directory / "logs"), active_dir=str(directory))
+    ledger = SalesLedger(str(directory / "ledger.db"))
+    ledger.sync_csv(str(directory), segments)
+    return ledger, segments
+
+
+def test_round_trip_between_csv_and_sqlite_keeps_every_sale(tmp_path):
+    record_csv(tmp_path, 1)
+    ledger, _ = open_ledger(tmp_path)
+    ledger.record_sale(sale(2), survey(2))
+    ledger.close()
+
+    # CSVに戻すと台帳で記録した販売が書き出される
+    ledger, _ = open_ledger(tmp_path)
+    ledger.close()
+    assert read_names(tmp_path / "log.csv") == ["客1", "客2"]
+    record_csv(tmp_path, 3)
+
+    # もう1度SQLiteにするとCSVで記録した販売が取り込まれる（重複はしない）
+    ledger, _ = open_ledger(tmp_path)
+    assert [row[2] for row in ledger.iter_rows('sales')] == ["客1", "客2", "客3"]
+    assert [row[2] for row in ledger.iter_rows('surveys')] == ["客1", "客2", "客3"]
+    joined = ledger.recent_sales(3)
+    assert [(s[2], v[2]) for s, v in joined] == [("客3", "客3"), ("客2", "客2"), ("客1", "客1")]
+    ledger.close()
+    assert read_names(tmp_path / "log.csv") == ["客1", "客2", "客3"]
+
+
+def test_delta_import_skips_closed_segments(tmp_path):
+    for i in range(3):
+        record_csv(tmp_path, i)
+    ledger, segments = open_ledger(tmp_path)
+    ledger.close()
+    segments.rotate()
+    record_csv(tmp_path, 3)
+    assert list(segments.iter_rows_from('sales', 3)) == [sale(3)]
+    assert [row for _, row in segments.iter_rows_with_start('sales', 2)] == [sale(2), sale(3)]
+    assert segments.count_rows('sales') == 4
+
+    ledger, _ = open_ledger(tmp_path)
+    assert [row[2] for row in ledger.iter_rows('sales')] == ["客0", "客1", "客2", "客3"]
+    ledger.close()
+
+
+def test_legacy_one_time_import_is_not_repeated(tmp_path):
+    record_csv(tmp_path, 1)
+    ledger = SalesLedger(str(tmp_path / "ledger.db"))
+    ledger.record_sale(sale(1), survey(1))
+    ledger.close()
+    conn = sqlite3.connect(str(tmp_path / "ledger.db"))
+    with conn:
+        conn.execute("INSERT INTO meta (key, value) VALUES ('csv_imported', '2024-08-27T10:00:00')")
+    conn.close()
+
+    ledger, _ = open_ledger(tmp_path)
+    assert ledger.count('sales') == 1
+    ledger.close()
+    assert read_names(tmp_path / "log.csv") == ["客1"]
+
+
+def test_append_csv_rows_repairs_missing_newline(tmp_path):
+    path = tmp_path / "log.csv"
+    path.write_text("08-27,10:00,客0,資格 1,0,0", encoding="utf-8")
+    append_csv_rows(str(path), [sale(1)])
+    assert read_names(path) == ["客0", "客1"]
+
+
+def test_recorded_datetime_keeps_the_year(tmp_path):
+    ledger = SalesLedger(str(tmp_path / "ledger.db"))
+    recorded = datetime(2023, 12, 31, 23, 50)
+    ledger.record_sale(sale(1), survey(1), recorded)
+    # 日付・時刻の列は記録日時から作る
+    assert [row[:2] for row in ledger.iter_rows('sales')] == [["12-31", "23:50"]]
+    assert [started for started, _ in ledger.iter_rows_with_start('sales')] == [recorded]
+    assert [started for started, _ in ledger.iter_rows_with_start('surveys')] == [recorded]
+    ledger.close()
+
+
+def test_old_ledger_gets_recorded_column_walking_back_from_today(tmp_path):
+    path = str(tmp_path / "ledger.db")
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executescript("""
+            CREATE TABLE sales (id INTEGER PRIMARY KEY, date TEXT, time TEXT, name TEXT,
+                                qualification TEXT, total INTEGER, products TEXT);
+            CREATE TABLE surveys (id INTEGER PRIMARY KEY, sale_id INTEGER, date TEXT, time TEXT, name TEXT,
+                                  qualification TEXT, survey TEXT, remarks TEXT);
+            INSERT INTO sales (date, time, name, qualification, total, products)
+                VALUES ('12-30', '10:00', '客1', 'なし', 100, '[1]'), ('01-02', '09:00', '客2', 'なし', 100, '[1]');
+        """)
+    conn.close()
+
+    ledger = SalesLedger(path)
+    last = row_datetime("01-02", "09:00", datetime.now())
+    assert [started for started, _ in ledger.iter_rows_with_start('sales')] == [
+        datetime(last.year - 1, 12, 30, 10, 0), last]
+    ledger.close()
+
+
+def test_imported_surveys_pair_with_sales_by_key(tmp_path):
+    # 客1 のアンケート結果だけ書き込めなかった場合も、客2 のアンケート結果は客2 の販売と結びつく
+    append_csv_rows(str(tmp_path / "log.csv"), [sale(1), sale(2)])
+    append_csv_rows(str(tmp_path / "survey_log.csv"), [survey(2)])
+    ledger, _ = open_ledger(tmp_path)
+    assert [(s[2], v[2]) for s, v in ledger.recent_sales(2)] == [("客2", "客2")]
+    ledger.close()
+
+
+def test_csv_mode_only_syncs_when_the_ledger_has_new_rows(tmp_path):
+    record_csv(tmp_path, 1)
+    ledger, _ = open_ledger(tmp_path)
+    assert not ledger.needs_csv_export()
+    ledger.record_sale(sale(2), survey(2))
+    assert ledger.needs_csv_export()
+    ledger.close()
+    ledger, _ = open_ledger(tmp_path)
+    assert not ledger.needs_csv_export()
+    ledger.close()
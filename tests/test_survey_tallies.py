@@ -0,0 +1,71 @@
+import json
+
+from PointGuiSale import SurveyTallies
+
+
+def answer(response, qualification="資格 1", time_str="10:05"):
+    return ["08-27", time_str, "客", qualification, response, ""]
+
+
+ROWS = [answer("良い"), answer("良い", "資格 2", "11:30"), answer("普通", "資格 2", "11:45"), ["08-27", "10:00"]]
+
+
+def test_counts_with_cross_tabs(tmp_path):
+    tallies = SurveyTallies(str(tmp_path / "survey_tallies.json"))
+    assert tallies.needs_rebuild
+    tallies.rebuild(ROWS)
+    assert not tallies.needs_rebuild
+    assert tallies.data['total'] == 3  # 短い行は数えない
+    assert tallies.data['answers'] == {"良い": 2, "普通": 1}
+    assert tallies.data['qualifications'] == {"資格 1": {"良い": 1}, "資格 2": {"良い": 1, "普通": 1}}
+    assert tallies.data['hours'] == {"10時": {"良い": 1}, "11時": {"良い": 1, "普通": 1}}
+
+
+def test_incremental_add_matches_rebuild_and_is_saved(tmp_path):
+    path = str(tmp_path / "survey_tallies.json")
+    incremental = SurveyTallies(path)
+    incremental.reset()
+    for row in ROWS:
+        incremental.add(row)
+    rebuilt = SurveyTallies(str(tmp_path / "rebuilt.json"))
+    rebuilt.rebuild(ROWS)
+    assert incremental.data == rebuilt.data
+    reopened = SurveyTallies(path)
+    assert not reopened.needs_rebuild
+    assert reopened.data == incremental.data
+
+
+def test_rename_survives_rebuild(tmp_path):
+    path = str(tmp_path / "survey_tallies.json")
+    tallies = SurveyTallies(path)
+    tallies.rebuild(ROWS)
+    tallies.rename("良い", "とても良い")
+    tallies.rename("とても良い", "最高")
+    assert tallies.data['answers'] == {"最高": 2, "普通": 1}
+    assert tallies.data['hours']["11時"] == {"最高": 1, "普通": 1}
+    # 別名は保存され、履歴から数え直しても変更後の名前で数える
+    assert json.load(open(path, encoding="utf-8"))['aliases'] == {"良い": "最高", "とても良い": "最高"}
+    reopened = SurveyTallies(path)
+    reopened.rebuild(ROWS + [answer("とても良い")])
+    assert reopened.data['answers'] == {"最高": 3, "普通": 1}
+
+
+def test_renaming_back_drops_the_alias(tmp_path):
+    tallies = SurveyTallies(str(tmp_path / "survey_tallies.json"))
+    tallies.rebuild(ROWS)
+    tallies.rename("普通", "まあまあ")
+    tallies.rename("まあまあ", "普通")
+    assert tallies.aliases == {"まあまあ": "普通"}
+    assert tallies.data['answers'] == {"良い": 2, "普通": 1}
+    assert tallies.ordered_answers(["普通", "良い", "悪い"]) == ["普通", "良い", "悪い"]
+
+
+def test_debounced_save(tmp_path):
+    scheduled = []
+    path = tmp_path / "survey_tallies.json"
+    tallies = SurveyTallies(str(path), after=lambda ms, func: scheduled.append(func))
+    tallies.add(answer("良い"))
+    tallies.add(answer("良い"))
+    assert len(scheduled) == 1 and not path.exists()
+    scheduled[0]()
+    assert json.loads(path.read_text(encoding="utf-8"))['total'] == 2
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import threading
+import time
+
+from PointGuiSale import SyncClient
+from sync_server import MergedLedger, SyncServer
+
+
+class ServerThread:
+    """テスト用に別スレッドのイベントループで待ち受ける（handler はそのスレッドで作る）"""
+
+    def __init__(self, make_handler):
+        self.make_handler = make_handler
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=lambda: asyncio.run(self.main()), daemon=True)
+        self.thread.start()
+        self.ready.wait(5)
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop = asyncio.Event()
+        server = await asyncio.start_server(self.make_handler(), "127.0.0.1", 0)
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        async with server:
+            await self.stop.wait()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.stop.set)
+        self.thread.join(5)
+
+
+def wait_until(condition, seconds=5):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+async def exchange(port, messages):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    replies = []
+    for message in messages:
+        writer.write((json.dumps(message) + "\n").encode("utf-8"))
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), 5)
+        replies.append(json.loads(line) if line else None)
+    writer.close()
+    return replies
+
+
+def test_server_rejects_messages_before_hello(tmp_path):
+    path = str(tmp_path / "sync_ledger.db")
+    server = ServerThread(lambda: SyncServer(MergedLedger(path)).handle)
+    try:
+        sale = {'id': "R1-1", 'register': "R1", 'recorded': "2024-08-27T10:00:00", 'log': [], 'survey': []}
+        replies = asyncio.run(exchange(server.port, [{'type': 'sales', 'sales': [sale]}]))
+        assert replies[0]['type'] == 'error'
+        replies = asyncio.run(exchange(server.port, [{'type': 'catalog', 'catalog': {}}]))
+        assert replies[0]['type'] == 'error'
+    finally:
+        server.close()
+    ledger = MergedLedger(path)
+    assert ledger.conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0] == 0
+    assert ledger.latest_catalog() == (0, None)
+
+
+def test_catalog_edit_survives_dropped_connection(tmp_path, monkeypatch):
+    monkeypatch.setattr(SyncClient, "RETRY_SECONDS", 0.05)
+    received = []
+
+    async def drop_after_catalog(reader, writer):
+        # 変更を受け取ったところで ack を返さずに切断する
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if message['type'] == 'catalog':
+                received.append(message['catalog'])
+                break
+        writer.close()
+
+    dropping = ServerThread(lambda: drop_after_catalog)
+    client = SyncClient("R1", f"127.0.0.1:{dropping.port}", str(tmp_path / "sync_outbox.jsonl"))
+    client.push_catalog({'products': ["A"]})
+    client.start()
+    try:
+        assert wait_until(lambda: received)
+        assert client.pending_catalog == {'products': ["A"]}
+        dropping.close()
+
+        path = str(tmp_path / "sync_ledger.db")
+        server = ServerThread(lambda: SyncServer(MergedLedger(path)).handle)
+        client.port = server.port
+        try:
+            assert wait_until(lambda: client.pending_catalog is None)
+            assert MergedLedger(path).latest_catalog() == (1, {'products': ["A"]})
+        finally:
+            server.close()
+    finally:
+        client.close()